@@ -0,0 +1,145 @@
+"""
+取数路径基准测试
+在合成的 sales 表上对比纯Python与C扩展连接、字典游标与元组/raw游标的取数吞吐量（行/秒）
+
+需要可写的MySQL库，连接参数与 mysql_server.py 相同（DB_HOST/DB_USER/DB_PASSWORD/DB_NAME）。
+用法: python benchmarks/bench_fetch_paths.py [--rows 200000] [--repeat 3] [--drop]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mysql.connector
+from mysql_server import DB_CONFIG, _build_row_converter
+
+TABLE = "bench_sales"
+
+CREATE_TABLE = f"""
+CREATE TABLE IF NOT EXISTS `{TABLE}` (
+  `sale_id` int NOT NULL AUTO_INCREMENT,
+  `product_id` int NOT NULL,
+  `quantity` int NOT NULL,
+  `total_price` decimal(10, 2) NOT NULL,
+  `sale_date` date NOT NULL,
+  `customer_name` varchar(100) NULL DEFAULT NULL,
+  `salesperson` varchar(100) NULL DEFAULT NULL,
+  PRIMARY KEY (`sale_id`)
+) ENGINE = InnoDB CHARACTER SET = utf8mb4
+"""
+
+CUSTOMERS = ["张三", "李四", "王五", "赵六", "钱七", "孙八", "周九", "吴十"]
+SALESPEOPLE = ["张明", "李军", "王芳", "赵强"]
+
+
+def prepare_table(rows):
+    """建表并填充到指定行数，已有数据量一致时直接复用"""
+    conn = mysql.connector.connect(**DB_CONFIG)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(CREATE_TABLE)
+        cursor.execute(f"SELECT COUNT(*) FROM `{TABLE}`")
+        if cursor.fetchone()[0] == rows:
+            return
+        cursor.execute(f"TRUNCATE TABLE `{TABLE}`")
+        rng = random.Random(42)
+        start = date(2024, 1, 1)
+        insert = (f"INSERT INTO `{TABLE}` (product_id, quantity, total_price, sale_date, customer_name, salesperson) "
+                  "VALUES (%s, %s, %s, %s, %s, %s)")
+        batch = []
+        for _ in range(rows):
+            quantity = rng.randint(1, 20)
+            batch.append((
+                rng.randint(1, 10),
+                quantity,
+                round(rng.uniform(100, 6000) * quantity, 2),
+                start + timedelta(days=rng.randint(0, 450)),
+                rng.choice(CUSTOMERS),
+                rng.choice(SALESPEOPLE)
+            ))
+            if len(batch) == 5000:
+                cursor.executemany(insert, batch)
+                batch = []
+        if batch:
+            cursor.executemany(insert, batch)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def fetch_dict(conn):
+    # 改造前的路径：字典游标
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute(f"SELECT * FROM `{TABLE}`")
+    rows = cursor.fetchall()
+    cursor.close()
+    return len(rows)
+
+
+def fetch_tuple(conn):
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT * FROM `{TABLE}`")
+    convert = _build_row_converter(cursor.description)
+    rows = [convert(row) for row in cursor.fetchall()]
+    cursor.close()
+    return len(rows)
+
+
+def fetch_raw(conn):
+    cursor = conn.cursor(raw=True)
+    cursor.execute(f"SELECT * FROM `{TABLE}`")
+    convert = _build_row_converter(cursor.description, raw=True)
+    rows = [convert(row) for row in cursor.fetchall()]
+    cursor.close()
+    return len(rows)
+
+
+PATHS = [
+    ("字典游标", fetch_dict),
+    ("元组游标+类型转换", fetch_tuple),
+    ("raw游标+文本转换", fetch_raw)
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="取数路径基准测试")
+    parser.add_argument("--rows", type=int, default=200000, help="合成表的行数")
+    parser.add_argument("--repeat", type=int, default=3, help="每种路径的重复次数，取最好成绩")
+    parser.add_argument("--drop", action="store_true", help="测试结束后删除合成表")
+    args = parser.parse_args()
+
+    prepare_table(args.rows)
+    implementations = [("纯Python", True)]
+    if mysql.connector.HAVE_CEXT:
+        implementations.append(("C扩展", False))
+    else:
+        print("未安装C扩展，只测试纯Python实现")
+
+    print(f"表 {TABLE}: {args.rows} 行，取{args.repeat}次中的最好成绩")
+    for impl_name, use_pure in implementations:
+        conn = mysql.connector.connect(**dict(DB_CONFIG, use_pure=use_pure))
+        try:
+            for path_name, func in PATHS:
+                best = float("inf")
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    count = func(conn)
+                    best = min(best, time.perf_counter() - start)
+                print(f"{impl_name:<8} {path_name:<12} {count / best:12,.0f} 行/秒")
+        finally:
+            conn.close()
+
+    if args.drop:
+        conn = mysql.connector.connect(**DB_CONFIG)
+        try:
+            conn.cursor().execute(f"DROP TABLE IF EXISTS `{TABLE}`")
+        finally:
+            conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+结果转换基准测试
+对比旧的 json.loads(json.dumps(..., default=json_serialize)) 往返方式
+与按列类型构建的单遍行转换函数在 sales 表结构上的吞吐量
+
+用法: python benchmarks/bench_row_converter.py [行数] [重复次数]
+"""
+import json
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mysql.connector import FieldType
+from mysql_server import _build_row_converter
+
+# 与 sales.sql 中 sales 表一致的列及类型码，形如游标的description
+SALES_DESCRIPTION = [
+    ("sale_id", FieldType.LONG, None, None, None, None, 0, 0, 63),
+    ("product_id", FieldType.LONG, None, None, None, None, 0, 0, 63),
+    ("quantity", FieldType.LONG, None, None, None, None, 0, 0, 63),
+    ("total_price", FieldType.NEWDECIMAL, None, None, None, None, 0, 0, 63),
+    ("sale_date", FieldType.DATE, None, None, None, None, 0, 0, 63),
+    ("customer_name", FieldType.VAR_STRING, None, None, None, None, 1, 0, 45),
+    ("salesperson", FieldType.VAR_STRING, None, None, None, None, 1, 0, 45)
+]
+
+CUSTOMERS = ["张三", "李四", "王五", "赵六", "钱七", "孙八", "周九", "吴十"]
+SALESPEOPLE = ["张明", "李军", "王芳", "赵强"]
+
+
+def legacy_json_serialize(obj):
+    """改造前的序列化函数，保留用于对比"""
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    elif hasattr(obj, 'decimal') or str(type(obj)) == "<class 'decimal.Decimal'>":
+        return float(obj)
+    raise TypeError(f"Object of type {type(obj)} is not JSON serializable")
+
+
+def make_rows(count):
+    """生成模拟的sales元组行"""
+    rng = random.Random(42)
+    start = date(2024, 1, 1)
+    rows = []
+    for sale_id in range(1, count + 1):
+        quantity = rng.randint(1, 20)
+        rows.append((
+            sale_id,
+            rng.randint(1, 10),
+            quantity,
+            Decimal(f"{rng.uniform(100, 6000) * quantity:.2f}"),
+            start + timedelta(days=rng.randint(0, 450)),
+            rng.choice(CUSTOMERS),
+            rng.choice(SALESPEOPLE)
+        ))
+    return rows
+
+
+def run_legacy(rows):
+    # 旧路径：字典游标产生的字典行，再做一次JSON往返
+    names = [column[0] for column in SALES_DESCRIPTION]
+    dict_rows = [dict(zip(names, row)) for row in rows]
+    return json.loads(json.dumps(dict_rows, default=legacy_json_serialize))
+
+
+def run_converter(rows):
+    convert = _build_row_converter(SALES_DESCRIPTION)
+    return [convert(row) for row in rows]
+
+
+def measure(func, rows, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(rows)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    rows = make_rows(count)
+
+    assert run_legacy(rows[:100]) == run_converter(rows[:100]), "两种转换方式的结果不一致"
+
+    legacy = measure(run_legacy, rows, repeat)
+    converter = measure(run_converter, rows, repeat)
+    print(f"行数: {count}, 取{repeat}次中的最好成绩")
+    print(f"json往返:   {legacy * 1000:8.1f} ms  {count / legacy:12,.0f} 行/秒")
+    print(f"单遍转换:   {converter * 1000:8.1f} ms  {count / converter:12,.0f} 行/秒")
+    print(f"加速比:     {legacy / converter:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
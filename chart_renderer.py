@@ -0,0 +1,209 @@
+"""
+图表渲染
+在独立的工作进程中用matplotlib的面向对象API（Figure + Agg画布）渲染图表，不使用pyplot的全局状态
+"""
+import asyncio
+import base64
+import functools
+import io
+import logging
+import multiprocessing
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Sequence
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+logger = logging.getLogger('mysql_mcp_server')
+
+CHART_TYPES = ("bar", "line", "scatter", "pie")
+# 折线图点数超过该值时不再绘制点标记，只画线
+LINE_MARKER_MAX_POINTS = 100
+# 散点图按每个点代表的行数缩放标记面积的范围
+SCATTER_MIN_SIZE = 4
+SCATTER_MAX_SIZE = 120
+
+_ISO_DATE_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}([T ]\d{2}:\d{2}(:\d{2}(\.\d+)?)?)?$")
+
+
+def is_iso_date(value: Any) -> bool:
+    """判断值是否为ISO格式的日期或时间文本（查询结果中的DATE/DATETIME列转换后的形式）"""
+    return isinstance(value, str) and bool(_ISO_DATE_PATTERN.match(value))
+
+
+def _as_dates(values: List[Any]) -> Optional[List[Any]]:
+    """x值全部是ISO日期文本时转换为datetime，使折线图和散点图使用时间轴而不是类别轴"""
+    if not values or not all(value is None or is_iso_date(value) for value in values):
+        return None
+    return [None if value is None else datetime.fromisoformat(value) for value in values]
+
+
+def lttb_indices(xs: Sequence[float], ys: Sequence[float], threshold: int) -> List[int]:
+    """Largest-Triangle-Three-Buckets降采样，返回保留的点的下标
+
+    首尾两点固定保留，其余点均分为threshold - 2个桶，每个桶中选出与上一个保留点、
+    下一个桶的平均点构成三角形面积最大的点。峰谷等形状特征会被保留，
+    不像按桶取平均那样被抹平。xs需要已按升序排列。threshold小于3时不足以分桶，只保留首尾两点（或首点）。
+    """
+    n = len(xs)
+    if threshold >= n:
+        return list(range(n))
+    if threshold < 3:
+        return [0, n - 1][:max(threshold, 1)]
+    every = (n - 2) / (threshold - 2)
+    keep = [0]
+    a = 0
+    for i in range(threshold - 2):
+        # 下一个桶的平均点
+        next_start = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        count = next_end - next_start
+        avg_x = sum(xs[next_start:next_end]) / count
+        avg_y = sum(ys[next_start:next_end]) / count
+        # 当前桶中选出面积最大的点
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        ax, ay = xs[a], ys[a]
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        keep.append(best)
+        a = best
+    keep.append(n - 1)
+    return keep
+
+
+def render_chart(x_values: List[Any], y_values: List[Any], x_column: str, y_column: str,
+                 chart_type: str, sizes: Optional[List[int]] = None) -> str:
+    """渲染图表并返回Base64编码的PNG
+
+    每次调用创建独立的Figure，不注册到pyplot的图形管理器，函数返回后即可被回收，
+    提前抛出异常也不会残留未关闭的图形。sizes为散点图每个点代表的行数（分桶聚合后），
+    用于按比例缩放标记面积。
+    """
+    if chart_type not in CHART_TYPES:
+        raise ValueError(f"不支持的图表类型: {chart_type}")
+    figure = Figure(figsize=(10, 6))
+    FigureCanvasAgg(figure)
+    ax = figure.add_subplot()
+
+    if chart_type == "bar":
+        ax.bar(x_values, y_values)
+        ax.set_title(f"{y_column} by {x_column}")
+    elif chart_type == "line":
+        x_values = _as_dates(x_values) or x_values
+        ax.plot(x_values, y_values, marker='o' if len(x_values) <= LINE_MARKER_MAX_POINTS else None)
+        ax.set_title(f"{y_column} vs {x_column}")
+    elif chart_type == "scatter":
+        x_values = _as_dates(x_values) or x_values
+        if sizes:
+            largest = max(sizes)
+            scaled = [max(SCATTER_MIN_SIZE, SCATTER_MAX_SIZE * size / largest) for size in sizes]
+            ax.scatter(x_values, y_values, s=scaled, alpha=0.6)
+        else:
+            ax.scatter(x_values, y_values)
+        ax.set_title(f"{y_column} vs {x_column} (Scatter)")
+    else:
+        ax.pie(y_values, labels=x_values, autopct='%1.1f%%')
+        ax.set_title(f"Distribution of {y_column}")
+
+    ax.set_xlabel(x_column)
+    ax.set_ylabel(y_column)
+    ax.tick_params(axis="x", labelrotation=45)
+    figure.tight_layout()
+
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format='png')
+    return base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+class ChartRenderer:
+    """图表渲染进程池
+
+    渲染是CPU密集的纯Python/C计算，放在事件循环或线程池中会占用GIL、拖慢其他工具调用；
+    这里交给独立的工作进程并行渲染。进程池在首次渲染时才创建，使用spawn方式启动，
+    不会通过fork复制主进程中已持有的连接、线程和锁。工作进程异常退出导致进程池损坏时，下次渲染会重建进程池。
+
+    注意spawn的工作进程启动时会以__mp_main__的名义重新执行启动脚本（python mysql_server.py）中
+    __main__判断之外的模块级代码：导入pandas、mysql.connector和FastMCP，创建连接池、执行器等单例并配置日志。
+    这些单例都是惰性的，工作进程中不会建立数据库连接或启动线程，但每个工作进程都要多付出这部分导入时间
+    （约一两秒）和内存。进程池在整个服务器生命周期内复用，这部分开销只在工作进程启动时付出一次。
+    """
+
+    def __init__(self, max_workers: int = 2):
+        self.max_workers = max(1, max_workers)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._inflight = 0
+        self._stats = {
+            "rendered": 0,
+            "failures": 0,
+            "pool_restarts": 0,
+            "total_render_seconds": 0.0
+        }
+
+    def _pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    def _reset(self, executor: ProcessPoolExecutor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+                self._stats["pool_restarts"] += 1
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    async def render(self, x_values: List[Any], y_values: List[Any], x_column: str, y_column: str,
+                     chart_type: str, sizes: Optional[List[int]] = None) -> str:
+        """在工作进程中渲染图表，返回Base64编码的PNG"""
+        executor = self._pool()
+        loop = asyncio.get_running_loop()
+        start = time.monotonic()
+        self._inflight += 1
+        try:
+            image = await loop.run_in_executor(
+                executor, functools.partial(render_chart, x_values, y_values, x_column, y_column, chart_type, sizes)
+            )
+        except BrokenProcessPool:
+            logger.error("图表渲染进程异常退出，将在下次渲染时重建进程池")
+            self._stats["failures"] += 1
+            self._reset(executor)
+            raise
+        except Exception:
+            self._stats["failures"] += 1
+            raise
+        finally:
+            self._inflight -= 1
+        self._stats["rendered"] += 1
+        self._stats["total_render_seconds"] += time.monotonic() - start
+        return image
+
+    def stats(self) -> Dict[str, Any]:
+        """返回渲染进程池的运行统计"""
+        rendered = self._stats["rendered"]
+        return {
+            "max_workers": self.max_workers,
+            "started": self._executor is not None,
+            "inflight": self._inflight,
+            "rendered": rendered,
+            "failures": self._stats["failures"],
+            "pool_restarts": self._stats["pool_restarts"],
+            "avg_render_ms": round(self._stats["total_render_seconds"] / rendered * 1000, 3) if rendered else 0.0
+        }
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,280 @@
+"""
+Excel流式读取工具
+供read_file_server.py和mysql_server.py共用：按块读取工作表，并推断各列对应的MySQL列类型
+"""
+import os
+import queue
+import re
+import threading
+from datetime import datetime, date, time, timedelta
+from decimal import Decimal
+from typing import Dict, List, Any, Iterable, Iterator, Optional, Union
+
+import openpyxl
+import pandas as pd
+
+EXCEL_SUFFIXES = ('.xls', '.xlsx', '.xlsm', '.xlsb')
+# openpyxl只支持OOXML格式，其余格式退回pandas读取
+STREAMING_SUFFIXES = ('.xlsx', '.xlsm')
+
+# MySQL标识符的最大长度
+MAX_IDENTIFIER_LENGTH = 64
+INT_RANGE = (-2 ** 31, 2 ** 31 - 1)
+BIGINT_RANGE = (-2 ** 63, 2 ** 63 - 1)
+# utf8mb4下VARCHAR(255)可以建索引；TEXT最多65535字节，按每字符4字节计算可容纳的字符数
+VARCHAR_MAX_CHARS = 255
+TEXT_MAX_CHARS = 65535 // 4
+
+
+def normalize_column_names(header: Iterable[Any]) -> List[str]:
+    """把表头转换为可用作MySQL列名的名字
+
+    空表头补为column_N，空白替换为下划线，超长的截断到64个字符；
+    MySQL列名不区分大小写，重复的名字（忽略大小写）依次追加_2、_3等后缀。
+    """
+    names = []
+    seen = set()
+    for index, value in enumerate(header, 1):
+        name = re.sub(r"\s+", "_", str(value).strip()) if value is not None else ""
+        name = name[:MAX_IDENTIFIER_LENGTH] or f"column_{index}"
+        candidate, suffix = name, 2
+        while candidate.lower() in seen:
+            candidate = f"{name[:MAX_IDENTIFIER_LENGTH - len(str(suffix)) - 1]}_{suffix}"
+            suffix += 1
+        seen.add(candidate.lower())
+        names.append(candidate)
+    return names
+
+
+def _plain_value(value):
+    """把pandas读出的值转换为普通Python值：缺失值为None，Timestamp为datetime"""
+    if value is None:
+        return None
+    if isinstance(value, pd.Timestamp):
+        return None if pd.isna(value) else value.to_pydatetime()
+    if isinstance(value, float) and value != value:
+        return None
+    if hasattr(value, "item") and not isinstance(value, (str, bytes)):
+        # numpy标量
+        return value.item()
+    return value
+
+
+class SheetReader:
+    """按块流式读取一个工作表，第一个非空行作为表头
+
+    .xlsx/.xlsm使用openpyxl只读模式边解析边产出行，内存占用与工作表大小无关；
+    .xls/.xlsb openpyxl不支持，退回pandas一次读入后再分块产出。
+    全空的行会被跳过，每行补齐或截断到表头的列数。
+    """
+
+    def __init__(self, file_path: str, sheet_name: Optional[Union[str, int]] = 0):
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"文件不存在: {file_path}")
+        if not file_path.lower().endswith(EXCEL_SUFFIXES):
+            raise ValueError(f"文件不是Excel格式: {file_path}")
+        self.file_path = file_path
+        self.rows_read = 0
+        self._workbook = None
+        if file_path.lower().endswith(STREAMING_SUFFIXES):
+            self._workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+            self.sheet_names = self._workbook.sheetnames
+            try:
+                sheet = (self._workbook.worksheets[sheet_name] if isinstance(sheet_name, int)
+                         else self._workbook[sheet_name])
+            except (IndexError, KeyError):
+                self.close()
+                raise ValueError(f"工作表不存在: {sheet_name}，可用的工作表: {self.sheet_names}")
+            self.sheet_name = sheet.title
+            self._rows = sheet.iter_rows(values_only=True)
+        else:
+            xl = pd.ExcelFile(file_path)
+            self.sheet_names = xl.sheet_names
+            df = pd.read_excel(xl, sheet_name=sheet_name, header=None, dtype=object)
+            self.sheet_name = sheet_name if isinstance(sheet_name, str) else self.sheet_names[sheet_name]
+            self._rows = (tuple(_plain_value(value) for value in row)
+                          for row in df.itertuples(index=False, name=None))
+
+        header = next(self._non_empty_rows(), None)
+        if header is None:
+            self.close()
+            raise ValueError(f"工作表 {self.sheet_name} 没有数据")
+        header = list(header)
+        # 去掉表头右侧的空单元格，避免把格式化过的空白列当作数据列
+        while header and header[-1] is None:
+            header.pop()
+        self.columns = normalize_column_names(header)
+
+    def _non_empty_rows(self) -> Iterator[tuple]:
+        for row in self._rows:
+            if row and any(value is not None for value in row):
+                yield row
+
+    def chunks(self, chunk_rows: int = 1000) -> Iterator[List[tuple]]:
+        """依次产出数据行的列表，每块最多chunk_rows行"""
+        width = len(self.columns)
+        padding = (None,) * width
+        chunk = []
+        for row in self._non_empty_rows():
+            if len(row) != width:
+                row = tuple(row[:width]) + padding[len(row):]
+            chunk.append(row)
+            if len(chunk) >= chunk_rows:
+                self.rows_read += len(chunk)
+                yield chunk
+                chunk = []
+        if chunk:
+            self.rows_read += len(chunk)
+            yield chunk
+
+    def close(self):
+        if self._workbook is not None:
+            self._workbook.close()
+            self._workbook = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def prefetch(iterable: Iterable[Any], depth: int = 2) -> Iterator[Any]:
+    """在后台线程中提前读取后续元素，让Excel解析与调用方的处理（如写入数据库）重叠进行
+
+    生成器被关闭（包括调用方提前退出循环后被回收）时通知后台线程停止并等待其退出。
+    后台线程中的异常会在调用方取到对应位置时重新抛出。
+    """
+    items = queue.Queue(maxsize=max(1, depth))
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((True, item)):
+                    return
+            put((False, None))
+        except BaseException as e:
+            put((False, e))
+
+    thread = threading.Thread(target=produce, name="excel-prefetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            has_item, item = items.get()
+            if not has_item:
+                if item is not None:
+                    raise item
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _column_type(kinds: set, max_int: int, min_int: int, max_chars: int, all_midnight: bool) -> str:
+    """根据一列中出现过的值类型选择MySQL列类型，无法统一为数值或时间类型时使用字符串类型"""
+    if not kinds:
+        return f"VARCHAR({VARCHAR_MAX_CHARS})"
+    if kinds <= {bool}:
+        return "TINYINT(1)"
+    if kinds <= {bool, int}:
+        if INT_RANGE[0] <= min_int and max_int <= INT_RANGE[1]:
+            return "INT"
+        if BIGINT_RANGE[0] <= min_int and max_int <= BIGINT_RANGE[1]:
+            return "BIGINT"
+        return "DECIMAL(65,0)"
+    if kinds <= {bool, int, float, Decimal}:
+        return "DOUBLE"
+    if kinds <= {date}:
+        return "DATE"
+    if kinds <= {datetime, date}:
+        return "DATE" if all_midnight else "DATETIME"
+    if kinds <= {time, timedelta}:
+        return "TIME"
+    if max_chars <= VARCHAR_MAX_CHARS:
+        return f"VARCHAR({VARCHAR_MAX_CHARS})"
+    if max_chars <= TEXT_MAX_CHARS:
+        return "TEXT"
+    return "MEDIUMTEXT"
+
+
+def infer_column_types(columns: List[str], rows: Iterable[tuple]) -> List[Dict[str, Any]]:
+    """根据样本行推断每一列的MySQL类型
+
+    Returns:
+        每列一个字典：name、mysql_type、sampled（样本中的非空值数）、null_count、python_types
+    """
+    width = len(columns)
+    kinds = [set() for _ in range(width)]
+    max_int = [0] * width
+    min_int = [0] * width
+    max_chars = [0] * width
+    all_midnight = [True] * width
+    null_count = [0] * width
+    sampled = [0] * width
+    for row in rows:
+        for index, value in enumerate(row):
+            if value is None:
+                null_count[index] += 1
+                continue
+            sampled[index] += 1
+            kind = type(value)
+            # datetime是date的子类，需要先判断
+            if isinstance(value, datetime):
+                kind = datetime
+                if all_midnight[index] and value.time() != time(0):
+                    all_midnight[index] = False
+            elif isinstance(value, bool):
+                kind = bool
+            elif isinstance(value, int):
+                kind = int
+                max_int[index] = max(max_int[index], value)
+                min_int[index] = min(min_int[index], value)
+            elif isinstance(value, float):
+                kind = float
+            kinds[index].add(kind)
+            max_chars[index] = max(max_chars[index], len(value) if isinstance(value, str) else len(str(value)))
+    return [
+        {
+            "name": name,
+            "mysql_type": _column_type(kinds[i], max_int[i], min_int[i], max_chars[i], all_midnight[i]),
+            "sampled": sampled[i],
+            "null_count": null_count[i],
+            "python_types": sorted(kind.__name__ for kind in kinds[i])
+        }
+        for i, name in enumerate(columns)
+    ]
+
+
+def quote_identifier(name: str) -> str:
+    """用反引号引用标识符"""
+    return "`" + name.replace("`", "``") + "`"
+
+
+def create_table_sql(table_name: str, column_types: List[Dict[str, Any]],
+                     primary_key: Optional[str] = None) -> str:
+    """生成建表语句
+
+    指定primary_key时以该列为主键（NOT NULL）；否则添加自增的id列（与数据列重名时为_row_id）作为主键，
+    使InnoDB按插入顺序追加聚簇索引页。二级索引不在这里创建，由调用方在数据写入后再建。
+    """
+    definitions = []
+    row_id_column = "_row_id" if any(column["name"].lower() == "id" for column in column_types) else "id"
+    if primary_key is None:
+        definitions.append(f"{quote_identifier(row_id_column)} BIGINT NOT NULL AUTO_INCREMENT")
+    for column in column_types:
+        nullable = "NOT NULL" if column["name"] == primary_key else "NULL"
+        definitions.append(f"{quote_identifier(column['name'])} {column['mysql_type']} {nullable}")
+    definitions.append(f"PRIMARY KEY ({quote_identifier(primary_key or row_id_column)})")
+    body = ",\n  ".join(definitions)
+    return f"CREATE TABLE {quote_identifier(table_name)} (\n  {body}\n) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"
@@ -4,17 +4,36 @@ MySQL数据库MCP服务器
 """
 import mysql.connector
 import pandas as pd
-import matplotlib.pyplot as plt
-import io
 import base64
+import asyncio
+import csv
+import functools
+import hashlib
+import hmac
+import importlib.util
+import itertools
 import json
 import logging
+import math
 import os
+import re
 import sys
-from typing import Dict, List, Any, Optional
-from datetime import datetime, date
+import tempfile
+import threading
+import time
+import weakref
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, List, Any, Optional, Union
+from datetime import datetime, date, timedelta
+from decimal import Decimal
+from mysql.connector import FieldType
 from mcp.server.fastmcp import FastMCP
 
+import excel_io
+from chart_renderer import CHART_TYPES, ChartRenderer, is_iso_date, lttb_indices
+
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -23,146 +42,3196 @@ logging.basicConfig(
 )
 logger = logging.getLogger('mysql_mcp_server')
 
-# 从环境变量获取数据库连接配置
-DB_CONFIG = {
-    "host": os.environ.get("DB_HOST", "localhost"),
-    "user": os.environ.get("DB_USER", "root"),
-    "password": os.environ.get("DB_PASSWORD", ""),
-    "database": os.environ.get("DB_NAME", "demo"),
-    "charset": 'utf8mb4',
-    "use_unicode": True,
-    "get_warnings": True
-}
+# 从环境变量获取数据库连接配置
+DB_CONFIG = {
+    "host": os.environ.get("DB_HOST", "localhost"),
+    "user": os.environ.get("DB_USER", "root"),
+    "password": os.environ.get("DB_PASSWORD", ""),
+    "database": os.environ.get("DB_NAME", "demo"),
+    "charset": 'utf8mb4',
+    "use_unicode": True,
+    "get_warnings": True,
+    # 默认使用C扩展实现的连接（未安装C扩展时驱动自动回退到纯Python实现）
+    "use_pure": os.environ.get("DB_USE_PURE", "false").lower() in ("1", "true", "yes")
+}
+
+logger.info(f"从环境变量加载数据库配置: {DB_CONFIG['host']}/{DB_CONFIG['database']}")
+if not DB_CONFIG["use_pure"] and not mysql.connector.HAVE_CEXT:
+    logger.warning("未安装mysql-connector的C扩展，将使用纯Python实现")
+
+# 连接池配置
+POOL_CONFIG = {
+    "min_size": int(os.environ.get("DB_POOL_MIN_SIZE", "1")),
+    "max_size": int(os.environ.get("DB_POOL_MAX_SIZE", "10")),
+    "acquire_timeout": float(os.environ.get("DB_POOL_TIMEOUT", "30")),
+    "validate_after": float(os.environ.get("DB_POOL_VALIDATE_AFTER", "30")),
+    "keepalive_interval": float(os.environ.get("DB_POOL_KEEPALIVE", "60")),
+    "idle_timeout": float(os.environ.get("DB_POOL_IDLE_TIMEOUT", "300"))
+}
+
+# 执行层配置：数据库工作线程数与同时执行的查询上限
+EXECUTOR_CONFIG = {
+    "max_workers": int(os.environ.get("DB_MAX_WORKERS", str(POOL_CONFIG["max_size"]))),
+    "max_inflight": int(os.environ.get("DB_MAX_INFLIGHT", os.environ.get("DB_MAX_WORKERS", str(POOL_CONFIG["max_size"]))))
+}
+
+# 图表渲染工作进程数，渲染在独立进程中进行，不占用事件循环和数据库工作线程
+CHART_WORKERS = int(os.environ.get("CHART_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# 查询超时（秒）：默认值与按工具名覆盖的值（JSON，如{"execute_query": 30, "analyze_sales_trend": 60}），0表示不限制
+QUERY_TIMEOUT = float(os.environ.get("QUERY_TIMEOUT", "30"))
+TOOL_TIMEOUTS = {name: float(value) for name, value in json.loads(os.environ.get("QUERY_TOOL_TIMEOUTS") or "{}").items()}
+
+# 单次查询最多返回的行数（兜底上限，返回量主要由下面的字节预算决定），以及流式读取时每批拉取的行数
+MAX_RESULT_ROWS = int(os.environ.get("QUERY_MAX_ROWS", "10000"))
+FETCH_BATCH_SIZE = int(os.environ.get("QUERY_FETCH_BATCH_SIZE", "200"))
+# 结果被截断后，为让连接能放回连接池而继续读出（只计数不转换）的总行数上限；
+# 没有LIMIT的SELECT已由sql_select_limit限制在QUERY_MAX_ROWS + 1行，超出该上限的只有自带更大LIMIT的查询，此时丢弃连接
+QUERY_DRAIN_MAX_ROWS = int(os.environ.get("QUERY_DRAIN_MAX_ROWS", "100000"))
+# 响应预算：结果按序列化后的字节数装填，可选再按token数限制（0表示不限制）；超长的单元格截断并加标记
+MAX_RESPONSE_BYTES = int(os.environ.get("QUERY_MAX_RESPONSE_BYTES", str(1024 * 1024)))
+MAX_RESPONSE_TOKENS = int(os.environ.get("QUERY_MAX_RESPONSE_TOKENS", "0"))
+MAX_CELL_BYTES = int(os.environ.get("QUERY_MAX_CELL_BYTES", "4096"))
+# execute_batch中每次executemany发送的参数行数，避免单个多行INSERT超过max_allowed_packet
+BATCH_CHUNK_ROWS = int(os.environ.get("QUERY_BATCH_CHUNK_ROWS", "1000"))
+# Excel导入：LOAD DATA LOCAL INFILE临时文件所在目录，为空时不启用LOAD DATA，只用executemany导入；
+# 配置后驱动只允许发送该目录下的文件，服务器端还需开启local_infile
+EXCEL_LOAD_INFILE_DIR = os.environ.get("EXCEL_LOAD_INFILE_DIR", "")
+# LOAD DATA每个临时文件包含的行数，以及导入的默认超时（秒），大文件导入远慢于普通查询
+EXCEL_LOAD_INFILE_ROWS = int(os.environ.get("EXCEL_LOAD_INFILE_ROWS", "50000"))
+EXCEL_LOAD_TIMEOUT = float(os.environ.get("EXCEL_LOAD_TIMEOUT", "600"))
+if EXCEL_LOAD_INFILE_DIR:
+    os.makedirs(EXCEL_LOAD_INFILE_DIR, exist_ok=True)
+    DB_CONFIG["allow_local_infile_in_path"] = os.path.abspath(EXCEL_LOAD_INFILE_DIR)
+# 查询导出：文件所在目录（默认为本文件旁的exports目录）、每批从服务器读取的行数，以及导出的默认超时（秒）
+EXPORT_DIR = os.environ.get("EXPORT_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "exports")
+EXPORT_CHUNK_ROWS = int(os.environ.get("EXPORT_CHUNK_ROWS", "10000"))
+EXPORT_TIMEOUT = float(os.environ.get("EXPORT_TIMEOUT", "600"))
+# 是否使用raw游标读取查询结果，由本服务直接把协议文本转换为JSON值
+RAW_FETCH = os.environ.get("QUERY_RAW_FETCH", "true").lower() in ("1", "true", "yes")
+
+# 每个连接最多缓存的服务器端预处理语句数（受MySQL全局max_prepared_stmt_count限制）
+STATEMENT_CACHE_SIZE = int(os.environ.get("DB_STATEMENT_CACHE_SIZE", "32"))
+
+# 表结构缓存：TTL到期后先做廉价的变更检查，未变化则续期；超过最长缓存时间则强制重新加载
+SCHEMA_CACHE_TTL = float(os.environ.get("SCHEMA_CACHE_TTL", "300"))
+SCHEMA_CACHE_MAX_AGE = float(os.environ.get("SCHEMA_CACHE_MAX_AGE", "3600"))
+
+# 查询结果缓存：按字节数限制内存，TTL兜底覆盖本服务之外的数据变更；RESULT_CACHE_MAX_BYTES为0时关闭
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESULT_CACHE_TTL = float(os.environ.get("RESULT_CACHE_TTL", "60"))
+# 图表缓存：按绘图数据的哈希缓存渲染好的图片，按字节数限制内存；CHART_CACHE_MAX_BYTES为0时关闭
+CHART_CACHE_MAX_BYTES = int(os.environ.get("CHART_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+CHART_CACHE_TTL = float(os.environ.get("CHART_CACHE_TTL", "3600"))
+
+# 查询预检：执行前用EXPLAIN估算代价。off关闭，warn（默认）超出预算时在结果中附带警告，reject直接拒绝执行
+QUERY_GUARD_MODE = os.environ.get("QUERY_GUARD_MODE", "warn").lower()
+QUERY_MAX_COST = float(os.environ.get("QUERY_MAX_COST", "1000000"))
+QUERY_MAX_ROWS_EXAMINED = float(os.environ.get("QUERY_MAX_ROWS_EXAMINED", "10000000"))
+# 执行计划缓存的条目数与有效期（秒），统计信息变化后计划也会变化
+QUERY_PLAN_CACHE_SIZE = int(os.environ.get("QUERY_PLAN_CACHE_SIZE", "512"))
+QUERY_PLAN_CACHE_TTL = float(os.environ.get("QUERY_PLAN_CACHE_TTL", "300"))
+
+# 是否让分析工具使用按天汇总的销售汇总表（按sale_id高水位增量刷新）
+SALES_ROLLUP_ENABLED = os.environ.get("SALES_ROLLUP_ENABLED", "false").lower() in ("1", "true", "yes")
+
+# 精确行数统计的默认时间预算（秒），超时的表退回使用估算值
+EXACT_COUNT_TIMEOUT = float(os.environ.get("EXACT_COUNT_TIMEOUT", "5"))
+
+# 分页令牌签名密钥；未配置时每次启动随机生成，令牌仅在本次运行期间有效
+PAGE_TOKEN_SECRET = os.environ.get("PAGE_TOKEN_SECRET", "").encode("utf-8") or os.urandom(32)
+
+# 初始化MCP服务器
+server = FastMCP(name="mysql-server", description="MySQL数据库交互服务器")
+
+# ======= 连接池 =======
+
+class ConnectionPool:
+    """线程安全的MySQL连接池
+
+    - 连接数在 min_size 与 max_size 之间，连接耗尽时借出方阻塞等待
+    - 借出空闲超过 validate_after 秒的连接时先 ping 校验，失效则重连
+    - 后台线程定期 ping 空闲连接保活，并回收超出 min_size 且空闲过久的连接
+    - 统计借出次数和等待时间，便于在负载下调整池大小
+    """
+
+    def __init__(self, db_config: Dict[str, Any], min_size: int = 1, max_size: int = 10,
+                 acquire_timeout: float = 30.0, validate_after: float = 30.0,
+                 keepalive_interval: float = 60.0, idle_timeout: float = 300.0):
+        # 池中连接统一开启autocommit，避免归还的连接残留未结束的读事务快照
+        self._db_config = dict(db_config, autocommit=True)
+        self.min_size = max(0, min_size)
+        self.max_size = max(1, max_size, self.min_size)
+        self.acquire_timeout = acquire_timeout
+        self.validate_after = validate_after
+        self.keepalive_interval = keepalive_interval
+        self.idle_timeout = idle_timeout
+
+        self._idle = deque()  # (连接, 最后归还时间)
+        self._size = 0  # 已打开的连接总数(空闲 + 借出)
+        self._cond = threading.Condition()
+        self._closed = False
+        self._stop_event = threading.Event()
+        self._keepalive_thread = None
+        self._driver = None  # 实际使用的连接实现类，如CMySQLConnection
+        self._stats = {
+            "checkouts": 0,
+            "waited_checkouts": 0,
+            "total_wait_seconds": 0.0,
+            "max_wait_seconds": 0.0,
+            "timeouts": 0,
+            "created": 0,
+            "reconnects": 0,
+            "discarded": 0
+        }
+
+    def _connect(self):
+        conn = mysql.connector.connect(**self._db_config)
+        with self._cond:
+            self._stats["created"] += 1
+            self._driver = type(conn).__name__
+        return conn
+
+    def _close_quietly(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _ensure_keepalive(self):
+        """首次借出时启动保活线程（调用方需持有锁）"""
+        if self._keepalive_thread is None and self.keepalive_interval > 0:
+            self._keepalive_thread = threading.Thread(
+                target=self._keepalive_loop, name="mysql-pool-keepalive", daemon=True
+            )
+            self._keepalive_thread.start()
+
+    def _validate(self, conn):
+        """校验连接是否存活，失效时重连，返回可用连接"""
+        try:
+            conn.ping(reconnect=False)
+            return conn
+        except Exception:
+            logger.warning("检测到失效的数据库连接，正在重连")
+        with self._cond:
+            self._stats["reconnects"] += 1
+        try:
+            conn.reconnect(attempts=1)
+            return conn
+        except Exception:
+            self._close_quietly(conn)
+            return self._connect()
+
+    def acquire(self, timeout: Optional[float] = None):
+        """借出一个连接，连接池耗尽时最多等待timeout秒"""
+        timeout = self.acquire_timeout if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+        conn, last_used = None, None
+        with self._cond:
+            self._ensure_keepalive()
+            waited = False
+            while True:
+                if self._closed:
+                    raise mysql.connector.errors.PoolError("连接池已关闭")
+                if self._idle:
+                    # 后进先出，优先复用最近使用过的连接
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise mysql.connector.errors.PoolError(f"等待数据库连接超时({timeout}秒)")
+                waited = True
+                self._cond.wait(remaining)
+            wait = time.monotonic() - start
+            self._stats["checkouts"] += 1
+            self._stats["total_wait_seconds"] += wait
+            self._stats["max_wait_seconds"] = max(self._stats["max_wait_seconds"], wait)
+            if waited:
+                self._stats["waited_checkouts"] += 1
+
+        # 建立连接和校验都在锁外进行，避免阻塞其他借出方
+        try:
+            if conn is None:
+                return self._connect()
+            if time.monotonic() - last_used > self.validate_after:
+                return self._validate(conn)
+            return conn
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn, discard: bool = False):
+        """归还连接；discard为True时直接关闭该连接"""
+        if discard or self._closed:
+            self._close_quietly(conn)
+            with self._cond:
+                self._size -= 1
+                self._stats["discarded"] += 1
+                self._cond.notify()
+            return
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout: Optional[float] = None):
+        """以上下文管理器方式借出连接，连接层错误时丢弃该连接"""
+        conn = self.acquire(timeout)
+        discard = False
+        try:
+            yield conn
+        except (mysql.connector.errors.OperationalError, mysql.connector.errors.InterfaceError):
+            discard = True
+            raise
+        finally:
+            self.release(conn, discard=discard)
+
+    def _keepalive_loop(self):
+        while not self._stop_event.wait(self.keepalive_interval):
+            try:
+                self._maintain()
+            except Exception as e:
+                logger.error(f"连接池维护失败: {str(e)}")
+
+    def _maintain(self):
+        """保活空闲连接、回收过期连接并补足min_size"""
+        now = time.monotonic()
+        expired, to_ping = [], []
+        with self._cond:
+            keep = deque()
+            for conn, last_used in self._idle:
+                idle_for = now - last_used
+                if idle_for > self.idle_timeout and self._size - len(expired) > self.min_size:
+                    expired.append(conn)
+                elif idle_for > self.keepalive_interval:
+                    to_ping.append(conn)
+                else:
+                    keep.append((conn, last_used))
+            self._idle = keep
+            # 待ping的连接视为借出状态，ping完再归还
+            self._size -= len(expired)
+            self._stats["discarded"] += len(expired)
+
+        for conn in expired:
+            self._close_quietly(conn)
+        for conn in to_ping:
+            try:
+                conn.ping(reconnect=True, attempts=1)
+                self.release(conn)
+            except Exception:
+                self.release(conn, discard=True)
+
+        while True:
+            with self._cond:
+                if self._closed or self._size >= self.min_size:
+                    break
+                self._size += 1
+            try:
+                conn = self._connect()
+            except Exception as e:
+                with self._cond:
+                    self._size -= 1
+                logger.warning(f"连接池预热连接失败: {str(e)}")
+                break
+            self.release(conn)
+
+    def stats(self) -> Dict[str, Any]:
+        """返回连接池的运行统计"""
+        with self._cond:
+            checkouts = self._stats["checkouts"]
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "checkouts": checkouts,
+                "waited_checkouts": self._stats["waited_checkouts"],
+                "timeouts": self._stats["timeouts"],
+                "avg_wait_ms": round(self._stats["total_wait_seconds"] * 1000 / checkouts, 3) if checkouts else 0.0,
+                "max_wait_ms": round(self._stats["max_wait_seconds"] * 1000, 3),
+                "created": self._stats["created"],
+                "reconnects": self._stats["reconnects"],
+                "discarded": self._stats["discarded"],
+                "driver": self._driver
+            }
+
+    def close(self):
+        """关闭连接池及所有空闲连接"""
+        self._stop_event.set()
+        with self._cond:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            self._close_quietly(conn)
+
+
+db_pool = ConnectionPool(DB_CONFIG, **POOL_CONFIG)
+
+# ======= 预处理语句缓存 =======
+
+class StatementCache:
+    """按连接缓存服务器端预处理语句
+
+    同一连接上再次执行相同的SQL文本时复用已准备好的预处理游标，只发送参数，
+    服务器不再重复解析和生成执行计划。
+    - 每个连接最多缓存max_per_connection条语句，超出时关闭最久未使用的语句
+    - 连接重连后服务器端语句随旧会话失效，按connection_id检测并丢弃整个连接的缓存
+    - 以弱引用关联连接，连接被连接池关闭后缓存随之释放
+    """
+
+    def __init__(self, max_per_connection: int):
+        self.max_per_connection = max(1, max_per_connection)
+        self._lock = threading.Lock()
+        # 连接 -> (connection_id, OrderedDict[SQL -> (SQL对象, 预处理游标)])
+        self._connections = weakref.WeakKeyDictionary()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "resets": 0
+        }
+
+    def _close_quietly(self, cursor):
+        try:
+            cursor.close()
+        except Exception:
+            pass
+
+    def _lookup(self, conn, sql: str):
+        """返回(SQL对象, 游标)，未命中时新建预处理游标"""
+        connection_id = conn.connection_id
+        evicted = None
+        with self._lock:
+            cached = self._connections.get(conn)
+            if cached is None or cached[0] != connection_id:
+                if cached is not None:
+                    self._stats["resets"] += 1
+                cached = (connection_id, OrderedDict())
+                self._connections[conn] = cached
+            statements = cached[1]
+            entry = statements.get(sql)
+            if entry is not None:
+                statements.move_to_end(sql)
+                self._stats["hits"] += 1
+                return entry
+            self._stats["misses"] += 1
+            if len(statements) >= self.max_per_connection:
+                _, evicted = statements.popitem(last=False)
+                self._stats["evictions"] += 1
+            # 驱动按对象身份判断语句是否已准备，之后每次都传入同一个字符串对象
+            entry = (sql, conn.cursor(prepared=True))
+            statements[sql] = entry
+        if evicted is not None:
+            self._close_quietly(evicted[1])
+        return entry
+
+    def _forget(self, conn, sql: str):
+        with self._lock:
+            cached = self._connections.get(conn)
+            entry = cached[1].pop(sql, None) if cached is not None else None
+        if entry is not None:
+            self._close_quietly(entry[1])
+
+    def execute(self, conn, sql: str, params):
+        """在conn上以预处理语句执行sql并返回游标；游标归缓存所有，调用方不要关闭"""
+        operation, cursor = self._lookup(conn, sql)
+        try:
+            cursor.execute(operation, tuple(params))
+        except Exception:
+            # 准备或执行失败的语句不再复用
+            self._forget(conn, sql)
+            raise
+        return cursor
+
+    def stats(self) -> Dict[str, Any]:
+        """返回语句缓存命中统计"""
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return dict(
+                self._stats,
+                hit_rate=round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+                connections=len(self._connections),
+                cached_statements=sum(len(statements) for _, statements in self._connections.values())
+            )
+
+
+statement_cache = StatementCache(STATEMENT_CACHE_SIZE)
+
+# ======= 执行层 =======
+
+# 明确表示不限制时间的超时值。None表示“使用默认值”，因此不限制时不能用None向下传递，
+# 否则分析工具把不限制的超时传给execute_query后，又会被换成execute_query自己的默认超时
+NO_TIMEOUT = 0.0
+
+def _tool_timeout(tool_name: str, timeout: Optional[float] = None) -> float:
+    """返回工具调用的超时秒数：调用方指定的值优先，其次是按工具配置的值，最后是默认值；不限制时返回NO_TIMEOUT"""
+    if timeout is None:
+        timeout = TOOL_TIMEOUTS.get(tool_name, QUERY_TIMEOUT)
+    return timeout if timeout > 0 else NO_TIMEOUT
+
+def _kill_query(connection_id: int):
+    """在独立的旁路连接上终止指定连接正在执行的语句（连接池可能已耗尽，不从池中借用）"""
+    conn = mysql.connector.connect(**dict(DB_CONFIG, connection_timeout=5))
+    try:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"KILL QUERY {int(connection_id)}")
+        finally:
+            cursor.close()
+    finally:
+        conn.close()
+
+class QueryHandle:
+    """一次数据库调用的取消句柄
+
+    工作线程借到连接后调用attach()登记连接ID，语句结束、连接归还前调用detach()。
+    kill()与detach()互斥，保证KILL QUERY只会发给仍在执行本次调用的连接，
+    不会误杀连接归还后被其他请求复用时执行的语句。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._connection_id = None
+        self.cancelled = False
+        self.killed = False
+
+    def attach(self, conn) -> bool:
+        """登记执行本次调用的连接；调用已被取消时返回False，调用方应直接放弃"""
+        with self._lock:
+            if self.cancelled:
+                return False
+            self._connection_id = conn.connection_id
+            return True
+
+    def detach(self):
+        with self._lock:
+            self._connection_id = None
+
+    def kill(self) -> bool:
+        """取消本次调用，语句正在执行时在服务器端终止它；返回是否发出了KILL QUERY"""
+        with self._lock:
+            self.cancelled = True
+            if self._connection_id is None:
+                return False
+            try:
+                _kill_query(self._connection_id)
+            except Exception as e:
+                logger.error(f"终止连接 {self._connection_id} 上的查询失败: {str(e)}")
+                return False
+            logger.warning(f"已终止连接 {self._connection_id} 上正在执行的查询")
+            self.killed = True
+            return True
+
+class QueryExecutor:
+    """在专用线程池中运行阻塞的mysql.connector调用
+
+    所有数据库操作都通过run()提交，事件循环只负责等待结果，
+    因此慢查询不会阻塞其他工具调用；max_inflight限制同时执行的查询数，
+    超出的请求在事件循环中排队等待。
+    """
+
+    def __init__(self, max_workers: int = 10, max_inflight: int = 10):
+        self.max_workers = max(1, max_workers)
+        self.max_inflight = max(1, min(max_inflight, self.max_workers))
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="mysql-worker")
+        self._semaphore = asyncio.Semaphore(self.max_inflight)
+        self._inflight = 0
+        self._waiting = 0
+        self._completed = 0
+        self._peak_inflight = 0
+        # KILL QUERY使用独立线程，不与待终止的查询争抢工作线程和并发名额
+        self._killer = ThreadPoolExecutor(max_workers=2, thread_name_prefix="mysql-kill")
+        self._timeouts = 0
+        self._cancellations = 0
+        self._kills = 0
+
+    async def run(self, func, *args, **kwargs):
+        """在工作线程中执行func(*args, **kwargs)并返回其结果"""
+        self._waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+        self._inflight += 1
+        self._peak_inflight = max(self._peak_inflight, self._inflight)
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+        finally:
+            self._inflight -= 1
+            self._completed += 1
+            self._semaphore.release()
+
+    def _kill(self, handle: QueryHandle):
+        if handle.kill():
+            self._kills += 1
+
+    async def run_cancellable(self, func, *args, timeout: Optional[float] = None, **kwargs):
+        """执行func(*args, handle=..., **kwargs)，超时或调用方取消时在服务器端终止正在执行的语句
+
+        func需要在借到连接后调用handle.attach()，归还连接前调用handle.detach()。
+        超时抛出TimeoutError；调用方被取消（如MCP客户端取消请求）时在后台发出KILL QUERY，
+        不在已取消的任务中等待，随后照常抛出CancelledError。
+        """
+        handle = QueryHandle()
+        # NO_TIMEOUT（0）表示不限制，wait_for的timeout为0会立即超时
+        timeout = timeout or None
+        future = asyncio.ensure_future(self.run(func, *args, handle=handle, **kwargs))
+        # 超时或取消后不再等待该任务，读取其异常以免产生未处理异常的警告
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            self._timeouts += 1
+            await asyncio.get_running_loop().run_in_executor(self._killer, self._kill, handle)
+            raise TimeoutError(f"查询超过{timeout:g}秒未完成，已在服务器端终止")
+        except asyncio.CancelledError:
+            self._cancellations += 1
+            self._killer.submit(self._kill, handle)
+            raise
+
+    def stats(self) -> Dict[str, Any]:
+        """返回执行层的运行统计"""
+        return {
+            "max_workers": self.max_workers,
+            "max_inflight": self.max_inflight,
+            "inflight": self._inflight,
+            "waiting": self._waiting,
+            "peak_inflight": self._peak_inflight,
+            "completed": self._completed,
+            "timeouts": self._timeouts,
+            "cancellations": self._cancellations,
+            "killed_queries": self._kills
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._killer.shutdown(wait=False, cancel_futures=True)
+
+
+if EXECUTOR_CONFIG["max_inflight"] > POOL_CONFIG["max_size"]:
+    logger.warning("DB_MAX_INFLIGHT大于连接池上限，超出的查询将在连接池中等待连接")
+
+db_executor = QueryExecutor(**EXECUTOR_CONFIG)
+
+chart_renderer = ChartRenderer(CHART_WORKERS)
+
+def json_serialize(obj):
+    """处理特殊类型的JSON序列化"""
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    elif isinstance(obj, Decimal):
+        # 处理Decimal类型
+        return float(obj)
+    elif isinstance(obj, timedelta):
+        return str(obj)
+    elif isinstance(obj, (bytes, bytearray)):
+        return obj.decode("utf-8", errors="replace")
+    elif isinstance(obj, set):
+        return sorted(obj)
+    raise TypeError(f"Object of type {type(obj)} is not JSON serializable")
+
+# ======= 结果转换 =======
+
+def _convert_bytes(value):
+    # TEXT与BLOB共用类型码，TEXT已被驱动解码为str，只有二进制内容需要处理
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode("utf-8", errors="replace")
+    return value
+
+def _convert_set(value):
+    return sorted(value) if isinstance(value, set) else value
+
+def _format_time(value: timedelta) -> str:
+    """按MySQL TIME的文本格式输出，与raw游标读到的文本保持一致"""
+    micros = (value.days * 86400 + value.seconds) * 1000000 + value.microseconds
+    sign = "-" if micros < 0 else ""
+    seconds, micros = divmod(abs(micros), 1000000)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    text = f"{sign}{hours:02d}:{minutes:02d}:{seconds:02d}"
+    return f"{text}.{micros:06d}" if micros else text
+
+# MySQL列类型码 -> 值转换函数；不在表中的类型（整数、浮点、字符串等）驱动已返回JSON原生值
+_COLUMN_CONVERTERS = {
+    FieldType.DECIMAL: float,
+    FieldType.NEWDECIMAL: float,
+    FieldType.DATE: date.isoformat,
+    FieldType.NEWDATE: date.isoformat,
+    FieldType.DATETIME: datetime.isoformat,
+    FieldType.TIMESTAMP: datetime.isoformat,
+    FieldType.TIME: _format_time,
+    FieldType.SET: _convert_set,
+    FieldType.TINY_BLOB: _convert_bytes,
+    FieldType.MEDIUM_BLOB: _convert_bytes,
+    FieldType.LONG_BLOB: _convert_bytes,
+    FieldType.BLOB: _convert_bytes,
+    FieldType.GEOMETRY: _convert_bytes
+}
+
+# 二进制字符集，VARBINARY/BINARY列的值由驱动返回为bytes
+BINARY_CHARSET_ID = 63
+
+def _raw_text(value):
+    return value.decode("utf-8", errors="replace")
+
+def _raw_date(value):
+    # 全零日期与类型转换路径保持一致，返回None
+    text = value.decode("ascii")
+    return None if text.startswith("0000") else text
+
+def _raw_datetime(value):
+    text = value.decode("ascii")
+    return None if text.startswith("0000") else text.replace(" ", "T", 1)
+
+def _raw_bit(value):
+    return int.from_bytes(value, "big")
+
+def _raw_set(value):
+    return sorted(value.decode("utf-8").split(",")) if value else []
+
+# raw游标返回协议中的原始字节，按列类型直接转换为JSON值，跳过Decimal/date等中间对象；
+# 不在表中的类型按文本解码
+_RAW_COLUMN_CONVERTERS = {
+    FieldType.TINY: int,
+    FieldType.SHORT: int,
+    FieldType.LONG: int,
+    FieldType.LONGLONG: int,
+    FieldType.INT24: int,
+    FieldType.YEAR: int,
+    FieldType.FLOAT: float,
+    FieldType.DOUBLE: float,
+    FieldType.DECIMAL: float,
+    FieldType.NEWDECIMAL: float,
+    FieldType.DATE: _raw_date,
+    FieldType.NEWDATE: _raw_date,
+    FieldType.DATETIME: _raw_datetime,
+    FieldType.TIMESTAMP: _raw_datetime,
+    FieldType.BIT: _raw_bit,
+    FieldType.SET: _raw_set
+}
+
+def _column_converters(description, raw: bool = False):
+    """返回需要转换的列：[(列下标, 转换函数)]"""
+    if raw:
+        return [
+            (index, _RAW_COLUMN_CONVERTERS.get(column[1], _raw_text))
+            for index, column in enumerate(description)
+        ]
+    converters = []
+    for index, column in enumerate(description):
+        func = _COLUMN_CONVERTERS.get(column[1])
+        if func is None and column[1] in FieldType.get_string_types() and column[8] == BINARY_CHARSET_ID:
+            func = _convert_bytes
+        if func is not None:
+            converters.append((index, func))
+    return converters
+
+def _build_row_converter(description, raw: bool = False):
+    """根据游标的列类型构建行转换函数
+
+    每个结果集只构建一次，之后每行只对需要转换的列调用对应函数，
+    一次遍历即可把元组行转换为JSON可序列化的字典，取代先dumps再loads的往返。
+    """
+    names = [column[0] for column in description]
+    converters = _column_converters(description, raw)
+
+    if not converters:
+        def convert(row):
+            return dict(zip(names, row))
+        return convert
+
+    def convert(row):
+        values = list(row)
+        for index, func in converters:
+            value = values[index]
+            if value is not None:
+                values[index] = func(value)
+        return dict(zip(names, values))
+    return convert
+
+def _build_value_converter(description, raw: bool = False):
+    """与_build_row_converter相同，但返回转换后的值列表，供按预算装填后再组装输出格式"""
+    converters = _column_converters(description, raw)
+
+    def convert(row):
+        values = list(row)
+        for index, func in converters:
+            value = values[index]
+            if value is not None:
+                values[index] = func(value)
+        return values
+    return convert
+
+def _convert_rows(cursor, rows, raw: bool = False) -> List[Dict[str, Any]]:
+    """把元组游标（或raw游标）读出的行转换为JSON可序列化的字典列表"""
+    if not rows:
+        return []
+    convert = _build_row_converter(cursor.description, raw)
+    return [convert(row) for row in rows]
+
+# 列式结果中，字符串列的不同值个数不超过行数的该比例时使用字典编码
+DICTIONARY_ENCODING_RATIO = 0.5
+
+def _dictionary_encode(values: List[Any]):
+    """对低基数字符串列做字典编码，返回(编码数组, 字典)；不值得编码时返回None"""
+    codes = []
+    lookup = {}
+    max_entries = int(len(values) * DICTIONARY_ENCODING_RATIO)
+    for value in values:
+        if value is None:
+            codes.append(None)
+            continue
+        if not isinstance(value, str):
+            return None
+        code = lookup.get(value)
+        if code is None:
+            if len(lookup) >= max_entries:
+                return None
+            code = lookup[value] = len(lookup)
+        codes.append(code)
+    if not lookup:
+        return None
+    return codes, list(lookup)
+
+def _encode_columns(names: List[str], columns: List[List[Any]]) -> Dict[str, Any]:
+    """把已转换的列组装为列式结果
+
+    列名只出现一次，每列是一个数组；重复度高的字符串列改为存放字典下标，
+    对应的取值表放在dictionaries中，可显著减少返回的字节数和LLM读取的token数。
+    """
+    data = {}
+    dictionaries = {}
+    for name, values in zip(names, columns):
+        encoded = _dictionary_encode(values) if len(values) > 1 else None
+        if encoded:
+            data[name], dictionaries[name] = encoded
+        else:
+            data[name] = values
+    return {
+        "columns": names,
+        "data": data,
+        "dictionaries": dictionaries
+    }
+
+RESULT_FORMATS = ("rows", "columnar")
+
+def _format_values(names: List[str], value_rows: List[List[Any]], result_format: str) -> Dict[str, Any]:
+    """把已转换（并按预算装填）的值列表组装为请求的结果格式，字典或列只在这里构建"""
+    if result_format == "columnar":
+        columns = [list(values) for values in zip(*value_rows)] if value_rows else [[] for _ in names]
+        return dict(format="columnar", **_encode_columns(names, columns))
+    return {"results": [dict(zip(names, values)) for values in value_rows]}
+
+# ======= 响应预算 =======
+
+# 估算token数时每个token对应的字节数；JSON标点与中文（UTF-8下3字节）混合时取偏保守的值
+BYTES_PER_TOKEN = 3
+
+def _response_byte_limit(max_bytes: Optional[int] = None, max_tokens: Optional[int] = None) -> int:
+    """合并字节预算与token预算，返回生效的字节上限；未指定的一项使用配置值"""
+    limit = MAX_RESPONSE_BYTES if max_bytes is None else max_bytes
+    tokens = MAX_RESPONSE_TOKENS if max_tokens is None else max_tokens
+    if tokens and tokens > 0:
+        limit = min(limit, tokens * BYTES_PER_TOKEN) if limit and limit > 0 else tokens * BYTES_PER_TOKEN
+    return max(0, limit or 0)
+
+def _truncate_cell(value: str, max_bytes: int) -> str:
+    """把超长字符串截断到max_bytes字节以内（不截断多字节字符），并追加标记说明原长度"""
+    encoded = value.encode("utf-8")
+    kept = encoded[:max_bytes].decode("utf-8", errors="ignore")
+    return f"{kept}…[已截断，原长{len(encoded)}字节]"
+
+class ResponseBudget:
+    """按序列化后的字节数装填结果行
+
+    每行先截断超过max_cell_bytes的字符串单元格，再按其JSON长度（rows格式另计重复的列名）
+    累计；累计值将超过max_bytes时停止装填。第一行总是放入，保证结果不为空。
+    max_bytes为0时只做单元格截断，不限制总字节数。
+    """
+
+    def __init__(self, names: List[str], result_format: str, max_bytes: int, max_cell_bytes: int = MAX_CELL_BYTES):
+        self.names = names
+        self.max_bytes = max_bytes
+        self.max_cell_bytes = max_cell_bytes
+        self.used_bytes = 2  # 外层的[]
+        self.exceeded = False
+        self.truncated_cells = 0
+        self.truncated_columns = set()
+        # 行之间的", "；rows格式每行还重复一次 "列名": ，列式格式列名只出现一次，不计入每行开销
+        self._row_overhead = 2
+        if result_format != "columnar":
+            self._row_overhead += sum(len(json.dumps(name, ensure_ascii=False).encode("utf-8")) + 2 for name in names)
+
+    def admit(self, values: List[Any]) -> bool:
+        """截断values中过长的单元格并计入预算；超出预算时返回False，该行不应放入结果"""
+        if self.max_cell_bytes > 0:
+            for index, value in enumerate(values):
+                # 字符数的4倍不超过上限时必然不超，省去编码
+                if isinstance(value, str) and len(value) * 4 > self.max_cell_bytes \
+                        and len(value.encode("utf-8")) > self.max_cell_bytes:
+                    values[index] = _truncate_cell(value, self.max_cell_bytes)
+                    self.truncated_cells += 1
+                    self.truncated_columns.add(self.names[index])
+        size = len(json.dumps(values, default=json_serialize, ensure_ascii=False).encode("utf-8")) + self._row_overhead
+        if self.max_bytes > 0 and self.used_bytes + size > self.max_bytes and self.used_bytes > 2:
+            self.exceeded = True
+            return False
+        self.used_bytes += size
+        return True
+
+    def report(self) -> Dict[str, Any]:
+        """返回预算使用情况及被截断的单元格"""
+        return {
+            "max_bytes": self.max_bytes or None,
+            "used_bytes": self.used_bytes,
+            "max_cell_bytes": self.max_cell_bytes or None,
+            "truncated_cells": self.truncated_cells,
+            "truncated_columns": sorted(self.truncated_columns)
+        }
+
+# ======= 查询结果缓存 =======
+
+# 包含这些函数或语法的查询每次结果可能不同，不进入缓存
+_NONDETERMINISTIC_PATTERN = re.compile(
+    r"\b(NOW|SYSDATE|CURDATE|CURTIME|CURRENT_DATE|CURRENT_TIME|CURRENT_TIMESTAMP|UTC_DATE|UTC_TIME|"
+    r"UTC_TIMESTAMP|UNIX_TIMESTAMP|RAND|UUID|UUID_SHORT|CONNECTION_ID|LAST_INSERT_ID|FOUND_ROWS|"
+    r"ROW_COUNT|SLEEP|GET_LOCK|DATABASE|USER|CURRENT_USER)\b|\bFOR\s+(UPDATE|SHARE)\b|@",
+    re.IGNORECASE
+)
+
+_IDENTIFIER_PATTERN = re.compile(r"`((?:[^`]|``)+)`|\b([A-Za-z_][A-Za-z0-9_$]*)\b")
+
+def _referenced_tables(query: str, conn=None) -> Optional[List[str]]:
+    """找出SQL中引用的表，无法获取表结构时返回None
+
+    把语句中的每个标识符与表结构缓存中的表名比对，能覆盖JOIN、逗号连接、子查询和CTE；
+    与表同名的列也会被计入，这只会导致多失效一些缓存，不影响正确性。
+    """
+    try:
+        tables = {name.lower(): name for name in schema_cache.get(conn)}
+    except Exception as e:
+        logger.warning(f"获取表结构失败，无法确定查询引用的表: {str(e)}")
+        return None
+    referenced = set()
+    for quoted, bare in _IDENTIFIER_PATTERN.findall(query):
+        name = quoted.replace("``", "`") if quoted else bare
+        table = tables.get(name.lower())
+        if table:
+            referenced.add(table)
+    return sorted(referenced)
+
+# 位于表名位置、带库名限定的标识符（如UPDATE otherdb.t），写入的表不在表结构缓存中
+_QUALIFIED_TABLE_PATTERN = re.compile(
+    r"\b(?:UPDATE|INTO|FROM|JOIN|TABLE)\s+(?:`(?:[^`]|``)+`|[A-Za-z_][A-Za-z0-9_$]*)\s*\.\s*[`A-Za-z_]",
+    re.IGNORECASE
+)
+
+# 不会写入表的非查询语句
+_NON_WRITING_PATTERN = re.compile(r"^(EXPLAIN|DESC|SET|USE)\b", re.IGNORECASE)
+
+def _written_tables(statement: str, conn=None) -> Optional[List[str]]:
+    """确定写操作涉及的表；无法可靠确定时返回None，调用方按涉及所有表处理（清空缓存、标记汇总表）
+
+    CALL执行的存储过程、带库名限定的表，以及解析不出任何已知表的语句都可能写入任意表，
+    返回空列表会让相关缓存一直保留到TTL到期。
+    """
+    if _NON_WRITING_PATTERN.match(statement.lstrip()):
+        return []
+    if statement.lstrip().upper().startswith("CALL") or _QUALIFIED_TABLE_PATTERN.search(statement):
+        return None
+    return _referenced_tables(statement, conn) or None
+
+def _params_key(params: Optional[List[Any]]) -> str:
+    """把绑定参数编码为缓存键的后缀，没有参数时为空字符串"""
+    if params is None:
+        return ""
+    return ":" + json.dumps(list(params), default=json_serialize, ensure_ascii=False, sort_keys=True)
+
+def _result_cache_key(query: str, result_format: str, params: Optional[List[Any]] = None) -> Optional[str]:
+    """返回查询的缓存键；非SELECT或结果不确定的查询返回None
+
+    键使用SQL原文（只去掉首尾空白和结尾分号）：合并空白会让字面量中空白不同的查询（如'a  b'与'a b'）共用同一个键。
+    """
+    if RESULT_CACHE_MAX_BYTES <= 0:
+        return None
+    normalized = _normalize_sql(query)
+    if not normalized.upper().startswith("SELECT") or _NONDETERMINISTIC_PATTERN.search(normalized):
+        return None
+    return f"{result_format}:{_strip_sql(query)}{_params_key(params)}"
+
+class ResultCache:
+    """按SQL原文缓存查询结果的LRU缓存
+
+    - 总大小按结果序列化后的字节数限制，超出时淘汰最久未使用的条目
+    - 每个条目记录查询引用的表，execute_query写入这些表后相关条目立即失效
+    - 条目超过ttl秒后过期，覆盖本服务之外对数据的修改
+    - 通过add_dependent关联的缓存随本缓存一起按表失效或清空
+    - 每次失效都递增失效计数并记录到涉及的表上；调用方在执行查询前用generation()取得计数，
+      put时若相关的表在此之后被失效过（查询与写操作并发），拒绝写入可能已过时的结果
+    """
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # 键 -> (结果, 引用的表, 字节数, 过期时间)
+        self._table_keys = {}  # 表名 -> 引用该表的缓存键集合
+        self._bytes = 0
+        self._dependents = []
+        self._generation = 0
+        self._table_generations = {}  # 表名 -> 该表最近一次失效时的计数
+        self._cleared_generation = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "invalidations": 0,
+            "stale_puts": 0
+        }
+
+    def _remove(self, key):
+        result, tables, size, _ = self._entries.pop(key)
+        self._bytes -= size
+        for table in tables:
+            keys = self._table_keys.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._table_keys[table]
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """查找缓存结果，未命中或已过期时返回None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            if entry[3] <= time.monotonic():
+                self._remove(key)
+                self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry[0]
+
+    def generation(self) -> int:
+        """返回当前的失效计数，在执行查询前调用，随结果一起传给put"""
+        with self._lock:
+            return self._generation
+
+    def put(self, key: str, result: Dict[str, Any], tables: List[str], generation: int):
+        """写入缓存；单个结果超过容量上限，或相关的表在generation之后被失效过时不缓存"""
+        size = len(json.dumps(result, ensure_ascii=False, default=json_serialize).encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if self._cleared_generation > generation or \
+                    any(self._table_generations.get(table, 0) > generation for table in tables):
+                self._stats["stale_puts"] += 1
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (result, tuple(tables), size, time.monotonic() + self.ttl)
+            self._bytes += size
+            for table in tables:
+                self._table_keys.setdefault(table, set()).add(key)
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._stats["evictions"] += 1
+
+    def add_dependent(self, cache: "ResultCache"):
+        """关联一个由本缓存的结果派生出的缓存，使其共用本缓存的失效"""
+        self._dependents.append(cache)
+
+    def invalidate_tables(self, tables: Optional[List[str]]):
+        """使引用了指定表的缓存条目失效；tables为None（无法确定涉及的表）时清空缓存"""
+        if tables is None:
+            self.clear()
+            return
+        with self._lock:
+            self._generation += 1
+            for table in tables:
+                self._table_generations[table] = self._generation
+                for key in list(self._table_keys.get(table, ())):
+                    self._remove(key)
+                    self._stats["invalidations"] += 1
+        for cache in self._dependents:
+            cache.invalidate_tables(tables)
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._generation += 1
+            self._cleared_generation = self._generation
+            self._stats["invalidations"] += len(self._entries)
+            self._entries.clear()
+            self._table_keys.clear()
+            self._bytes = 0
+        for cache in self._dependents:
+            cache.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """返回命中率、容量等统计信息"""
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return dict(
+                self._stats,
+                hit_rate=round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+                entries=len(self._entries),
+                bytes=self._bytes,
+                max_bytes=self.max_bytes
+            )
+
+
+result_cache = ResultCache(RESULT_CACHE_MAX_BYTES, RESULT_CACHE_TTL)
+# 图表由查询结果渲染而来，底层表被写入时随结果缓存一起失效
+chart_cache = ResultCache(CHART_CACHE_MAX_BYTES, CHART_CACHE_TTL)
+result_cache.add_dependent(chart_cache)
+
+# ======= 请求合并 =======
+
+class SingleFlight:
+    """合并相同键的并发请求
+
+    某个键的请求执行期间，相同键的新请求不再重复执行，而是等待同一个任务的结果；
+    任务结束后立即移除，之后的请求重新执行，因此不会产生缓存意义上的过期数据。
+    单个等待方取消只会停止它自己的等待，最后一个等待方取消时才取消底层任务。
+    """
+
+    def __init__(self):
+        self._inflight = {}  # 键 -> [任务, 等待方数量]
+        self._stats = {
+            "executions": 0,
+            "coalesced": 0
+        }
+
+    async def do(self, key: str, func):
+        """执行func()（返回协程的函数），相同键的并发调用共享同一次执行的结果"""
+        entry = self._inflight.get(key)
+        if entry is None:
+            entry = [asyncio.ensure_future(func()), 0]
+            self._inflight[key] = entry
+            self._stats["executions"] += 1
+
+            def _cleanup(_, key=key, entry=entry):
+                if self._inflight.get(key) is entry:
+                    del self._inflight[key]
+            entry[0].add_done_callback(_cleanup)
+        else:
+            self._stats["coalesced"] += 1
+
+        task = entry[0]
+        entry[1] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if entry[1] == 1 and not task.done():
+                task.cancel()
+            raise
+        finally:
+            entry[1] -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        """返回执行次数、被合并的请求数和当前执行中的键数"""
+        return dict(self._stats, inflight=len(self._inflight))
+
+
+# 结果依赖执行时机或会话状态的查询不参与合并
+_VOLATILE_PATTERN = re.compile(
+    r"\b(RAND|UUID|UUID_SHORT|SLEEP|GET_LOCK|CONNECTION_ID|LAST_INSERT_ID|FOUND_ROWS|ROW_COUNT)\b"
+    r"|\bFOR\s+(UPDATE|SHARE)\b|@",
+    re.IGNORECASE
+)
+
+def _single_flight_key(query: str, result_format: str, params: Optional[List[Any]] = None) -> Optional[str]:
+    """返回只读查询的合并键，写操作和易变查询返回None"""
+    normalized = _normalize_sql(query)
+    if not normalized.upper().startswith(("SELECT", "SHOW", "DESCRIBE")):
+        return None
+    if _VOLATILE_PATTERN.search(normalized):
+        return None
+    # 合并键使用SQL原文，字面量中空白不同的查询不能共享结果
+    return f"query:{result_format}:{_strip_sql(query)}{_params_key(params)}"
+
+
+single_flight = SingleFlight()
+
+# ======= 查询预检 =======
+
+QUERY_GUARD_MODES = ("off", "warn", "reject")
+
+def _walk_plan(node, loops: float, tables: List[Dict[str, Any]], flags: set):
+    """遍历EXPLAIN FORMAT=JSON的计划树，收集各表的访问方式和扫描次数
+
+    嵌套循环连接中，某张表被扫描的次数等于前一张表的rows_produced_per_join（连接到该表为止的累计行数）；
+    哈希连接的内表只读取一次用于建表。
+    """
+    if isinstance(node, list):
+        for item in node:
+            _walk_plan(item, loops, tables, flags)
+        return
+    if not isinstance(node, dict):
+        return
+    for key, value in node.items():
+        if key == "nested_loop" and isinstance(value, list):
+            prefix = loops
+            for item in value:
+                _walk_plan(item, prefix, tables, flags)
+                table = item.get("table") if isinstance(item, dict) else None
+                if isinstance(table, dict):
+                    prefix = float(table.get("rows_produced_per_join") or 1)
+        elif key == "table" and isinstance(value, dict):
+            hash_join = "hash join" in str(value.get("using_join_buffer") or "").lower()
+            tables.append(dict(value, _loops=1.0 if hash_join else loops))
+            # 物化子查询、附加子查询等按执行一次估算
+            _walk_plan(value, 1.0, tables, flags)
+        elif key in ("using_filesort", "using_temporary_table") and value is True:
+            flags.add(key)
+        elif isinstance(value, (dict, list)):
+            _walk_plan(value, loops, tables, flags)
+
+def _summarize_plan(plan: Dict[str, Any], max_cost: float, max_rows_examined: float) -> Dict[str, Any]:
+    """把EXPLAIN FORMAT=JSON的输出归纳为代价、扫描行数、各表访问方式和问题提示"""
+    tables, flags = [], set()
+    _walk_plan(plan, 1.0, tables, flags)
+
+    cost = None
+    cost_info = plan.get("query_block", {}).get("cost_info", {})
+    if cost_info.get("query_cost") is not None:
+        cost = float(cost_info["query_cost"])
+
+    rows_examined = 0.0
+    table_summaries, warnings = [], []
+    for table in tables:
+        per_scan = float(table.get("rows_examined_per_scan") or 0)
+        loops = table["_loops"]
+        rows_examined += per_scan * loops
+        name = table.get("table_name")
+        summary = {
+            "table": name,
+            "access_type": table.get("access_type"),
+            "key": table.get("key"),
+            "possible_keys": table.get("possible_keys"),
+            "rows_examined_per_scan": int(per_scan),
+            "scans": int(loops),
+            "filtered": table.get("filtered")
+        }
+        if table.get("using_join_buffer"):
+            summary["join_buffer"] = table["using_join_buffer"]
+            warnings.append(f"表 {name} 的连接没有可用索引（{table['using_join_buffer']}），结果行数随两表行数相乘增长")
+        if table.get("access_type") == "ALL":
+            warnings.append(f"表 {name} 全表扫描，约{int(per_scan)}行")
+        table_summaries.append(summary)
+    if "using_filesort" in flags:
+        warnings.append("结果需要额外排序(filesort)")
+    if "using_temporary_table" in flags:
+        warnings.append("需要使用临时表")
+
+    violations = []
+    if cost is not None and cost > max_cost:
+        violations.append(f"预估代价 {cost:.0f} 超过上限 {max_cost:.0f}")
+    if rows_examined > max_rows_examined:
+        violations.append(f"预估扫描 {rows_examined:.0f} 行，超过上限 {max_rows_examined:.0f}")
+
+    return {
+        "cost": cost,
+        "rows_examined": int(rows_examined),
+        "tables": table_summaries,
+        "warnings": warnings,
+        "over_budget": bool(violations),
+        "violations": violations
+    }
+
+class QueryGuard:
+    """执行前的查询代价预检
+
+    - 对SELECT/UPDATE/DELETE先执行EXPLAIN FORMAT=JSON，估算代价与扫描行数
+    - 超出预算时按模式警告或拒绝，并把计划摘要返回给调用方，便于改写查询
+    - 计划摘要按规范化SQL缓存（LRU + TTL），DDL后整体失效；绑定参数不同的同一语句共用一份计划
+    - EXPLAIN本身失败时不拦截，由实际执行返回错误
+    """
+
+    def __init__(self, mode: str, max_cost: float, max_rows_examined: float,
+                 cache_size: int, cache_ttl: float):
+        if mode not in QUERY_GUARD_MODES:
+            logger.warning(f"未知的查询预检模式: {mode}，使用warn")
+            mode = "warn"
+        self.mode = mode
+        self.max_cost = max_cost
+        self.max_rows_examined = max_rows_examined
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self._plans = OrderedDict()  # 规范化SQL -> (计划摘要, 过期时间)
+        self._lock = threading.Lock()
+        self._stats = {
+            "checks": 0,
+            "plan_cache_hits": 0,
+            "explain_failures": 0,
+            "warned": 0,
+            "rejected": 0
+        }
+
+    def _explain(self, conn, query: str, params: Optional[List[Any]]) -> Optional[Dict[str, Any]]:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"EXPLAIN FORMAT=JSON {query}", tuple(params) if params is not None else None)
+            row = cursor.fetchone()
+            cursor.fetchall()
+        except Exception as e:
+            logger.debug(f"查询预检EXPLAIN失败: {str(e)}")
+            with self._lock:
+                self._stats["explain_failures"] += 1
+            return None
+        finally:
+            cursor.close()
+        plan = row[0] if row else None
+        if isinstance(plan, (bytes, bytearray)):
+            plan = plan.decode("utf-8")
+        return json.loads(plan) if plan else None
+
+    def check(self, conn, query: str, params: Optional[List[Any]] = None) -> Optional[Dict[str, Any]]:
+        """返回查询的计划摘要；预检关闭、语句不需要预检或EXPLAIN失败时返回None"""
+        if self.mode == "off":
+            return None
+        normalized = _normalize_sql(query)
+        if not normalized.upper().startswith(("SELECT", "UPDATE", "DELETE")):
+            return None
+
+        now = time.monotonic()
+        with self._lock:
+            self._stats["checks"] += 1
+            cached = self._plans.get(normalized)
+            if cached is not None and cached[1] > now:
+                self._plans.move_to_end(normalized)
+                self._stats["plan_cache_hits"] += 1
+                summary = cached[0]
+            else:
+                summary = None
+        if summary is None:
+            plan = self._explain(conn, query, params)
+            if plan is None:
+                return None
+            summary = _summarize_plan(plan, self.max_cost, self.max_rows_examined)
+            with self._lock:
+                self._plans[normalized] = (summary, now + self.cache_ttl)
+                self._plans.move_to_end(normalized)
+                while len(self._plans) > self.cache_size:
+                    self._plans.popitem(last=False)
+
+        if summary["over_budget"]:
+            with self._lock:
+                self._stats["rejected" if self.mode == "reject" else "warned"] += 1
+        return summary
+
+    def invalidate(self):
+        """清空计划缓存（表结构变化后调用）"""
+        with self._lock:
+            self._plans.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """返回预检模式、预算和计划缓存统计"""
+        with self._lock:
+            return dict(
+                self._stats,
+                mode=self.mode,
+                max_cost=self.max_cost,
+                max_rows_examined=self.max_rows_examined,
+                cached_plans=len(self._plans)
+            )
+
+
+query_guard = QueryGuard(QUERY_GUARD_MODE, QUERY_MAX_COST, QUERY_MAX_ROWS_EXAMINED,
+                         QUERY_PLAN_CACHE_SIZE, QUERY_PLAN_CACHE_TTL)
+
+# ======= 数据库工具 =======
+
+def _fetch_within_budget(cursor, convert, budget: ResponseBudget, max_rows: int):
+    """流式读取并转换结果集，直到行数上限或字节预算用尽
+
+    每批读出的行立即转换并计入预算，内存占用与响应大小相当，不会先把整批宽行全部读进来。
+    截断后继续读出剩余的行（只计数不转换），使连接可以放回连接池，读出的行数也就是结果的总行数；
+    剩余行超过QUERY_DRAIN_MAX_ROWS时停止读取，结果集未读完，调用方应丢弃连接。
+
+    Returns:
+        (转换后的值列表, 是否截断, 结果集是否已读完, 从游标读出的总行数)
+    """
+    value_rows = []
+    rows_read = 0
+    while True:
+        batch = cursor.fetchmany(FETCH_BATCH_SIZE)
+        if not batch:
+            return value_rows, False, True, rows_read
+        rows_read += len(batch)
+        for row in batch:
+            if len(value_rows) >= max_rows:
+                break
+            values = convert(row)
+            if not budget.admit(values):
+                break
+            value_rows.append(values)
+        else:
+            continue
+        # 当前批次有未放入的行；读完剩余结果，只计数
+        drain_limit = max(QUERY_DRAIN_MAX_ROWS, max_rows + 1)
+        while rows_read <= drain_limit:
+            batch = cursor.fetchmany(FETCH_BATCH_SIZE)
+            if not batch:
+                return value_rows, True, True, rows_read
+            rows_read += len(batch)
+        return value_rows, True, False, rows_read
+
+def _estimate_total_rows(conn, query: str, params: Optional[List[Any]] = None) -> Optional[int]:
+    """用EXPLAIN估算查询结果的总行数，无法估算时返回None；conn为None时从连接池借用连接"""
+    if conn is None:
+        try:
+            conn = db_pool.acquire()
+        except Exception as e:
+            logger.debug(f"EXPLAIN估算行数失败: {str(e)}")
+            return None
+        try:
+            return _estimate_total_rows(conn, query, params)
+        finally:
+            db_pool.release(conn)
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute(f"EXPLAIN {query}", tuple(params) if params is not None else None)
+        plan = cursor.fetchall()
+    except Exception as e:
+        logger.debug(f"EXPLAIN估算行数失败: {str(e)}")
+        return None
+    finally:
+        cursor.close()
+    estimate = None
+    for row in plan:
+        # 只看最外层查询块，嵌套循环连接的输出行数为各表(rows * filtered%)之积
+        if row.get("id") != 1 or row.get("rows") is None:
+            continue
+        rows = float(row["rows"]) * float(row.get("filtered") or 100) / 100
+        estimate = rows if estimate is None else estimate * rows
+    return int(estimate) if estimate is not None else None
+
+def _after_write(tables: Optional[List[str]], statement: str, conn=None):
+    """写操作成功后统一处理：失效结果缓存、标记汇总表、DDL时失效表结构缓存和执行计划缓存
+
+    conn为执行写操作的连接，汇总表的过期标记经由它写入；为None时从连接池借用。
+    """
+    result_cache.invalidate_tables(tables)
+    sales_rollup.note_write(tables, statement, conn)
+    if _is_ddl(statement):
+        schema_cache.invalidate()
+        query_guard.invalidate()
+
+# 查询超过max_execution_time被服务器终止时的错误码
+ER_QUERY_TIMEOUT = 3024
+
+_DDL_PATTERN = re.compile(r"^(CREATE|ALTER|DROP|RENAME|TRUNCATE)\b", re.IGNORECASE)
+
+def _is_ddl(statement: str) -> bool:
+    """判断语句是否为会改变表结构的DDL"""
+    return bool(_DDL_PATTERN.match(statement.lstrip()))
+
+def _reset_select_limit(conn, timeout: Optional[float]):
+    """恢复_execute_query_sync为SELECT设置的sql_select_limit（以及max_execution_time）"""
+    reset_cursor = conn.cursor()
+    try:
+        reset_cursor.execute(
+            "SET SESSION sql_select_limit = DEFAULT, max_execution_time = DEFAULT" if timeout
+            else "SET SESSION sql_select_limit = DEFAULT"
+        )
+    finally:
+        reset_cursor.close()
+
+def _execute_query_sync(query: str, result_format: str = "rows", cache_key: Optional[str] = None,
+                        params: Optional[List[Any]] = None, timeout: Optional[float] = None,
+                        max_bytes: Optional[int] = None, handle: Optional[QueryHandle] = None) -> Dict[str, Any]:
+    """在工作线程中执行SQL查询，由execute_query调度
+
+    cache_key不为空时，成功的查询结果会连同其引用的表一起写入结果缓存；执行期间这些表被写入过时不写入。
+    params不为None时以服务器端预处理语句执行，语句按连接缓存复用。
+    timeout不为空时SELECT由服务器按max_execution_time自行终止；其他语句由调用方超时后通过handle终止。
+    max_bytes为结果的字节预算，None时使用配置值。
+    """
+    conn = None
+    cursor = None
+    discard = False
+    limit_set = False
+    # 预处理游标归语句缓存所有，不能在这里关闭
+    prepared = params is not None
+    # 在语句执行前取失效计数，执行期间发生的写操作会使本次结果不进入缓存
+    cache_generation = result_cache.generation()
+    try:
+        logger.info(f"执行SQL查询: {query}")
+        try:
+            conn = db_pool.acquire()
+        except Exception as e:
+            logger.error(f"数据库连接错误: {str(e)}")
+            return {"error": "无法连接到数据库"}
+        if handle is not None and not handle.attach(conn):
+            return {"error": "查询已取消"}
+            
+        statement = query.strip().upper()
+        is_read = statement.startswith(("SELECT", "SHOW", "DESCRIBE"))
+        written_tables = []
+        if not is_read:
+            # 在执行前确定写入涉及的表（DROP之后表就不在表结构缓存中了）
+            written_tables = _written_tables(query, conn)
+        plan = query_guard.check(conn, query, params)
+        over_budget = plan is not None and plan["over_budget"]
+        if over_budget:
+            logger.warning(f"查询预估代价超出预算: {'; '.join(plan['violations'])}")
+            if query_guard.mode == "reject":
+                return {
+                    "error": f"查询预估代价超出预算（{'; '.join(plan['violations'])}），"
+                             "请根据query_plan添加过滤条件、使用带索引的列或缩小范围后重试",
+                    "query_plan": plan
+                }
+        if statement.startswith("SELECT"):
+            # 将行数上限下推到服务器：没有LIMIT子句的SELECT最多只返回MAX_RESULT_ROWS + 1行；
+            # 有超时时一并设置max_execution_time，由服务器在超时后终止只读查询
+            limit_cursor = conn.cursor()
+            if timeout:
+                limit_cursor.execute(
+                    "SET SESSION sql_select_limit = %s, max_execution_time = %s",
+                    (MAX_RESULT_ROWS + 1, max(1, int(timeout * 1000)))
+                )
+            else:
+                limit_cursor.execute("SET SESSION sql_select_limit = %s", (MAX_RESULT_ROWS + 1,))
+            limit_cursor.close()
+            limit_set = True
+            
+        if prepared:
+            # 二进制协议的结果已由驱动转换为Python值
+            cursor = statement_cache.execute(conn, query, params)
+        else:
+            # 内部使用元组（或raw）游标，只在输出时构建字典或列
+            cursor = conn.cursor(raw=RAW_FETCH)
+            cursor.execute(query)
+        raw = RAW_FETCH and not prepared
+        
+        # 检查是否是SELECT查询
+        if is_read:
+            names = [column[0] for column in cursor.description]
+            budget = ResponseBudget(names, result_format, _response_byte_limit() if max_bytes is None else max_bytes)
+            try:
+                # 按列类型逐行转换为JSON可序列化的值，同时按字节预算装填
+                rows, truncated, exhausted, rows_read = _fetch_within_budget(
+                    cursor, _build_value_converter(cursor.description, raw), budget, MAX_RESULT_ROWS
+                )
+                formatted = _format_values(names, rows, result_format)
+            except Exception as e:
+                logger.error(f"结果转换失败: {str(e)}")
+                return {"error": f"结果序列化失败: {str(e)}"}
+            logger.debug(f"查询返回 {len(rows)} 条结果，截断: {truncated}")
+            if not exhausted:
+                # 查询自带更大的LIMIT时剩余结果超过可排空的上限，直接丢弃连接比继续读取更便宜；
+                # 连接立即归还，估算总行数时另借一个连接，避免同时占用两个连接
+                if handle is not None:
+                    handle.detach()
+                db_pool.release(conn, discard=True)
+                conn = None
+                cursor = None
+            
+            total_row_count = len(rows)
+            total_exact = not truncated
+            if truncated and exhausted and rows_read <= MAX_RESULT_ROWS:
+                # 剩余行已全部读过且未触及服务器端行数上限时，总行数是精确的
+                total_row_count = rows_read
+                total_exact = True
+            elif truncated:
+                if cursor is not None:
+                    if not prepared:
+                        cursor.close()
+                    cursor = None
+                # 估算值不小于实际读出的行数；无法估算时总行数未知
+                estimate = _estimate_total_rows(conn, query, params)
+                total_row_count = max(estimate, rows_read) if estimate is not None else None
+            logger.info("成功序列化查询结果")
+            result = {
+                "success": True,
+                "query_type": "SELECT",
+                "row_count": len(rows),
+                "truncated": truncated,
+                "total_row_count": total_row_count,
+                "total_row_count_exact": total_exact
+            }
+            result.update(formatted)
+            if truncated or budget.truncated_cells:
+                # 说明被丢弃的行和被截断的单元格，便于调用方缩小查询或分页获取
+                reason = None
+                if truncated:
+                    reason = "max_bytes" if budget.exceeded else "max_rows"
+                result["response_budget"] = dict(
+                    budget.report(),
+                    truncated_by=reason,
+                    dropped_rows=total_row_count - len(rows) if total_row_count is not None else None
+                )
+            if over_budget:
+                result["query_plan"] = plan
+            if cache_key is not None:
+                if conn is not None and limit_set:
+                    # 表结构缓存过期时会在这个连接上重新加载information_schema，
+                    # 先恢复行数上限，否则大库的列和索引列表会被截断在MAX_RESULT_ROWS + 1行
+                    _reset_select_limit(conn, timeout)
+                    limit_set = False
+                tables = _referenced_tables(query, conn)
+                if tables is not None:
+                    result_cache.put(cache_key, result, tables, cache_generation)
+            return result
+        else:
+            # 对于INSERT, UPDATE, DELETE等查询（连接池中的连接已开启autocommit）
+            logger.info(f"更新操作影响了 {cursor.rowcount} 行")
+            _after_write(written_tables, statement, conn)
+            result = {
+                "success": True,
+                "query_type": "UPDATE",
+                "affected_rows": cursor.rowcount,
+                "message": f"查询执行成功，影响了{cursor.rowcount}行"
+            }
+            if over_budget:
+                result["query_plan"] = plan
+            return result
+    except Exception as e:
+        logger.error(f"查询执行失败: {str(e)}")
+        if handle is not None and handle.killed:
+            # 被KILL QUERY终止的连接可能残留中断标记，不再复用
+            discard = True
+        if _is_ddl(query):
+            # 失败的DDL也可能已部分生效（如多表DROP），保守地使缓存失效
+            schema_cache.invalidate()
+            result_cache.clear()
+            query_guard.invalidate()
+            sales_rollup.note_write(None, query)
+        # 连接层错误说明连接已不可用，不再放回连接池
+        discard = discard or isinstance(e, (mysql.connector.errors.OperationalError, mysql.connector.errors.InterfaceError))
+        if getattr(e, "errno", None) == ER_QUERY_TIMEOUT:
+            limit = f"{timeout:g}秒" if timeout else "服务器的执行时间上限"
+            return {"error": f"查询执行超过{limit}，已被服务器终止；请缩小查询范围或增大timeout"}
+        return {"error": str(e)}
+    finally:
+        if conn is not None:
+            if cursor is not None and not discard and not prepared:
+                try:
+                    cursor.close()
+                except Exception:
+                    discard = True
+            if limit_set and not discard:
+                try:
+                    _reset_select_limit(conn, timeout)
+                except Exception:
+                    discard = True
+            if handle is not None:
+                handle.detach()
+                discard = discard or handle.killed
+            db_pool.release(conn, discard=discard)
+            logger.debug("数据库连接已归还连接池")
+
+@server.tool()
+async def execute_query(query: str, format: str = "rows", use_cache: bool = True,
+                        params: Optional[List[Any]] = None, timeout: Optional[float] = None,
+                        max_bytes: Optional[int] = None, max_tokens: Optional[int] = None) -> Dict[str, Any]:
+    """执行SQL查询并返回结果
+    
+    Args:
+        query: SQL查询语句
+        format: 结果格式。"rows"（默认）为字典列表；"columnar"为列式结果，
+            列名只返回一次，重复字符串用dictionaries中的下标表示，适合大结果集
+        use_cache: 是否使用查询结果缓存，需要绕过缓存读取最新数据时传False
+        params: 绑定参数列表，依次对应query中的%s占位符。提供时以服务器端预处理语句执行，
+            同一连接上重复执行相同的语句不再重新解析；参数值不会被拼接进SQL文本
+        timeout: 本次调用的超时秒数，默认使用QUERY_TIMEOUT（或QUERY_TOOL_TIMEOUTS中的配置）；
+            超时或请求被取消时，正在执行的语句会在服务器端被终止
+        max_bytes: 结果序列化后的字节预算，默认QUERY_MAX_RESPONSE_BYTES；结果行装满预算即停止
+        max_tokens: 结果的token预算（按字节粗略换算），与max_bytes同时指定时取较小者
+        
+    Returns:
+        查询结果或错误信息。结果超过字节预算或行数上限时truncated为True，
+        total_row_count为总行数（total_row_count_exact为False时是估算值，无法估算时为None）；
+        有行被丢弃或单元格被截断时附带response_budget，说明截断原因、丢弃的行数和被截断的列；
+        需要完整结果时请使用export_query导出到文件。来自缓存的结果带有cached: True。
+        预估代价超出预算时附带query_plan（代价、扫描行数、各表访问方式和问题提示），
+        QUERY_GUARD_MODE为reject时这类查询不会执行，直接返回错误和query_plan
+    """
+    if format not in RESULT_FORMATS:
+        return {"error": f"不支持的结果格式: {format}，支持的格式有: {', '.join(RESULT_FORMATS)}"}
+    try:
+        byte_limit = _response_byte_limit(max_bytes, max_tokens)
+        # 不同预算下的结果不同，预算计入缓存键和合并键
+        budget_format = f"{format}@{byte_limit}"
+        cache_key = _result_cache_key(query, budget_format, params) if use_cache else None
+        if cache_key is not None:
+            cached = result_cache.get(cache_key)
+            if cached is not None:
+                logger.info(f"查询命中结果缓存: {query}")
+                return dict(cached, cached=True)
+        timeout = _tool_timeout("execute_query", timeout)
+
+        def run():
+            return db_executor.run_cancellable(
+                _execute_query_sync, query, format, cache_key, params, timeout, byte_limit, timeout=timeout
+            )
+
+        flight_key = _single_flight_key(query, budget_format, params)
+        if flight_key is None:
+            return await run()
+        # 相同的只读查询正在执行时直接等待其结果，不再重复发送到数据库；
+        # 所有等待者都取消后合并的调用才会被取消并终止语句
+        return await single_flight.do(flight_key, run)
+    except Exception as e:
+        logger.error(f"查询执行失败: {str(e)}")
+        return {"error": str(e)}
+
+# ======= 批量执行 =======
+
+def _execute_batch_sync(statements: Optional[List[str]], statement: Optional[str],
+                        param_rows: Optional[List[List[Any]]],
+                        handle: Optional[QueryHandle] = None) -> Dict[str, Any]:
+    """在工作线程中于单个连接、单个事务内执行一批写语句，由execute_batch调度"""
+    batch = statements if statements is not None else [statement]
+    for index, sql in enumerate(batch):
+        normalized = sql.strip().upper()
+        if normalized.startswith(("SELECT", "SHOW", "DESCRIBE")):
+            return {"error": f"第{index + 1}条语句是查询语句，execute_batch只用于写操作，请使用execute_query"}
+        if _is_ddl(sql):
+            # DDL会隐式提交事务，无法随批次一起回滚
+            return {"error": f"第{index + 1}条语句是DDL，DDL会隐式提交事务，不能放在批量事务中执行"}
+
+    start = time.monotonic()
+    try:
+        conn = db_pool.acquire()
+    except Exception as e:
+        logger.error(f"数据库连接错误: {str(e)}")
+        return {"error": "无法连接到数据库"}
+    if handle is not None and not handle.attach(conn):
+        db_pool.release(conn)
+        return {"error": "批量执行已取消"}
+    cursor = None
+    discard = False
+    affected_rows = []
+    current = 0
+    try:
+        # 在执行前确定各语句写入的表，提交后统一失效缓存
+        written_tables = [_written_tables(sql, conn) for sql in batch]
+        cursor = conn.cursor()
+        conn.start_transaction()
+        if statements is not None:
+            for current, sql in enumerate(statements):
+                cursor.execute(sql)
+                affected_rows.append(cursor.rowcount)
+        else:
+            # 分块executemany：INSERT ... VALUES会被驱动改写为多行INSERT，其余语句逐行执行
+            for offset in range(0, len(param_rows), BATCH_CHUNK_ROWS):
+                current = offset
+                chunk = [tuple(row) for row in param_rows[offset:offset + BATCH_CHUNK_ROWS]]
+                cursor.executemany(statement, chunk)
+                affected_rows.append(cursor.rowcount)
+        conn.commit()
+    except Exception as e:
+        if isinstance(e, (mysql.connector.errors.OperationalError, mysql.connector.errors.InterfaceError)):
+            # 连接已断开，服务器会丢弃未提交的事务；丢弃该连接
+            discard = True
+            raise
+        try:
+            conn.rollback()
+        except Exception as rollback_error:
+            logger.error(f"批量执行回滚失败: {str(rollback_error)}")
+        logger.error(f"批量执行失败，已回滚: {str(e)}")
+        if statements is not None:
+            location = {"failed_statement_index": current}
+        else:
+            location = {"failed_chunk_start_row": current}
+        return dict({"error": str(e), "rolled_back": True}, **location)
+    finally:
+        if cursor is not None:
+            try:
+                cursor.close()
+            except Exception:
+                discard = True
+        if handle is not None:
+            handle.detach()
+            # 被KILL QUERY终止的连接可能残留中断标记，不再复用
+            discard = discard or handle.killed
+        db_pool.release(conn, discard=discard)
+
+    for tables, sql in zip(written_tables, batch):
+        _after_write(tables, sql.strip().upper())
+    elapsed = time.monotonic() - start
+    total = sum(count for count in affected_rows if count and count > 0)
+    logger.info(f"批量执行完成，共影响 {total} 行，耗时 {elapsed:.3f}秒")
+    result = {
+        "success": True,
+        "total_affected_rows": total,
+        "elapsed_seconds": round(elapsed, 3)
+    }
+    if statements is not None:
+        result.update(mode="statements", statement_count=len(statements), affected_rows=affected_rows)
+    else:
+        result.update(mode="executemany", param_row_count=len(param_rows), chunk_affected_rows=affected_rows)
+    return result
+
+@server.tool()
+async def execute_batch(statements: Optional[List[str]] = None, statement: Optional[str] = None,
+                        params: Optional[List[List[Any]]] = None, timeout: Optional[float] = None) -> Dict[str, Any]:
+    """在一个事务中批量执行写操作，全部成功才提交，任一条失败则整体回滚
+    
+    两种用法二选一：
+    - statements: 多条独立的INSERT/UPDATE/DELETE语句，按顺序执行
+    - statement + params: 一条带%s占位符的语句和多行参数，以executemany分块执行；
+      INSERT ... VALUES会合并为多行INSERT，适合一次写入成千上万行
+    
+    Args:
+        statements: 写语句列表
+        statement: 带%s占位符的写语句
+        params: 参数行列表，每行依次对应statement中的占位符
+        timeout: 整个批次的超时秒数，默认使用QUERY_TIMEOUT（或QUERY_TOOL_TIMEOUTS中的配置）；
+            超时或请求被取消时终止正在执行的语句并回滚
+        
+    Returns:
+        statements模式返回每条语句影响的行数；executemany模式返回参数行数和每个分块影响的行数；
+        失败时返回错误、失败的位置，以及rolled_back: True
+    """
+    if (statements is None) == (statement is None):
+        return {"error": "请提供statements，或者提供statement和params，二者只能选一种"}
+    if statement is not None and not params:
+        return {"error": "使用statement时需要提供params参数行列表"}
+    if statements is not None and not statements:
+        return {"error": "statements不能为空"}
+    try:
+        logger.info(f"批量执行 {len(statements) if statements is not None else len(params)} 条"
+                    f"{'语句' if statements is not None else '参数行'}")
+        timeout = _tool_timeout("execute_batch", timeout)
+        return await db_executor.run_cancellable(
+            _execute_batch_sync, statements, statement, params, timeout=timeout
+        )
+    except Exception as e:
+        logger.error(f"批量执行失败: {str(e)}")
+        return {"error": str(e)}
+
+# ======= Excel导入 =======
+
+EXCEL_LOAD_METHODS = ("auto", "load_data", "executemany")
+EXCEL_IF_EXISTS = ("fail", "append", "replace")
+# 服务器或客户端未开启local_infile时LOAD DATA LOCAL返回的错误码，auto模式下据此退回executemany
+ER_LOCAL_INFILE_DISABLED = (1148, 2068, 3948)
+
+_INFILE_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r", "\0": "\\0"})
+
+def _infile_value(value) -> str:
+    """把单元格的值编码为LOAD DATA默认格式（制表符分隔、反斜杠转义、\\N表示NULL）的一个字段"""
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, datetime):
+        return value.isoformat(sep=" ")
+    if isinstance(value, timedelta):
+        return _format_time(value)
+    if hasattr(value, "isoformat"):
+        # date和time
+        return value.isoformat()
+    return str(value).translate(_INFILE_ESCAPES)
+
+def _sql_string(value: str) -> str:
+    """把字符串转换为SQL字符串字面量"""
+    return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+def _load_infile_chunk(cursor, table_name: str, columns: List[str], rows: List[tuple]) -> int:
+    """把一块数据写入EXCEL_LOAD_INFILE_DIR下的临时文件，再用LOAD DATA LOCAL INFILE导入，返回导入的行数"""
+    fd, path = tempfile.mkstemp(suffix=".tsv", dir=EXCEL_LOAD_INFILE_DIR)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8", newline="\n") as f:
+            f.writelines("\t".join(map(_infile_value, row)) + "\n" for row in rows)
+        cursor.execute(
+            f"LOAD DATA LOCAL INFILE {_sql_string(os.path.abspath(path))} "
+            f"INTO TABLE {_quote_identifier(table_name)} CHARACTER SET utf8mb4 "
+            f"({', '.join(map(_quote_identifier, columns))})"
+        )
+        return cursor.rowcount
+    finally:
+        os.remove(path)
+
+def _insert_chunk(cursor, insert_sql: str, rows: List[tuple]) -> int:
+    """以executemany写入一块数据，按BATCH_CHUNK_ROWS拆分，避免单个多行INSERT超过max_allowed_packet
+
+    warning_count只反映最近一条语句，每个批次执行后都要检查，否则前面批次的警告会被后面的覆盖。
+    """
+    inserted = 0
+    for offset in range(0, len(rows), BATCH_CHUNK_ROWS):
+        batch = rows[offset:offset + BATCH_CHUNK_ROWS]
+        cursor.executemany(insert_sql, batch)
+        _check_chunk_written(cursor, len(batch), cursor.rowcount)
+        inserted += cursor.rowcount
+    return inserted
+
+def _check_chunk_written(cursor, expected: int, written: int):
+    """确认一块数据原样写入，行数不符或有警告时抛出异常，由调用方回滚整个导入
+
+    LOAD DATA LOCAL相当于带IGNORE：不符合推断类型的值被转换或截断、主键重复的行被跳过，都只产生警告；
+    非严格sql_mode下的INSERT也是如此。这些情况按失败处理，不能把缺失或被改写的数据报告为导入成功。
+    """
+    warning_count = getattr(cursor, "warning_count", 0) or 0
+    if written == expected and not warning_count:
+        return
+    messages = []
+    if warning_count:
+        cursor.execute("SHOW WARNINGS LIMIT 5")
+        messages = [_text(row[2]) for row in cursor.fetchall()]
+    detail = f"：{'; '.join(messages)}" if messages else ""
+    raise RuntimeError(f"数据块应写入{expected}行，实际写入{written}行，产生{warning_count}条警告{detail}")
+
+def _existing_table_columns(cursor, table_name: str):
+    """返回已有表的(表名, 列名列表)，表不存在时返回None"""
+    cursor.execute(
+        "SELECT TABLE_NAME, COLUMN_NAME FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s ORDER BY ORDINAL_POSITION",
+        (table_name,)
+    )
+    rows = cursor.fetchall()
+    if not rows:
+        return None
+    return _text(rows[0][0]), [_text(row[1]) for row in rows]
+
+def _drop_table_quietly(cursor, table_name: str):
+    try:
+        cursor.execute(f"DROP TABLE IF EXISTS {_quote_identifier(table_name)}")
+    except Exception as e:
+        logger.error(f"删除导入失败的表 {table_name} 失败: {str(e)}")
+
+def _index_definition(column: Dict[str, Any]) -> str:
+    """为导入后的列生成ADD INDEX子句，TEXT列使用前缀索引"""
+    prefix = "(191)" if column["mysql_type"].endswith("TEXT") else ""
+    name = f"idx_{column['name']}"[:excel_io.MAX_IDENTIFIER_LENGTH]
+    return f"ADD INDEX {_quote_identifier(name)} ({_quote_identifier(column['name'])}{prefix})"
+
+def _load_excel_sync(file_path: str, table_name: str, sheet_name: Union[str, int], if_exists: str,
+                     method: str, primary_key: Optional[str], indexes: List[str],
+                     disable_checks: Optional[bool], sample_rows: int,
+                     handle: Optional[QueryHandle] = None) -> Dict[str, Any]:
+    """在工作线程中把工作表导入MySQL表，由load_excel_to_table调度
+
+    流式读取前sample_rows行推断列类型，随后在单个事务内分块写入，Excel解析与写入在两个线程中重叠进行。
+    新建的表只带主键，二级索引在数据提交后一次性创建；replace模式先导入临时表，
+    全部成功后再用RENAME TABLE原子地替换原表，失败时原表保持不变。
+    """
+    start = time.monotonic()
+    via = method
+    if method == "auto":
+        via = "load_data" if EXCEL_LOAD_INFILE_DIR else "executemany"
+    chunk_rows = EXCEL_LOAD_INFILE_ROWS if via == "load_data" else BATCH_CHUNK_ROWS
+
+    with excel_io.SheetReader(file_path, sheet_name) as reader:
+        # primary_key和indexes可以使用表头原文，按与表头相同的规则规范化后再匹配
+        column_map = {name.lower(): name for name in reader.columns}
+        requested = ([primary_key] if primary_key else []) + indexes
+        keys = [excel_io.normalize_column_names([name])[0].lower() for name in requested]
+        unknown = [name for name, key in zip(requested, keys) if key not in column_map]
+        if unknown:
+            return {"error": f"工作表中没有这些列: {unknown}", "sheet_columns": reader.columns}
+        resolved = [column_map[key] for key in keys]
+        primary_key, indexes = (resolved[0], resolved[1:]) if primary_key else (None, resolved)
+
+        chunks = excel_io.prefetch(reader.chunks(chunk_rows))
+        try:
+            sample, sampled = [], 0
+            for chunk in chunks:
+                sample.append(chunk)
+                sampled += len(chunk)
+                if sampled >= sample_rows:
+                    break
+            column_types = excel_io.infer_column_types(reader.columns, itertools.chain.from_iterable(sample))
+            infer_seconds = time.monotonic() - start
+
+            try:
+                conn = db_pool.acquire()
+            except Exception as e:
+                logger.error(f"数据库连接错误: {str(e)}")
+                return {"error": "无法连接到数据库"}
+            if handle is not None and not handle.attach(conn):
+                db_pool.release(conn)
+                return {"error": "导入已取消"}
+            cursor = conn.cursor()
+            discard = False
+            checks_disabled = False
+            created = False
+            target = table_name
+            loaded = 0
+            try:
+                existing = _existing_table_columns(cursor, table_name)
+                if existing is not None and if_exists == "fail":
+                    return {"error": f"表 {existing[0]} 已存在；追加数据请设置if_exists='append'，"
+                                     "替换原表请设置if_exists='replace'"}
+                if existing is not None and if_exists == "append":
+                    target, table_columns = existing
+                    table_lookup = {name.lower(): name for name in table_columns}
+                    missing = [name for name in reader.columns if name.lower() not in table_lookup]
+                    if missing:
+                        return {"error": f"表 {target} 中没有这些列: {missing}", "table_columns": table_columns}
+                    if indexes:
+                        return {"error": "indexes只用于新建或替换的表，已有表请使用execute_query添加索引"}
+                    columns = [table_lookup[name.lower()] for name in reader.columns]
+                else:
+                    # 新建表；replace模式先导入同库的临时表
+                    if existing is not None:
+                        target = f"{existing[0][:48]}__loading"
+                        _drop_table_quietly(cursor, target)
+                    cursor.execute(excel_io.create_table_sql(target, column_types, primary_key))
+                    created = True
+                    columns = reader.columns
+
+                # 新建的表没有外键和二级唯一索引，默认关闭唯一性和外键检查以减少写入时的索引查找
+                if created if disable_checks is None else disable_checks:
+                    cursor.execute("SET SESSION unique_checks = 0, foreign_key_checks = 0")
+                    checks_disabled = True
+
+                insert_sql = (f"INSERT INTO {_quote_identifier(target)} "
+                              f"({', '.join(map(_quote_identifier, columns))}) "
+                              f"VALUES ({', '.join(['%s'] * len(columns))})")
+                chunk_count = 0
+                load_start = time.monotonic()
+                conn.start_transaction()
+                for chunk in itertools.chain(sample, chunks):
+                    if handle is not None and handle.cancelled:
+                        raise RuntimeError("导入已取消")
+                    written = None
+                    if via == "load_data":
+                        try:
+                            written = _load_infile_chunk(cursor, target, columns, chunk)
+                        except mysql.connector.errors.Error as e:
+                            if method != "auto" or chunk_count or e.errno not in ER_LOCAL_INFILE_DISABLED:
+                                raise
+                            logger.warning(f"LOAD DATA LOCAL INFILE不可用，改用executemany导入: {str(e)}")
+                            via = "executemany"
+                        else:
+                            _check_chunk_written(cursor, len(chunk), written)
+                    if via == "executemany":
+                        # 逐批检查写入行数和警告
+                        written = _insert_chunk(cursor, insert_sql, chunk)
+                    loaded += written
+                    chunk_count += 1
+                conn.commit()
+                load_seconds = time.monotonic() - load_start
+
+                index_start = time.monotonic()
+                if indexes:
+                    types = {column["name"]: column for column in column_types}
+                    cursor.execute(f"ALTER TABLE {_quote_identifier(target)} "
+                                   + ", ".join(_index_definition(types[name]) for name in indexes))
+                index_seconds = time.monotonic() - index_start
+                if created and existing is not None:
+                    backup = f"{existing[0][:47]}__replaced"
+                    _drop_table_quietly(cursor, backup)
+                    cursor.execute(f"RENAME TABLE {_quote_identifier(existing[0])} TO {_quote_identifier(backup)}, "
+                                   f"{_quote_identifier(target)} TO {_quote_identifier(existing[0])}")
+                    target = existing[0]
+                    _drop_table_quietly(cursor, backup)
+            except Exception as e:
+                # 连接层错误说明连接已不可用，服务器会丢弃未提交的事务
+                discard = isinstance(e, (mysql.connector.errors.OperationalError, mysql.connector.errors.InterfaceError))
+                if not discard:
+                    try:
+                        conn.rollback()
+                    except Exception as rollback_error:
+                        logger.error(f"导入回滚失败: {str(rollback_error)}")
+                    if created:
+                        _drop_table_quietly(cursor, target)
+                logger.error(f"Excel导入失败，已回滚: {str(e)}")
+                return {
+                    "error": str(e),
+                    "rolled_back": True,
+                    "rows_before_failure": loaded,
+                    "hint": "列类型由前sample_rows行推断，若后续行的值不符合推断的类型，"
+                            "可增大sample_rows，或先建好表再使用if_exists='append'导入"
+                }
+            finally:
+                if checks_disabled and not discard:
+                    try:
+                        cursor.execute("SET SESSION unique_checks = DEFAULT, foreign_key_checks = DEFAULT")
+                    except Exception:
+                        discard = True
+                try:
+                    cursor.close()
+                except Exception:
+                    discard = True
+                if handle is not None:
+                    handle.detach()
+                    discard = discard or handle.killed
+                db_pool.release(conn, discard=discard)
+        finally:
+            chunks.close()
+
+    if created:
+        _after_write([target], "CREATE TABLE")
+    else:
+        _after_write([target], "INSERT")
+    elapsed = time.monotonic() - start
+    rows_per_second = round(loaded / elapsed) if elapsed > 0 else None
+    logger.info(f"Excel导入完成: {loaded} 行写入 {target}，耗时 {elapsed:.3f}秒（{rows_per_second} 行/秒）")
+    return {
+        "success": True,
+        "table": target,
+        "mode": ("replace" if existing is not None else "create") if created else "append",
+        "method": via,
+        "sheet_name": reader.sheet_name,
+        "rows_loaded": loaded,
+        "chunks": chunk_count,
+        "columns": [{"name": column, "mysql_type": info["mysql_type"]} if created
+                    else {"name": column, "source": info["name"]}
+                    for column, info in zip(columns, column_types)],
+        "indexes": indexes,
+        "checks_disabled": checks_disabled,
+        "rows_per_second": rows_per_second,
+        "timing": {
+            "infer_seconds": round(infer_seconds, 3),
+            "load_seconds": round(load_seconds, 3),
+            "index_seconds": round(index_seconds, 3),
+            "total_seconds": round(elapsed, 3)
+        }
+    }
+
+@server.tool()
+async def load_excel_to_table(file_path: str, table_name: str, sheet_name: Union[str, int] = 0,
+                              if_exists: str = "fail", method: str = "auto", primary_key: Optional[str] = None,
+                              indexes: Optional[List[str]] = None, disable_checks: Optional[bool] = None,
+                              sample_rows: int = 10000, timeout: Optional[float] = None) -> Dict[str, Any]:
+    """把Excel工作表批量导入MySQL表，适合几十万到上百万行的数据
+    
+    工作表被流式分块读取（第一行为表头），在单个事务中写入，任一块失败则整体回滚；
+    值不符合列类型被转换或截断、主键重复被跳过等只产生警告的情况也按失败处理。
+    列类型由前sample_rows行推断（可先用Excel服务器的infer_excel_schema预览）。
+    
+    Args:
+        file_path: Excel文件路径
+        table_name: 目标表名
+        sheet_name: 工作表名称或索引，默认为第一个工作表
+        if_exists: 表已存在时的处理方式：fail（默认，报错）、append（按列名追加到已有表）、
+            replace（导入到临时表后原子地替换原表）
+        method: auto（默认，配置了EXCEL_LOAD_INFILE_DIR时使用LOAD DATA LOCAL INFILE，不可用时退回executemany）、
+            load_data 或 executemany
+        primary_key: 新建表时作为主键的列，默认添加自增的id列作为主键
+        indexes: 新建表时需要创建二级索引的列，数据写入后再统一创建
+        disable_checks: 导入期间是否关闭unique_checks和foreign_key_checks，默认只对新建的表关闭
+        sample_rows: 用于推断列类型的行数
+        timeout: 导入的超时秒数，默认使用EXCEL_LOAD_TIMEOUT；超时或请求被取消时终止正在执行的语句并回滚
+        
+    Returns:
+        导入的表名、模式、实际使用的写入方式、行数、各阶段耗时和每秒写入行数
+    """
+    if if_exists not in EXCEL_IF_EXISTS:
+        return {"error": f"不支持的if_exists: {if_exists}，可选值: {', '.join(EXCEL_IF_EXISTS)}"}
+    if method not in EXCEL_LOAD_METHODS:
+        return {"error": f"不支持的导入方式: {method}，可选值: {', '.join(EXCEL_LOAD_METHODS)}"}
+    if method == "load_data" and not EXCEL_LOAD_INFILE_DIR:
+        return {"error": "未配置EXCEL_LOAD_INFILE_DIR，无法使用LOAD DATA LOCAL INFILE，请使用executemany"}
+    if sample_rows < 1:
+        return {"error": "sample_rows必须大于0"}
+    try:
+        logger.info(f"导入Excel: {file_path} -> {table_name}")
+        if timeout is None:
+            timeout = TOOL_TIMEOUTS.get("load_excel_to_table", EXCEL_LOAD_TIMEOUT)
+        return await db_executor.run_cancellable(
+            _load_excel_sync, file_path, table_name, sheet_name, if_exists, method, primary_key,
+            indexes or [], disable_checks, sample_rows, timeout=_tool_timeout("load_excel_to_table", timeout)
+        )
+    except Exception as e:
+        logger.error(f"Excel导入失败: {str(e)}")
+        return {"error": str(e)}
+
+# ======= 分页查询 =======
+
+def _normalize_sql(query: str) -> str:
+    """规范化SQL文本：去掉首尾空白和结尾分号，并合并连续空白
+
+    字符串字面量中的空白也会被合并，行注释会吞掉其后的子句，结果只能用于比较或查找，不能拿去执行。
+    """
+    return " ".join(query.strip().rstrip(";").split())
+
+def _strip_sql(query: str) -> str:
+    """只去掉首尾空白和结尾分号，保留原文中的字面量、注释和换行，可以安全地嵌入其他语句执行"""
+    return query.strip().rstrip(";").rstrip()
+
+def _quote_identifier(name: str) -> str:
+    """用反引号引用标识符"""
+    return "`" + name.replace("`", "``") + "`"
+
+def _token_value(value):
+    """将键值转换为可放入分页令牌的JSON值，Decimal保留为字符串以免损失精度"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode("utf-8", errors="replace")
+    return value
+
+def _encode_page_token(payload: Dict[str, Any]) -> str:
+    """生成带HMAC签名的不透明分页令牌"""
+    body = base64.urlsafe_b64encode(
+        json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    ).decode("ascii").rstrip("=")
+    signature = hmac.new(PAGE_TOKEN_SECRET, body.encode("ascii"), hashlib.sha256).hexdigest()[:32]
+    return f"{body}.{signature}"
+
+def _decode_page_token(token: str) -> Dict[str, Any]:
+    """校验并解析分页令牌，签名不符时抛出ValueError"""
+    try:
+        body, signature = token.rsplit(".", 1)
+    except ValueError:
+        raise ValueError("无效的分页令牌")
+    expected = hmac.new(PAGE_TOKEN_SECRET, body.encode("ascii"), hashlib.sha256).hexdigest()[:32]
+    if not hmac.compare_digest(signature, expected):
+        raise ValueError("分页令牌无效或已过期")
+    padding = "=" * (-len(body) % 4)
+    return json.loads(base64.urlsafe_b64decode(body + padding).decode("utf-8"))
+
+def _execute_paged_query_sync(query: str, page_size: int, page_token: Optional[str],
+                              key_columns: Optional[List[str]], descending: bool,
+                              result_format: str = "rows", timeout: Optional[float] = None,
+                              max_bytes: Optional[int] = None, handle: Optional[QueryHandle] = None) -> Dict[str, Any]:
+    """在工作线程中执行一页键集分页查询，由execute_paged_query调度"""
+    # 规范化的文本只用于令牌指纹和推断键列，执行的是原文
+    normalized = _normalize_sql(query)
+    if not normalized.upper().startswith(("SELECT", "WITH")):
+        return {"error": "分页查询只支持SELECT语句"}
+    fingerprint = hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:16]
+    page_size = max(1, min(page_size, MAX_RESULT_ROWS))
+
+    last_values = None
+    page = 1
+    if page_token:
+        try:
+            state = _decode_page_token(page_token)
+        except ValueError as e:
+            return {"error": str(e)}
+        if state.get("q") != fingerprint:
+            return {"error": "分页令牌与当前查询不匹配，请使用首次查询返回的令牌并保持查询语句不变"}
+        key_columns = state["k"]
+        last_values = state["v"]
+        descending = state.get("d", False)
+        page = state.get("p", 1) + 1
+
+    conn = db_pool.acquire()
+    if handle is not None and not handle.attach(conn):
+        db_pool.release(conn)
+        return {"error": "查询已取消"}
+    discard = False
+    try:
+        if not key_columns:
+            # 未指定键列时，使用FROM后第一个表的主键
+            match = re.search(r"\bFROM\s+`?(\w+)`?", normalized, re.IGNORECASE)
+            table = schema_cache.get_table(match.group(1), conn) if match else None
+            if table:
+                key_columns = table["primary_key"]
+            if not key_columns:
+                return {"error": "无法推断分页键列，请通过key_columns指定能唯一确定行顺序的列（如主键）"}
+
+        quoted = [f"_page.{_quote_identifier(col)}" for col in key_columns]
+        direction = "DESC" if descending else "ASC"
+        # 超时由服务器按MAX_EXECUTION_TIME提示自行终止
+        hint = f"/*+ MAX_EXECUTION_TIME({max(1, int(timeout * 1000))}) */ " if timeout else ""
+        # 原文单独成行，末尾的行注释不会吞掉后面的) AS _page
+        sql = f"SELECT {hint}* FROM (\n{_strip_sql(query)}\n) AS _page"
+        params = []
+        if last_values is not None:
+            # 行构造器比较可以直接在索引上定位到上一页末尾，代价与页码无关
+            operator = "<" if descending else ">"
+            if len(quoted) == 1:
+                sql += f" WHERE {quoted[0]} {operator} %s"
+            else:
+                placeholders = ", ".join(["%s"] * len(quoted))
+                sql += f" WHERE ({', '.join(quoted)}) {operator} ({placeholders})"
+            params.extend(last_values)
+        sql += " ORDER BY " + ", ".join(f"{col} {direction}" for col in quoted)
+        sql += " LIMIT %s"
+        params.append(page_size + 1)
+
+        logger.info(f"执行分页查询(第{page}页): {sql}")
+        cursor = conn.cursor()
+        try:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+            columns = list(cursor.column_names)
+            # 按字节预算装填本页；装不下的行留到下一页，令牌从最后放入的行开始
+            budget = ResponseBudget(columns, result_format, _response_byte_limit() if max_bytes is None else max_bytes)
+            convert = _build_value_converter(cursor.description)
+            value_rows = []
+            for row in rows[:page_size]:
+                values = convert(row)
+                if not budget.admit(values):
+                    break
+                value_rows.append(values)
+            has_more = len(rows) > len(value_rows)
+            rows = rows[:len(value_rows)]
+            formatted = _format_values(columns, value_rows, result_format)
+        except mysql.connector.Error as e:
+            if e.errno == ER_QUERY_TIMEOUT:
+                limit = f"{timeout:g}秒" if timeout else "服务器的执行时间上限"
+                return {"error": f"分页查询执行超过{limit}，已被服务器终止；请缩小查询范围或增大timeout"}
+            raise
+        finally:
+            cursor.close()
+    except (mysql.connector.errors.OperationalError, mysql.connector.errors.InterfaceError):
+        discard = True
+        raise
+    finally:
+        if handle is not None:
+            handle.detach()
+            # 被KILL QUERY终止的连接可能残留中断标记，不再复用
+            discard = discard or handle.killed
+        db_pool.release(conn, discard=discard)
+
+    missing = [col for col in key_columns if col not in columns]
+    if missing:
+        return {"error": f"查询结果中缺少分页键列: {', '.join(missing)}"}
+
+    next_page_token = None
+    if has_more:
+        # 令牌中的键值取自转换前的原始值，避免Decimal转float损失精度
+        next_page_token = _encode_page_token({
+            "q": fingerprint,
+            "k": key_columns,
+            "v": [_token_value(rows[-1][columns.index(col)]) for col in key_columns],
+            "d": descending,
+            "p": page
+        })
+
+    result = {
+        "success": True,
+        "query_type": "SELECT",
+        "page": page,
+        "page_size": page_size,
+        "row_count": len(rows),
+        "key_columns": key_columns,
+        "has_more": has_more,
+        "next_page_token": next_page_token
+    }
+    result.update(formatted)
+    if budget.exceeded or budget.truncated_cells:
+        result["response_budget"] = dict(budget.report(), truncated_by="max_bytes" if budget.exceeded else None)
+    return result
+
+@server.tool()
+async def execute_paged_query(query: str, page_size: int = 100, page_token: Optional[str] = None,
+                              key_columns: Optional[List[str]] = None, descending: bool = False,
+                              format: str = "rows", timeout: Optional[float] = None,
+                              max_bytes: Optional[int] = None, max_tokens: Optional[int] = None) -> Dict[str, Any]:
+    """分页执行SELECT查询，适合浏览超过单次行数上限的结果
+    
+    采用键集分页：后续页通过键列上的范围条件直接定位，获取第N页与第1页的代价相同。
+    
+    Args:
+        query: SELECT查询语句（结果中需包含分页键列，查询自身的ORDER BY会被分页顺序取代）
+        page_size: 每页行数，不超过单次查询的行数上限
+        page_token: 上一页返回的next_page_token，首次查询时不传
+        key_columns: 分页键列，组合起来需唯一；默认使用FROM后第一个表的主键
+        descending: 是否按键列降序分页
+        format: 结果格式，"rows"或"columnar"，含义同execute_query
+        timeout: 本页查询的超时秒数，含义同execute_query
+        max_bytes: 本页结果的字节预算，含义同execute_query；装不下的行顺延到下一页
+        max_tokens: 本页结果的token预算，含义同execute_query
+        
+    Returns:
+        当前页结果；has_more为True时用next_page_token获取下一页
+    """
+    if format not in RESULT_FORMATS:
+        return {"error": f"不支持的结果格式: {format}，支持的格式有: {', '.join(RESULT_FORMATS)}"}
+    try:
+        timeout = _tool_timeout("execute_paged_query", timeout)
+        return await db_executor.run_cancellable(_execute_paged_query_sync, query, page_size, page_token,
+                                                 key_columns, descending, format, timeout,
+                                                 _response_byte_limit(max_bytes, max_tokens), timeout=timeout)
+    except Exception as e:
+        logger.error(f"分页查询失败: {str(e)}")
+        return {"error": str(e)}
+
+# ======= 查询导出 =======
+
+# 在只读事务中执行写语句时的错误码
+ER_READ_ONLY_TRANSACTION = 1792
+
+EXPORT_FORMATS = {"csv": ".csv", "jsonl": ".jsonl", "parquet": ".parquet"}
+
+class _CsvExportWriter:
+    """CSV导出：首行为列名，NULL写为空字段；使用带BOM的UTF-8，Excel可以直接打开中文内容"""
+
+    def __init__(self, path: str, names: List[str], description):
+        self._file = open(path, "w", encoding="utf-8-sig", newline="")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(names)
+
+    def write(self, rows: List[List[Any]]):
+        self._writer.writerows(rows)
+
+    def close(self):
+        self._file.close()
+
+class _JsonlExportWriter:
+    """JSON Lines导出：每行一个JSON对象，值与execute_query返回的JSON值一致"""
+
+    def __init__(self, path: str, names: List[str], description):
+        self._file = open(path, "w", encoding="utf-8")
+        self._names = names
+
+    def write(self, rows: List[List[Any]]):
+        names = self._names
+        self._file.writelines(
+            json.dumps(dict(zip(names, row)), ensure_ascii=False, default=json_serialize) + "\n"
+            for row in rows
+        )
+
+    def close(self):
+        self._file.close()
+
+_ARROW_INTEGER_TYPES = (FieldType.TINY, FieldType.SHORT, FieldType.LONG, FieldType.LONGLONG,
+                        FieldType.INT24, FieldType.YEAR, FieldType.BIT)
+_ARROW_FLOAT_TYPES = (FieldType.FLOAT, FieldType.DOUBLE, FieldType.DECIMAL, FieldType.NEWDECIMAL)
+
+class _ParquetExportWriter:
+    """Parquet导出：按MySQL列类型确定Arrow列类型，每批写为一个row group；需要安装pyarrow
+
+    DECIMAL与JSON输出一致按双精度浮点写出；日期和时间在转换后是ISO文本，由Arrow解析为date32/timestamp。
+    """
+
+    def __init__(self, path: str, names: List[str], description):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self._pa = pa
+        self._types = []
+        for column in description:
+            if column[1] in _ARROW_INTEGER_TYPES:
+                self._types.append(pa.int64())
+            elif column[1] in _ARROW_FLOAT_TYPES:
+                self._types.append(pa.float64())
+            elif column[1] in (FieldType.DATE, FieldType.NEWDATE):
+                self._types.append(pa.date32())
+            elif column[1] in (FieldType.DATETIME, FieldType.TIMESTAMP):
+                self._types.append(pa.timestamp("us"))
+            else:
+                self._types.append(pa.string())
+        self._schema = pa.schema(list(zip(names, self._types)))
+        self._writer = pq.ParquetWriter(path, self._schema, compression="snappy")
+
+    def write(self, rows: List[List[Any]]):
+        pa = self._pa
+        arrays = []
+        for values, arrow_type in zip(zip(*rows), self._types):
+            if pa.types.is_temporal(arrow_type):
+                arrays.append(pa.array(values, pa.string()).cast(arrow_type))
+            else:
+                arrays.append(pa.array(values, arrow_type))
+        self._writer.write_table(pa.Table.from_arrays(arrays, schema=self._schema))
+
+    def close(self):
+        self._writer.close()
+
+_EXPORT_WRITERS = {
+    "csv": _CsvExportWriter,
+    "jsonl": _JsonlExportWriter,
+    "parquet": _ParquetExportWriter
+}
+
+def _export_query_sync(query: str, params: Optional[List[Any]], export_format: str, path: str,
+                       handle: Optional[QueryHandle] = None) -> Dict[str, Any]:
+    """在工作线程中把查询结果流式写入文件，由export_query调度
+
+    使用非缓冲游标：驱动从socket边读边交付结果，每次fetchmany取EXPORT_CHUNK_ROWS行转换后立即写出，
+    内存占用与结果集大小无关。先写入.part临时文件，完整写完后再改名，失败时不留下不完整的文件。
+    查询在只读事务中执行：以WITH开头的DELETE/UPDATE等写语句会被服务器拒绝，不会在autocommit连接上被提交；
+    只读事务同时让整个导出读到同一个一致性快照。
+    """
+    start = time.monotonic()
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    partial = path + ".part"
+    try:
+        conn = db_pool.acquire()
+    except Exception as e:
+        logger.error(f"数据库连接错误: {str(e)}")
+        return {"error": "无法连接到数据库"}
+    if handle is not None and not handle.attach(conn):
+        db_pool.release(conn)
+        return {"error": "导出已取消"}
+
+    cursor = None
+    writer = None
+    discard = False
+    in_transaction = False
+    rows = 0
+    try:
+        conn.start_transaction(readonly=True)
+        in_transaction = True
+        cursor = conn.cursor(raw=RAW_FETCH)
+        cursor.execute(query, params or None)
+        if not cursor.with_rows:
+            return {"error": "查询没有返回结果集"}
+        names = list(cursor.column_names)
+        convert = _build_value_converter(cursor.description, RAW_FETCH)
+        writer = _EXPORT_WRITERS[export_format](partial, names, cursor.description)
+        while True:
+            if handle is not None and handle.cancelled:
+                raise RuntimeError("导出已取消")
+            batch = cursor.fetchmany(EXPORT_CHUNK_ROWS)
+            if not batch:
+                break
+            writer.write([convert(row) for row in batch])
+            rows += len(batch)
+        writer.close()
+        writer = None
+        os.replace(partial, path)
+    except mysql.connector.errors.Error as e:
+        if e.errno == ER_READ_ONLY_TRANSACTION:
+            # 语句在执行写入前即被拒绝，连接可以继续使用
+            return {"error": "export_query只支持SELECT查询，写操作请使用execute_query或execute_batch"}
+        # 中途失败时结果集可能未读完，连接不再复用
+        discard = True
+        logger.error(f"导出查询结果失败: {str(e)}")
+        return {"error": str(e), "rows_written_before_failure": rows}
+    except Exception as e:
+        discard = True
+        logger.error(f"导出查询结果失败: {str(e)}")
+        return {"error": str(e), "rows_written_before_failure": rows}
+    finally:
+        if writer is not None:
+            try:
+                writer.close()
+            except Exception:
+                pass
+        if os.path.exists(partial):
+            os.remove(partial)
+        if cursor is not None and not discard:
+            try:
+                cursor.close()
+            except Exception:
+                discard = True
+        if in_transaction and not discard:
+            # 只读事务没有需要提交的修改
+            try:
+                conn.rollback()
+            except Exception:
+                discard = True
+        if handle is not None:
+            handle.detach()
+            discard = discard or handle.killed
+        db_pool.release(conn, discard=discard)
+
+    elapsed = time.monotonic() - start
+    size = os.path.getsize(path)
+    logger.info(f"导出完成: {rows} 行，{size} 字节，耗时 {elapsed:.3f}秒 -> {path}")
+    return {
+        "success": True,
+        "path": path,
+        "format": export_format,
+        "rows": rows,
+        "columns": names,
+        "bytes": size,
+        "elapsed_seconds": round(elapsed, 3),
+        "rows_per_second": round(rows / elapsed) if elapsed > 0 else None
+    }
+
+@server.tool()
+async def export_query(query: str, format: str = "csv", file_name: Optional[str] = None,
+                       params: Optional[List[Any]] = None, timeout: Optional[float] = None) -> Dict[str, Any]:
+    """把SELECT查询的完整结果流式导出到本地文件，不受execute_query返回行数和字节数的限制
+    
+    结果分批从服务器读取并写入文件，内存占用恒定，适合导出整张表或大范围的明细数据。
+    
+    Args:
+        query: SELECT查询语句，可以使用%s占位符
+        format: 文件格式：csv（默认）、jsonl 或 parquet（需要安装pyarrow）
+        file_name: 文件名（不含目录），默认按时间生成；文件写在EXPORT_DIR下，同名文件会被覆盖
+        params: 按顺序绑定到%s占位符的参数
+        timeout: 导出的超时秒数，默认使用EXPORT_TIMEOUT；超时或请求被取消时终止查询并删除未写完的文件
+        
+    Returns:
+        文件的绝对路径、行数、列名、文件字节数和耗时
+    """
+    if format not in EXPORT_FORMATS:
+        return {"error": f"不支持的导出格式: {format}，可选值: {', '.join(EXPORT_FORMATS)}"}
+    if format == "parquet" and importlib.util.find_spec("pyarrow") is None:
+        return {"error": "导出Parquet需要安装pyarrow（pip install pyarrow），或改用csv/jsonl格式"}
+    query = query.strip().rstrip(";")
+    if not query.upper().startswith(("SELECT", "WITH")):
+        return {"error": "export_query只支持SELECT查询"}
+    if file_name is None:
+        file_name = f"export_{datetime.now():%Y%m%d_%H%M%S}_{os.urandom(3).hex()}"
+    if not file_name or os.path.basename(file_name) != file_name or file_name.startswith("."):
+        return {"error": f"无效的文件名: {file_name}，文件名不能包含目录"}
+    if not file_name.lower().endswith(EXPORT_FORMATS[format]):
+        file_name += EXPORT_FORMATS[format]
+    path = os.path.join(os.path.abspath(EXPORT_DIR), file_name)
+    try:
+        logger.info(f"导出查询结果({format}): {query}")
+        if timeout is None:
+            timeout = TOOL_TIMEOUTS.get("export_query", EXPORT_TIMEOUT)
+        return await db_executor.run_cancellable(
+            _export_query_sync, query, params, format, path, timeout=_tool_timeout("export_query", timeout)
+        )
+    except Exception as e:
+        logger.error(f"导出查询结果失败: {str(e)}")
+        return {"error": str(e)}
+
+# ======= 图表数据聚合 =======
+
+# 各图表类型默认的数据点上限：柱状图和饼图的类别过多时难以阅读，折线图和散点图按图片像素宽度取值
+CHART_DEFAULT_MAX_POINTS = {"bar": 100, "line": 2000, "scatter": 2500, "pie": 12}
+CHART_AGGREGATES = {"sum": "SUM", "avg": "AVG", "min": "MIN", "max": "MAX", "count": "COUNT"}
+# 数据量超过单次查询上限的折线图，先在SQL中聚合到max_points的这么多倍，再用LTTB选出max_points个点
+LTTB_OVERSAMPLING = 4
+
+# 时间分桶粒度：(名称, 近似秒数, 分桶表达式)，按从细到粗的顺序选择第一个桶数不超过上限的粒度
+_TIME_BUCKETS = [
+    ("minute", 60, "DATE_FORMAT({x}, '%Y-%m-%d %H:%i:00')"),
+    ("hour", 3600, "DATE_FORMAT({x}, '%Y-%m-%d %H:00:00')"),
+    ("day", 86400, "DATE_FORMAT({x}, '%Y-%m-%d')"),
+    ("week", 7 * 86400, "DATE_FORMAT(DATE_SUB({x}, INTERVAL WEEKDAY({x}) DAY), '%Y-%m-%d')"),
+    ("month", 30.44 * 86400, "DATE_FORMAT({x}, '%Y-%m-01')"),
+    ("quarter", 91.31 * 86400, "CONCAT(YEAR({x}), '-', LPAD(QUARTER({x}) * 3 - 2, 2, '0'), '-01')"),
+    ("year", 365.25 * 86400, "DATE_FORMAT({x}, '%Y-01-01')")
+]
+# 与_TIME_BUCKETS中各分桶表达式输出相同的桶标签，用于在进程内聚合已完整取回的结果
+_TIME_BUCKET_LABELS = {
+    "minute": lambda t: t.strftime("%Y-%m-%d %H:%M:00"),
+    "hour": lambda t: t.strftime("%Y-%m-%d %H:00:00"),
+    "day": lambda t: t.strftime("%Y-%m-%d"),
+    "week": lambda t: (t - timedelta(days=t.weekday())).strftime("%Y-%m-%d"),
+    "month": lambda t: t.strftime("%Y-%m-01"),
+    "quarter": lambda t: f"{t.year}-{(t.month - 1) // 3 * 3 + 1:02d}-01",
+    "year": lambda t: t.strftime("%Y-01-01")
+}
+
+def _chart_cache_key(x_values: List[Any], y_values: List[Any], sizes: Optional[List[int]],
+                     x_column: str, y_column: str, chart_type: str) -> Optional[str]:
+    """按实际绘制的数据和渲染参数计算图表缓存键；图表缓存关闭时返回None
+
+    键只取决于图片的内容来源，与查询文本无关：不同的SQL得到相同的绘图数据时共用同一张图片，
+    数据一旦变化键也随之变化，不会命中过时的图片。
+    """
+    if CHART_CACHE_MAX_BYTES <= 0:
+        return None
+    payload = json.dumps([chart_type, x_column, y_column, x_values, y_values, sizes],
+                         default=json_serialize, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _value_kind(values: List[Any]) -> str:
+    """根据查询结果判断x列的类别：numeric、temporal（ISO日期文本）或categorical"""
+    sample = [value for value in values if value is not None][:100]
+    if not sample:
+        return "categorical"
+    if all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in sample):
+        return "numeric"
+    if all(is_iso_date(value) for value in sample):
+        return "temporal"
+    return "categorical"
+
+def _time_bucket(x_min: str, x_max: str, max_buckets: int):
+    """选择桶数不超过max_buckets的最细时间粒度，返回(粒度名称, 分桶表达式模板)"""
+    span = (datetime.fromisoformat(x_max) - datetime.fromisoformat(x_min)).total_seconds()
+    for name, seconds, template in _TIME_BUCKETS:
+        if span / seconds + 1 <= max_buckets:
+            return name, template
+    return _TIME_BUCKETS[-1][0], _TIME_BUCKETS[-1][2]
+
+def _bin_width(low: float, high: float, bins: int) -> float:
+    """把[low, high]等分为bins个桶的桶宽；所有值相同时取1"""
+    return (high - low) / bins or 1
+
+def _numeric_bin(column: str, low: float, high: float, bins: int):
+    """把数值列等宽分为bins个桶，返回(桶序号表达式, 桶宽)"""
+    width = _bin_width(low, high, bins)
+    return f"LEAST(FLOOR(({column} - {low!r}) / {width!r}), {bins - 1})", width
+
+def _lttb_series(x_values: List[Any], y_values: List[Any], x_kind: str, max_points: int,
+                 report: Dict[str, Any]) -> Dict[str, Any]:
+    """用LTTB把按x排序的折线数据降采样到max_points个点"""
+    positions = ([datetime.fromisoformat(value).timestamp() for value in x_values]
+                 if x_kind == "temporal" else x_values)
+    try:
+        keep = lttb_indices(positions, y_values, max_points)
+    except TypeError:
+        return {"error": "折线图的y列必须是数值才能降采样"}
+    report.update(points=len(keep), downsampled_from=len(x_values))
+    return {
+        "x": [x_values[i] for i in keep],
+        "y": [y_values[i] for i in keep],
+        "aggregation": report
+    }
+
+def _plain_values(values) -> List[Any]:
+    """把pandas的Series或Index转换为Python值列表，NaN转换为None"""
+    return [None if pd.isna(value) else value for value in values.tolist()]
+
+def _aggregate_series(grouped, agg: str):
+    """对分组后的y列求聚合值，与SQL聚合函数一致：忽略NULL，全为NULL的组得到NULL"""
+    if agg == "sum":
+        return grouped.sum(min_count=1)
+    if agg == "avg":
+        return grouped.mean()
+    return getattr(grouped, agg)()
+
+def _value_bins(values, low: float, width: float, bins: int):
+    """数值等宽分桶的桶序号，与_numeric_bin生成的SQL表达式一致"""
+    return (((values - low) / width) // 1).clip(upper=bins - 1).astype(int)
+
+def _aggregate_chart_frame(df: pd.DataFrame, x_column: str, y_column: str, chart_type: str, x_kind: str,
+                           max_points: int, agg: str) -> Dict[str, Any]:
+    """完整取回的结果超过数据点上限时，在进程内按与_aggregate_chart_data相同的规则聚合
+
+    结果已经全部在手中，不必把查询包成派生表再执行一遍：既省去额外的往返，
+    也避免SELECT * ... JOIN这类带重名列的查询放进派生表后报错。
+    """
+    report = {"aggregate": agg, "max_points": max_points}
+    y_values = df[y_column]
+    if agg != "count":
+        try:
+            y_values = pd.to_numeric(y_values)
+        except (TypeError, ValueError):
+            return {"error": f"y列必须是数值才能按{agg}聚合"}
+    frame = pd.DataFrame({"_x": df[x_column], "_y": y_values})
+
+    if x_kind == "categorical":
+        grouped = _aggregate_series(frame.groupby("_x", dropna=False, sort=False)["_y"], agg)
+        if chart_type in ("bar", "pie"):
+            top = grouped.sort_values(ascending=False, na_position="last").iloc[:max_points]
+        else:
+            top = grouped.sort_index(na_position="first").iloc[:max_points]
+        x_values, y_values = _plain_values(top.index), _plain_values(top)
+        groups = len(grouped)
+        report.update(method="group_by", groups=groups, points=len(top))
+        if groups > len(top) and agg in ("sum", "count") and chart_type in ("bar", "pie"):
+            # 其余类别合并为一项，饼图的占比才与全部数据一致
+            total = sum(value for value in _plain_values(grouped) if value is not None)
+            x_values[-1] = "Other"
+            y_values[-1] = total - sum(value or 0 for value in y_values[:-1])
+            report["other_groups"] = groups - len(top) + 1
+        elif groups > len(top):
+            report["dropped_groups"] = groups - len(top)
+        return {"x": x_values, "y": y_values, "aggregation": report}
+
+    points = frame.dropna()
+    report["source_rows"] = len(points)
+    if points.empty:
+        return {"error": "查询没有返回x和y都非空的数据"}
+    if chart_type == "line":
+        # 按x排序后直接降采样，不需要先分桶
+        points = points.sort_values("_x")
+        report.update(aggregate=None, method="lttb")
+        return _lttb_series(points["_x"].tolist(), points["_y"].tolist(), x_kind, max_points, report)
+
+    x_min, x_max = _plain_values(points["_x"].agg(["min", "max"]))
+    buckets = max(1, math.isqrt(max_points)) if chart_type == "scatter" else max_points
+    if x_kind == "temporal":
+        bucket, _ = _time_bucket(x_min, x_max, buckets)
+        label = _TIME_BUCKET_LABELS[bucket]
+        x_bins = points["_x"].map(lambda value: label(datetime.fromisoformat(value)))
+    else:
+        width = _bin_width(x_min, x_max, buckets)
+        x_bins = _value_bins(points["_x"], x_min, width, buckets)
+
+    if chart_type == "scatter":
+        if not pd.api.types.is_numeric_dtype(points["_y"]):
+            return {"error": "散点图的y列必须是数值才能分桶聚合"}
+        if x_kind == "temporal":
+            report["x_bucket"] = bucket
+        else:
+            report["x_bin_width"] = width
+        y_min, y_max = _plain_values(points["_y"].agg(["min", "max"]))
+        y_width = _bin_width(y_min, y_max, buckets)
+        cells = points.assign(_xb=x_bins, _yb=_value_bins(points["_y"], y_min, y_width, buckets))
+        # 时间型x的点放在桶的起点，数值型x的点放在格内x的平均位置
+        cells = cells.groupby(["_xb", "_yb"]).agg(
+            _x=("_xb" if x_kind == "temporal" else "_x", "first" if x_kind == "temporal" else "mean"),
+            _y=("_y", "mean"),
+            _n=("_y", "size")
+        ).sort_values("_x")
+        report.update(method="grid_bins", grid=f"{buckets}x{buckets}", y_bin_width=y_width, points=len(cells))
+        return {
+            "x": _plain_values(cells["_x"]),
+            "y": _plain_values(cells["_y"]),
+            "sizes": _plain_values(cells["_n"]),
+            "aggregation": report
+        }
+
+    grouped = _aggregate_series(points.groupby(x_bins)["_y"], agg).sort_index()
+    if x_kind == "temporal":
+        x_values = _plain_values(grouped.index)
+        report.update(method="time_bucket", bucket=bucket)
+    else:
+        # 柱状图和饼图以区间作为类别标签
+        x_values = [f"[{x_min + index * width:g}, {x_min + (index + 1) * width:g})" for index in grouped.index]
+        report.update(method="value_bins", bin_width=width)
+    report["points"] = len(grouped)
+    return {"x": x_values, "y": _plain_values(grouped), "aggregation": report}
+
+async def _aggregate_chart_data(query: str, x_column: str, y_column: str, chart_type: str, x_kind: str,
+                                max_points: int, agg: str) -> Dict[str, Any]:
+    """结果超出单次查询的返回上限时，在SQL中按x分组或分桶聚合图表数据
+
+    - 类别型x：GROUP BY x；柱状图和饼图取聚合值最大的类别，其余合并为"其他"（sum/count时）
+    - 时间型x：按自动选择的时间粒度分桶；数值型x：等宽分桶
+    - 折线图：原始点数在单次查询上限内时取出全部点用LTTB降采样，否则先分桶再LTTB
+    - 散点图：x、y两个方向同时分桶，每个格子一个点，sizes为格子内的行数
+
+    Returns:
+        x、y值列表（散点图另有sizes）和说明聚合方式的aggregation，失败时返回error
+    """
+    base = query.strip().rstrip(";")
+    if not base.upper().startswith(("SELECT", "WITH")):
+        return {"error": "结果超过图表数据点上限，自动分桶聚合只支持SELECT查询；请在查询中自行聚合或缩小范围"}
+    x, y = _quote_identifier(x_column), _quote_identifier(y_column)
+    source = f"({base}) AS _chart"
+    func = CHART_AGGREGATES[agg]
+    report = {"aggregate": agg, "max_points": max_points}
+
+    if x_kind == "categorical":
+        order = "_v DESC" if chart_type in ("bar", "pie") else "_x"
+        result = await execute_query(
+            f"SELECT _x, _v, COUNT(*) OVER () AS _groups, SUM(_v) OVER () AS _total "
+            f"FROM (SELECT {x} AS _x, {func}({y}) AS _v FROM {source} GROUP BY {x}) AS _g "
+            f"ORDER BY {order} LIMIT {max_points}"
+        )
+        if "error" in result:
+            return result
+        rows = result.get("results") or []
+        if not rows:
+            return {"error": "查询没有返回结果"}
+        x_values = [row["_x"] for row in rows]
+        y_values = [row["_v"] for row in rows]
+        groups = rows[0]["_groups"]
+        report.update(method="group_by", groups=groups, points=len(rows))
+        if groups > len(rows) and agg in ("sum", "count") and chart_type in ("bar", "pie"):
+            # 其余类别合并为一项，饼图的占比才与全部数据一致
+            x_values[-1] = "Other"
+            y_values[-1] = (rows[0]["_total"] or 0) - sum(value or 0 for value in y_values[:-1])
+            report["other_groups"] = groups - len(rows) + 1
+        elif groups > len(rows):
+            report["dropped_groups"] = groups - len(rows)
+        return {"x": x_values, "y": y_values, "aggregation": report}
+
+    where = f"WHERE {x} IS NOT NULL AND {y} IS NOT NULL"
+    probe = await execute_query(
+        f"SELECT COUNT(*) AS _n, MIN({x}) AS _x_min, MAX({x}) AS _x_max, MIN({y}) AS _y_min, MAX({y}) AS _y_max "
+        f"FROM {source} {where}"
+    )
+    if "error" in probe:
+        return probe
+    stats = probe["results"][0]
+    report["source_rows"] = stats["_n"]
+    if not stats["_n"]:
+        return {"error": "查询没有返回x和y都非空的数据"}
+
+    if chart_type == "line" and stats["_n"] <= MAX_RESULT_ROWS:
+        # 原始点数在单次查询上限内：取出全部点，直接降采样
+        result = await execute_query(f"SELECT {x} AS _x, {y} AS _y FROM {source} {where} ORDER BY {x}")
+        if "error" in result:
+            return result
+        if not result.get("truncated"):
+            rows = result["results"]
+            report["method"] = "lttb"
+            return _lttb_series([row["_x"] for row in rows], [row["_y"] for row in rows], x_kind, max_points, report)
+
+    if chart_type == "scatter":
+        if not isinstance(stats["_y_min"], (int, float)):
+            return {"error": "散点图的y列必须是数值才能分桶聚合"}
+        grid = max(1, math.isqrt(max_points))
+        if x_kind == "temporal":
+            bucket, template = _time_bucket(stats["_x_min"], stats["_x_max"], grid)
+            x_bin = x_position = template.format(x=x)
+            report["x_bucket"] = bucket
+        else:
+            x_bin, width = _numeric_bin(x, stats["_x_min"], stats["_x_max"], grid)
+            x_position = f"AVG({x})"
+            report["x_bin_width"] = width
+        y_bin, y_width = _numeric_bin(y, stats["_y_min"], stats["_y_max"], grid)
+        result = await execute_query(
+            f"SELECT {x_position} AS _x, AVG({y}) AS _y, COUNT(*) AS _n FROM {source} {where} "
+            f"GROUP BY {x_bin}, {y_bin} ORDER BY _x"
+        )
+        if "error" in result:
+            return result
+        rows = result["results"]
+        report.update(method="grid_bins", grid=f"{grid}x{grid}", y_bin_width=y_width, points=len(rows))
+        return {
+            "x": [row["_x"] for row in rows],
+            "y": [row["_y"] for row in rows],
+            "sizes": [row["_n"] for row in rows],
+            "aggregation": report
+        }
+
+    buckets = min(MAX_RESULT_ROWS, max_points * LTTB_OVERSAMPLING) if chart_type == "line" else max_points
+    intervals = None
+    if x_kind == "temporal":
+        bucket, template = _time_bucket(stats["_x_min"], stats["_x_max"], buckets)
+        sql = (f"SELECT {template.format(x=x)} AS _x, {func}({y}) AS _v FROM {source} {where} "
+               f"GROUP BY _x ORDER BY _x")
+        report.update(method="time_bucket", bucket=bucket)
+    else:
+        bin_expr, width = _numeric_bin(x, stats["_x_min"], stats["_x_max"], buckets)
+        if chart_type == "line":
+            # 折线图的点放在桶内x的平均位置
+            sql = (f"SELECT AVG({x}) AS _x, {func}({y}) AS _v FROM {source} {where} "
+                   f"GROUP BY {bin_expr} ORDER BY _x")
+        else:
+            # 柱状图和饼图以区间作为类别标签
+            sql = f"SELECT {bin_expr} AS _x, {func}({y}) AS _v FROM {source} {where} GROUP BY _x ORDER BY _x"
+            intervals = (stats["_x_min"], width)
+        report.update(method="value_bins", bin_width=width)
+    result = await execute_query(sql)
+    if "error" in result:
+        return result
+    rows = result["results"]
+    if intervals:
+        low, width = intervals
+        x_values = [f"[{low + row['_x'] * width:g}, {low + (row['_x'] + 1) * width:g})" for row in rows]
+    else:
+        x_values = [row["_x"] for row in rows]
+    y_values = [row["_v"] for row in rows]
+    report["points"] = len(rows)
+    if chart_type == "line" and len(rows) > max_points:
+        report["method"] += "+lttb"
+        return _lttb_series(x_values, y_values, x_kind, max_points, report)
+    return {"x": x_values, "y": y_values, "aggregation": report}
+
+# ======= 表结构查询 =======
 
-logger.info(f"从环境变量加载数据库配置: {DB_CONFIG['host']}/{DB_CONFIG['database']}")
+def _text(value):
+    """information_schema中的文本列在部分驱动版本下以bytes返回，统一解码为str"""
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode("utf-8")
+    return value
 
-# 初始化MCP服务器
-server = FastMCP(name="mysql-server", description="MySQL数据库交互服务器")
+def _iso_text(value):
+    """把时间值转换为ISO格式文本"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return _text(value)
+
+def _load_schema(conn) -> Dict[str, Dict[str, Any]]:
+    """用三次information_schema批量查询加载所有表的结构、主键和索引
 
-def get_db_connection():
-    """创建并返回数据库连接"""
+    每张表的structure与DESCRIBE的输出字段一致（Field/Type/Null/Key/Default/Extra）。
+    """
+    cursor = conn.cursor()
     try:
-        return mysql.connector.connect(**DB_CONFIG)
-    except Exception as e:
-        logger.error(f"数据库连接错误: {str(e)}")
-        return None
+        cursor.execute(
+            """
+            SELECT TABLE_NAME, TABLE_ROWS, CREATE_TIME, UPDATE_TIME
+            FROM information_schema.TABLES
+            WHERE TABLE_SCHEMA = DATABASE()
+            ORDER BY TABLE_NAME
+            """
+        )
+        tables = {}
+        for table_name, table_rows, create_time, update_time in cursor.fetchall():
+            table_name = _text(table_name)
+            tables[table_name] = {
+                "name": table_name,
+                "table_rows": table_rows,
+                "create_time": _iso_text(create_time),
+                "update_time": _iso_text(update_time),
+                "structure": [],
+                "primary_key": [],
+                "indexes": []
+            }
 
-def json_serialize(obj):
-    """处理特殊类型的JSON序列化"""
-    if isinstance(obj, (datetime, date)):
-        return obj.isoformat()
-    elif hasattr(obj, 'decimal') or str(type(obj)) == "<class 'decimal.Decimal'>":
-        # 处理Decimal类型
-        return float(obj)
-    raise TypeError(f"Object of type {type(obj)} is not JSON serializable")
+        cursor.execute(
+            """
+            SELECT TABLE_NAME, COLUMN_NAME, COLUMN_TYPE, IS_NULLABLE, COLUMN_KEY, COLUMN_DEFAULT, EXTRA
+            FROM information_schema.COLUMNS
+            WHERE TABLE_SCHEMA = DATABASE()
+            ORDER BY TABLE_NAME, ORDINAL_POSITION
+            """
+        )
+        for table_name, field, column_type, nullable, key, default, extra in cursor.fetchall():
+            table = tables.get(_text(table_name))
+            if table is None:
+                continue
+            table["structure"].append({
+                "Field": _text(field),
+                "Type": _text(column_type),
+                "Null": _text(nullable),
+                "Key": _text(key),
+                "Default": _text(default),
+                "Extra": _text(extra)
+            })
 
-# ======= 数据库工具 =======
+        cursor.execute(
+            """
+            SELECT TABLE_NAME, INDEX_NAME, NON_UNIQUE, COLUMN_NAME, INDEX_TYPE
+            FROM information_schema.STATISTICS
+            WHERE TABLE_SCHEMA = DATABASE()
+            ORDER BY TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX
+            """
+        )
+        for table_name, index_name, non_unique, column_name, index_type in cursor.fetchall():
+            table = tables.get(_text(table_name))
+            if table is None:
+                continue
+            index_name = _text(index_name)
+            indexes = table["indexes"]
+            if not indexes or indexes[-1]["name"] != index_name:
+                indexes.append({
+                    "name": index_name,
+                    "unique": not int(non_unique),
+                    "columns": [],
+                    "type": _text(index_type)
+                })
+            indexes[-1]["columns"].append(_text(column_name))
+            if index_name == "PRIMARY":
+                table["primary_key"].append(_text(column_name))
+        return tables
+    finally:
+        cursor.close()
 
-@server.tool()
-async def execute_query(query: str) -> Dict[str, Any]:
-    """执行SQL查询并返回结果
-    
-    Args:
-        query: SQL查询语句
-        
-    Returns:
-        查询结果或错误信息
+def _schema_fingerprint(conn):
+    """计算表结构的变更指纹：表数量、表名校验和、最大CREATE_TIME以及列总数
+
+    只查询information_schema的数据字典，不会扫描任何用户表。
+    UPDATE_TIME反映的是数据写入而非结构变更，因此只随表信息缓存、不参与指纹。
     """
+    cursor = conn.cursor()
     try:
-        logger.info(f"执行SQL查询: {query}")
-        conn = get_db_connection()
-        if not conn:
-            logger.error("数据库连接失败")
-            return {"error": "无法连接到数据库"}
-            
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute(query)
-        
-        # 检查是否是SELECT查询
-        if query.strip().upper().startswith(("SELECT", "SHOW", "DESCRIBE")):
-            results = cursor.fetchall()
-            logger.debug(f"查询返回 {len(results)} 条结果")
-            try:
-                # 确保结果是可JSON序列化的
-                serializable_results = json.loads(
-                    json.dumps(results[:1000], default=json_serialize)
-                )
-                logger.info("成功序列化查询结果")
-                return {
-                    "success": True,
-                    "query_type": "SELECT",
-                    "row_count": len(results),
-                    "results": serializable_results
-                }
-            except Exception as e:
-                logger.error(f"JSON序列化失败: {str(e)}")
-                return {"error": f"结果序列化失败: {str(e)}"}
-        else:
-            # 对于INSERT, UPDATE, DELETE等查询
-            conn.commit()
-            logger.info(f"更新操作影响了 {cursor.rowcount} 行")
-            return {
-                "success": True,
-                "query_type": "UPDATE",
-                "affected_rows": cursor.rowcount,
-                "message": f"查询执行成功，影响了{cursor.rowcount}行"
-            }
-    except Exception as e:
-        logger.error(f"查询执行失败: {str(e)}")
-        return {"error": str(e)}
+        cursor.execute(
+            """
+            SELECT
+                COUNT(*),
+                COALESCE(SUM(CRC32(TABLE_NAME)), 0),
+                MAX(CREATE_TIME),
+                (SELECT COUNT(*) FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE())
+            FROM information_schema.TABLES
+            WHERE TABLE_SCHEMA = DATABASE()
+            """
+        )
+        return tuple(str(value) for value in cursor.fetchone())
+    finally:
+        cursor.close()
+
+class SchemaCache:
+    """进程内的表结构缓存（表、列、类型、主键和索引）
+
+    - 缓存超过ttl秒后，先用_schema_fingerprint做廉价检查，未变化则续期
+    - 超过max_age秒强制重新加载，兜底覆盖指纹检测不到的外部DDL
+    - execute_query执行DDL后调用invalidate()立即失效
+    """
+
+    def __init__(self, ttl: float = 300.0, max_age: float = 3600.0):
+        self.ttl = ttl
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._tables = None
+        self._fingerprint = None
+        self._loaded_at = 0.0
+        self._checked_at = 0.0
+        self._stats = {
+            "hits": 0,
+            "loads": 0,
+            "revalidations": 0,
+            "invalidations": 0
+        }
+
+    def _fresh(self, now: float) -> bool:
+        return self._tables is not None and now - self._checked_at < self.ttl
+
+    def get(self, conn=None) -> Dict[str, Dict[str, Any]]:
+        """返回 表名 -> 表结构信息 的字典（只读），必要时从数据库加载
+
+        Args:
+            conn: 可选，调用方已借出的连接；不传时从连接池借用
+        """
+        with self._lock:
+            if self._fresh(time.monotonic()):
+                self._stats["hits"] += 1
+                return self._tables
+
+        # 同一时间只允许一个线程加载，其余线程等待后直接使用加载结果
+        with self._load_lock:
+            with self._lock:
+                if self._fresh(time.monotonic()):
+                    self._stats["hits"] += 1
+                    return self._tables
+            if conn is None:
+                with db_pool.connection() as pooled_conn:
+                    return self._refresh(pooled_conn)
+            return self._refresh(conn)
+
+    def _refresh(self, conn) -> Dict[str, Dict[str, Any]]:
+        now = time.monotonic()
+        fingerprint = _schema_fingerprint(conn)
+        with self._lock:
+            if (self._tables is not None and fingerprint == self._fingerprint
+                    and now - self._loaded_at < self.max_age):
+                self._checked_at = now
+                self._stats["revalidations"] += 1
+                return self._tables
+
+        logger.info("加载表结构缓存")
+        tables = _load_schema(conn)
+        with self._lock:
+            self._tables = tables
+            self._fingerprint = fingerprint
+            self._loaded_at = self._checked_at = now
+            self._stats["loads"] += 1
+        return tables
+
+    def get_table(self, table_name: str, conn=None) -> Optional[Dict[str, Any]]:
+        """返回单张表的结构信息，表不存在时返回None"""
+        return self.get(conn).get(table_name)
+
+    def invalidate(self):
+        """使缓存立即失效，下次访问时重新加载"""
+        with self._lock:
+            self._tables = None
+            self._fingerprint = None
+            self._stats["invalidations"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """返回缓存命中与加载统计"""
+        with self._lock:
+            return dict(self._stats, cached_tables=len(self._tables) if self._tables is not None else 0)
+
+
+schema_cache = SchemaCache(SCHEMA_CACHE_TTL, SCHEMA_CACHE_MAX_AGE)
+
+def _estimate_table_rows(conn) -> Dict[str, Optional[int]]:
+    """从information_schema.TABLES读取所有表的估算行数（InnoDB统计信息，不扫描表）"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """
+            SELECT TABLE_NAME, TABLE_ROWS
+            FROM information_schema.TABLES
+            WHERE TABLE_SCHEMA = DATABASE()
+            """
+        )
+        return {_text(name): rows for name, rows in cursor.fetchall()}
     finally:
-        if 'conn' in locals() and conn is not None and conn.is_connected():
+        cursor.close()
+
+def _count_rows_exact_sync(table_name: str, timeout: float) -> int:
+    """统计单张表的精确行数，服务器端执行时间不超过timeout秒"""
+    with db_pool.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                f"SELECT /*+ MAX_EXECUTION_TIME({max(1, int(timeout * 1000))}) */ COUNT(*) "
+                f"FROM {_quote_identifier(table_name)}"
+            )
+            return cursor.fetchone()[0]
+        finally:
             cursor.close()
-            conn.close()
-            logger.debug("数据库连接已关闭")
+
+async def _count_rows_exact(table_names: List[str], timeout: float) -> Dict[str, int]:
+    """并发统计多张表的精确行数，在时间预算内完成的表才返回结果"""
+    if not table_names:
+        return {}
+    tasks = {
+        asyncio.ensure_future(db_executor.run(_count_rows_exact_sync, name, timeout)): name
+        for name in table_names
+    }
+    done, pending = await asyncio.wait(tasks, timeout=timeout)
+    for task in pending:
+        task.cancel()
+    counts = {}
+    for task in done:
+        if task.exception() is None:
+            counts[tasks[task]] = task.result()
+        else:
+            logger.warning(f"统计表 {tasks[task]} 的精确行数失败: {str(task.exception())}")
+    if pending:
+        logger.warning(f"{len(pending)} 张表的精确行数统计超出时间预算，使用估算值")
+    return counts
+
+def _fetch_sample_rows(conn, table_name: str, limit: int = 5) -> List[Dict[str, Any]]:
+    """获取表的前几行作为示例数据"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"SELECT * FROM {_quote_identifier(table_name)} LIMIT {int(limit)}")
+        return _convert_rows(cursor, cursor.fetchall())
+    finally:
+        cursor.close()
+
+def _collect_tables_info_sync(with_samples: bool = False) -> List[Dict[str, Any]]:
+    """在一个连接上批量收集所有表的结构、估算行数（以及示例数据）"""
+    with db_pool.connection() as conn:
+        tables = list(schema_cache.get(conn).values())
+        estimates = _estimate_table_rows(conn)
+        tables_info = []
+        for table in tables:
+            info = {
+                "name": table["name"],
+                "row_count": estimates.get(table["name"]) or 0,
+                "row_count_exact": False,
+                "structure": table["structure"]
+            }
+            if with_samples:
+                try:
+                    info["sample_data"] = _fetch_sample_rows(conn, table["name"])
+                except mysql.connector.errors.Error as e:
+                    if isinstance(e, (mysql.connector.errors.OperationalError, mysql.connector.errors.InterfaceError)):
+                        raise
+                    # 单个损坏的视图或无权限的表只影响它自己的示例数据，不使整个调用失败
+                    logger.warning(f"获取表 {table['name']} 的示例数据失败: {str(e)}")
+                    info["sample_data"] = []
+                    info["sample_error"] = str(e)
+            tables_info.append(info)
+        return tables_info
+
+async def _collect_tables_info(with_samples: bool, exact_counts: Union[bool, List[str]],
+                               count_timeout: Optional[float]) -> List[Dict[str, Any]]:
+    """收集表信息，并按需把指定表的估算行数替换为精确行数
+
+    参数相同的并发调用（如多个客户端同时调用get_tables）只执行一次。
+    """
+    if isinstance(exact_counts, list):
+        exact_counts = sorted(set(exact_counts))
+    key = f"tables_info:{with_samples}:{exact_counts}:{count_timeout}"
+    return await single_flight.do(
+        key, lambda: _collect_tables_info_once(with_samples, exact_counts, count_timeout)
+    )
+
+async def _collect_tables_info_once(with_samples: bool, exact_counts: Union[bool, List[str]],
+                                    count_timeout: Optional[float]) -> List[Dict[str, Any]]:
+    tables_info = await db_executor.run(_collect_tables_info_sync, with_samples)
+    if exact_counts is True:
+        exact_tables = [table["name"] for table in tables_info]
+    elif exact_counts:
+        exact_tables = [table["name"] for table in tables_info if table["name"] in set(exact_counts)]
+    else:
+        exact_tables = []
+    counts = await _count_rows_exact(exact_tables, count_timeout or EXACT_COUNT_TIMEOUT)
+    for table in tables_info:
+        if table["name"] in counts:
+            table["row_count"] = counts[table["name"]]
+            table["row_count_exact"] = True
+    return tables_info
 
 @server.tool()
-async def get_tables() -> Dict[str, Any]:
+async def get_tables(exact_counts: Union[bool, List[str]] = False, count_timeout: Optional[float] = None) -> Dict[str, Any]:
     """获取数据库中的所有表
     
+    Args:
+        exact_counts: 是否统计精确行数。默认False，使用information_schema中的估算行数（毫秒级）；
+            True表示所有表，也可以传入需要精确统计的表名列表
+        count_timeout: 精确统计的时间预算（秒），超时的表保留估算值
+    
     Returns:
-        表列表及其行数和结构
+        表列表及其行数和结构，row_count_exact为False的行数是估算值
     """
     try:
         logger.info("获取所有表信息")
-        # 执行查询获取所有表
-        tables_result = await execute_query("SHOW TABLES")
-        
-        if "error" in tables_result:
-            logger.error(f"获取表列表失败: {tables_result['error']}")
-            return tables_result
-            
-        tables = []
-        for table_row in tables_result["results"]:
-            table_name = list(table_row.values())[0]
-            logger.debug(f"处理表: {table_name}")
-            
-            # 获取表的行数
-            count_result = await execute_query(f"SELECT COUNT(*) as count FROM `{table_name}`")
-            row_count = 0
-            if "error" not in count_result and count_result["results"]:
-                row_count = count_result["results"][0]["count"]
-                
-            # 获取表结构
-            structure_result = await execute_query(f"DESCRIBE `{table_name}`")
-            structure = structure_result.get("results", []) if "error" not in structure_result else []
-            
-            try:
-                # 确保数据是可JSON序列化的
-                serializable_structure = json.loads(
-                    json.dumps(structure, default=json_serialize)
-                )
-                logger.debug(f"表 {table_name} 结构序列化成功")
-                    
-                tables.append({
-                    "name": table_name,
-                    "row_count": row_count,
-                    "structure": serializable_structure
-                })
-            except Exception as e:
-                logger.error(f"表 {table_name} 结构序列化失败: {str(e)}")
-                return {"error": f"表结构序列化失败: {str(e)}"}
-            
+        tables = await _collect_tables_info(False, exact_counts, count_timeout)
         logger.info(f"成功获取 {len(tables)} 个表的信息")
         return {
             "success": True,
@@ -175,20 +3244,37 @@ async def get_tables() -> Dict[str, Any]:
         return {"error": str(e)}
 
 @server.tool()
-async def visualize_data(query: str, x_column: str, y_column: str, chart_type: str = "bar") -> Dict[str, Any]:
+async def visualize_data(query: str, x_column: str, y_column: str, chart_type: str = "bar",
+                         max_points: Optional[int] = None, agg: str = "auto") -> Dict[str, Any]:
     """执行查询并可视化结果
     
+    结果行数超过数据点上限时自动聚合后再绘图：完整的结果在进程内聚合，超出单次查询返回上限的结果
+    在SQL中对全部数据聚合，不会因截断而只画出部分数据。时间列按合适的粒度分桶，数值列等宽分桶，
+    类别列按值分组；折线图再用LTTB降采样以保留峰谷形状，散点图按x、y两个方向分格并按格内行数缩放点的大小。
+    渲染好的图片按绘图数据的哈希缓存，数据未变化的重复请求不再重新渲染。
+    
     Args:
         query: SQL查询语句
         x_column: X轴列名
         y_column: Y轴列名
         chart_type: 图表类型 (bar, line, scatter, pie)
+        max_points: 数据点上限，默认柱状图100、折线图2000、散点图2500、饼图12
+        agg: 分桶时y值的聚合函数：sum、avg、min、max、count；默认auto（柱状图和饼图为sum，折线图为avg）
         
     Returns:
-        包含Base64编码图表的结果
+        包含Base64编码图表的结果，cached表示图片是否来自图表缓存；
+        发生聚合时附带aggregation，说明聚合方式、粒度、原始行数和绘制的点数
     """
+    if chart_type not in CHART_TYPES:
+        return {"error": f"不支持的图表类型: {chart_type}"}
+    if agg != "auto" and agg not in CHART_AGGREGATES:
+        return {"error": f"不支持的聚合函数: {agg}，可选值: auto, {', '.join(CHART_AGGREGATES)}"}
+    max_points = max(2, min(max_points or CHART_DEFAULT_MAX_POINTS[chart_type], MAX_RESULT_ROWS))
+    if agg == "auto":
+        agg = "sum" if chart_type in ("bar", "pie") else "avg"
     try:
         # 执行查询
+        cache_generation = chart_cache.generation()
         query_result = await execute_query(query)
         
         if "error" in query_result:
@@ -207,97 +3293,68 @@ async def visualize_data(query: str, x_column: str, y_column: str, chart_type: s
         if y_column not in df.columns:
             return {"error": f"列 '{y_column}' 不在结果中"}
             
-        # 创建图表
-        plt.figure(figsize=(10, 6))
-        
-        if chart_type == "bar":
-            plt.bar(df[x_column], df[y_column])
-            plt.title(f"{y_column} by {x_column}")
-        elif chart_type == "line":
-            plt.plot(df[x_column], df[y_column], marker='o')
-            plt.title(f"{y_column} vs {x_column}")
-        elif chart_type == "scatter":
-            plt.scatter(df[x_column], df[y_column])
-            plt.title(f"{y_column} vs {x_column} (Scatter)")
-        elif chart_type == "pie":
-            # 饼图需要正的值
-            if (df[y_column] < 0).any():
-                return {"error": "饼图不能包含负值"}
-                
-            plt.pie(df[y_column], labels=df[x_column], autopct='%1.1f%%')
-            plt.title(f"Distribution of {y_column}")
-        else:
-            return {"error": f"不支持的图表类型: {chart_type}"}
+        x_values, y_values = df[x_column].tolist(), df[y_column].tolist()
+        sizes = None
+        aggregation = None
+        if query_result.get("truncated") or len(df) > max_points:
+            x_kind = _value_kind(x_values)
+            if query_result.get("truncated"):
+                # 只取回了部分行，聚合需要在SQL中对全部数据进行
+                series = await _aggregate_chart_data(query, x_column, y_column, chart_type, x_kind, max_points, agg)
+            else:
+                series = _aggregate_chart_frame(df, x_column, y_column, chart_type, x_kind, max_points, agg)
+            if "error" in series:
+                return series
+            x_values, y_values, sizes, aggregation = series["x"], series["y"], series.get("sizes"), series["aggregation"]
+            logger.info(f"图表数据已聚合: {aggregation}")
             
-        plt.xlabel(x_column)
-        plt.ylabel(y_column)
-        plt.xticks(rotation=45)
-        plt.tight_layout()
-        
-        # 将图表转换为Base64字符串
-        buffer = io.BytesIO()
-        plt.savefig(buffer, format='png')
-        buffer.seek(0)
-        image_base64 = base64.b64encode(buffer.read()).decode('utf-8')
-        plt.close()
+        # 饼图需要正的值
+        if chart_type == "pie" and any(isinstance(value, (int, float)) and value < 0 for value in y_values):
+            return {"error": "饼图不能包含负值"}
+            
+        # 相同的绘图数据已渲染过时直接返回缓存的图片
+        cache_key = _chart_cache_key(x_values, y_values, sizes, x_column, y_column, chart_type)
+        cached = chart_cache.get(cache_key) if cache_key is not None else None
+        if cached is not None:
+            image_base64 = cached["chart_image"]
+        else:
+            # 在渲染进程池中绘图并编码为Base64字符串
+            image_base64 = await chart_renderer.render(x_values, y_values, x_column, y_column, chart_type, sizes)
+            if cache_key is not None:
+                tables = await db_executor.run(_referenced_tables, query)
+                if tables is not None:
+                    chart_cache.put(cache_key, {"chart_image": image_base64}, tables, cache_generation)
         
-        return {
+        result = {
             "success": True,
             "chart_type": chart_type,
             "x_column": x_column,
             "y_column": y_column,
-            "row_count": len(df),
-            "chart_image": image_base64
+            "row_count": len(x_values),
+            "chart_image": image_base64,
+            "cached": cached is not None
         }
+        if aggregation:
+            result["aggregation"] = aggregation
+        return result
     except Exception as e:
         logger.error(f"可视化数据失败: {str(e)}")
         return {"error": str(e)}
 
 @server.tool()
-async def show_tables_info() -> Dict[str, Any]:
+async def show_tables_info(exact_counts: Union[bool, List[str]] = False, count_timeout: Optional[float] = None) -> Dict[str, Any]:
     """获取数据库中的所有表及其结构信息
     
+    Args:
+        exact_counts: 是否统计精确行数，含义同get_tables
+        count_timeout: 精确统计的时间预算（秒）
+    
     Returns:
         包含所有表及其结构的字典
     """
     try:
         logger.info("获取数据库表结构信息")
-        
-        # 获取所有表
-        tables_result = await execute_query("SHOW TABLES")
-        if "error" in tables_result:
-            return tables_result
-            
-        tables_info = []
-        
-        for table_row in tables_result["results"]:
-            table_name = list(table_row.values())[0]
-            logger.info(f"获取表 {table_name} 的结构")
-            
-            # 获取表结构
-            structure_result = await execute_query(f"DESCRIBE `{table_name}`")
-            if "error" not in structure_result:
-                structure = structure_result.get("results", [])
-                
-                # 获取表行数
-                count_result = await execute_query(f"SELECT COUNT(*) as count FROM `{table_name}`")
-                row_count = 0
-                if "error" not in count_result and count_result.get("results"):
-                    row_count = count_result["results"][0]["count"]
-                
-                # 获取表前5条数据作为示例
-                sample_result = await execute_query(f"SELECT * FROM `{table_name}` LIMIT 5")
-                samples = []
-                if "error" not in sample_result:
-                    samples = sample_result.get("results", [])
-                
-                tables_info.append({
-                    "name": table_name,
-                    "row_count": row_count,
-                    "structure": structure,
-                    "sample_data": samples
-                })
-            
+        tables_info = await _collect_tables_info(True, exact_counts, count_timeout)
         return {
             "success": True,
             "database": DB_CONFIG["database"],
@@ -321,39 +3378,401 @@ async def get_table_columns(table_name: str) -> Dict[str, Any]:
     try:
         logger.info(f"获取表 {table_name} 的列信息")
         
-        # 检查表是否存在
-        tables_result = await execute_query("SHOW TABLES")
-        if "error" in tables_result:
-            return tables_result
-            
-        table_exists = False
-        for table_row in tables_result["results"]:
-            if table_name == list(table_row.values())[0]:
-                table_exists = True
-                break
-                
-        if not table_exists:
+        # 从表结构缓存中检查表是否存在并获取列信息
+        table = await db_executor.run(schema_cache.get_table, table_name)
+        if table is None:
             return {"error": f"表 '{table_name}' 不存在"}
             
-        # 获取表结构
-        structure_result = await execute_query(f"DESCRIBE `{table_name}`")
-        if "error" in structure_result:
-            return structure_result
-            
-        columns = structure_result.get("results", [])
+        columns = table["structure"]
         
         return {
             "success": True,
             "table": table_name,
             "columns_count": len(columns),
-            "columns": columns
+            "columns": columns,
+            "primary_key": table["primary_key"],
+            "indexes": table["indexes"]
         }
     except Exception as e:
         logger.error(f"获取表列信息失败: {str(e)}")
         return {"error": str(e)}
+
+# ======= 销售汇总表 =======
+
+SALES_ROLLUP_TABLE = "sales_daily_rollup"
+ROLLUP_STATE_TABLE = "rollup_state"
+
+_SALES_ROLLUP_DDL = [
+    f"""
+    CREATE TABLE IF NOT EXISTS `{SALES_ROLLUP_TABLE}` (
+      `sale_day` date NOT NULL,
+      `product_id` int NOT NULL,
+      `category` varchar(50) NOT NULL,
+      `salesperson` varchar(100) NOT NULL DEFAULT '',
+      `total_amount` decimal(16, 2) NOT NULL,
+      `total_quantity` bigint NOT NULL,
+      `sale_count` bigint NOT NULL,
+      `price_sum` decimal(20, 2) NOT NULL,
+      `unit_price_sum` decimal(24, 6) NOT NULL,
+      `unit_price_count` bigint NOT NULL,
+      PRIMARY KEY (`sale_day`, `product_id`, `salesperson`),
+      INDEX `idx_rollup_category_day`(`category`, `sale_day`)
+    ) ENGINE = InnoDB CHARACTER SET = utf8mb4 COLLATE = utf8mb4_general_ci
+    """,
+    f"""
+    CREATE TABLE IF NOT EXISTS `{ROLLUP_STATE_TABLE}` (
+      `name` varchar(64) NOT NULL,
+      `high_water_mark` bigint NOT NULL DEFAULT 0,
+      `refreshed_at` datetime NULL DEFAULT NULL,
+      `write_version` bigint NOT NULL DEFAULT 0,
+      `rebuilt_version` bigint NOT NULL DEFAULT 0,
+      PRIMARY KEY (`name`)
+    ) ENGINE = InnoDB CHARACTER SET = utf8mb4 COLLATE = utf8mb4_general_ci
+    """
+]
+
+# 早于过期标记的rollup_state表需要补上的列：write_version在每次增量刷新无法覆盖的写操作后递增，
+# rebuilt_version为最近一次完整重建时看到的write_version，前者更大即汇总表已过期
+_ROLLUP_STATE_COLUMNS = [
+    ("write_version", "ADD COLUMN `write_version` bigint NOT NULL DEFAULT 0"),
+    ("rebuilt_version", "ADD COLUMN `rebuilt_version` bigint NOT NULL DEFAULT 0")
+]
+
+# 把(low, high]区间内的新销售记录按 天 × 产品 × 销售员 聚合后合并进汇总表；
+# price_sum与unit_price_sum/unit_price_count用于还原原查询中的AVG(p.price)和AVG(单价)
+_SALES_ROLLUP_MERGE = f"""
+INSERT INTO `{SALES_ROLLUP_TABLE}`
+    (sale_day, product_id, category, salesperson, total_amount, total_quantity,
+     sale_count, price_sum, unit_price_sum, unit_price_count)
+SELECT * FROM (
+    SELECT
+        s.sale_date AS sale_day,
+        s.product_id,
+        p.category,
+        COALESCE(s.salesperson, '') AS salesperson,
+        SUM(s.total_price) AS total_amount,
+        SUM(s.quantity) AS total_quantity,
+        COUNT(*) AS sale_count,
+        SUM(p.price) AS price_sum,
+        COALESCE(SUM(s.total_price / s.quantity), 0) AS unit_price_sum,
+        COUNT(s.total_price / s.quantity) AS unit_price_count
+    FROM sales s
+    JOIN products p ON p.product_id = s.product_id
+    WHERE s.sale_id > %s AND s.sale_id <= %s
+    GROUP BY s.sale_date, s.product_id, p.category, COALESCE(s.salesperson, '')
+) AS delta
+ON DUPLICATE KEY UPDATE
+    total_amount = `{SALES_ROLLUP_TABLE}`.total_amount + delta.total_amount,
+    total_quantity = `{SALES_ROLLUP_TABLE}`.total_quantity + delta.total_quantity,
+    sale_count = `{SALES_ROLLUP_TABLE}`.sale_count + delta.sale_count,
+    price_sum = `{SALES_ROLLUP_TABLE}`.price_sum + delta.price_sum,
+    unit_price_sum = `{SALES_ROLLUP_TABLE}`.unit_price_sum + delta.unit_price_sum,
+    unit_price_count = `{SALES_ROLLUP_TABLE}`.unit_price_count + delta.unit_price_count
+"""
+
+class SalesRollup:
+    """按天 × 产品 × 销售员 物化的销售汇总表
+
+    以sales.sale_id为高水位增量刷新：每次只聚合高水位之后新增的销售记录并合并进汇总表，
+    分析工具因此只需扫描汇总表，耗时不再随sales表增长。
+    高水位无法反映对已有销售记录的UPDATE/DELETE（以及产品类别的修改），
+    经由本服务执行的此类写操作会在rollup_state中把汇总表标记为过期，分析工具随即改回查询原表，
+    直到调用refresh_sales_rollup(full_rebuild=True)重建。过期标记保存在数据库中，
+    服务重启或多个进程共用汇总表时同样生效。
+    """
+
+    name = "sales_daily"
+
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._tables_ready = False
+        # 最近一次从rollup_state读到（或本进程写入）的过期状态
+        self._stale = False
+        # 过期标记未能写入数据库时置位，在本进程完成一次完整重建之前不使用汇总表
+        self._unrecorded_write = False
+        self._stats = {
+            "refreshes": 0,
+            "full_rebuilds": 0,
+            "rows_merged": 0,
+            "high_water_mark": None
+        }
+
+    def _ensure_tables(self, conn):
+        if self._tables_ready:
+            return
+        cursor = conn.cursor()
+        try:
+            for ddl in _SALES_ROLLUP_DDL:
+                cursor.execute(ddl)
+            cursor.execute(
+                "SELECT COLUMN_NAME FROM information_schema.COLUMNS "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+                (ROLLUP_STATE_TABLE,)
+            )
+            existing = {_text(row[0]).lower() for row in cursor.fetchall()}
+            missing = [clause for name, clause in _ROLLUP_STATE_COLUMNS if name not in existing]
+            if missing:
+                cursor.execute(f"ALTER TABLE `{ROLLUP_STATE_TABLE}` " + ", ".join(missing))
+        finally:
+            cursor.close()
+        schema_cache.invalidate()
+        self._tables_ready = True
+
+    def refresh_sync(self, full_rebuild: bool = False, handle: Optional[QueryHandle] = None) -> Dict[str, Any]:
+        """增量刷新（或完整重建）汇总表，返回刷新统计及汇总表是否过期
+
+        完整重建把rebuilt_version设为锁住状态行时读到的write_version。重建开始后才提交的写操作，
+        其过期标记要等重建提交、释放行锁后才能写入，因而一定晚于重建，汇总表仍会被判为过期。
+        """
+        start = time.monotonic()
+        conn = db_pool.acquire()
+        if handle is not None and not handle.attach(conn):
+            db_pool.release(conn)
+            raise RuntimeError("汇总表刷新已取消")
+        discard = False
+        try:
+            self._ensure_tables(conn)
+            cursor = conn.cursor()
+            try:
+                conn.start_transaction()
+                # 锁住状态行，多个进程同时刷新时串行执行，避免重复合并同一批记录
+                cursor.execute(
+                    f"INSERT IGNORE INTO `{ROLLUP_STATE_TABLE}` (name, high_water_mark) VALUES (%s, 0)",
+                    (self.name,)
+                )
+                cursor.execute(
+                    f"SELECT high_water_mark, write_version, rebuilt_version FROM `{ROLLUP_STATE_TABLE}` "
+                    "WHERE name = %s FOR UPDATE",
+                    (self.name,)
+                )
+                high_water_mark, write_version, rebuilt_version = cursor.fetchall()[0]
+                if full_rebuild:
+                    high_water_mark = 0
+                    rebuilt_version = write_version
+                    cursor.execute(f"DELETE FROM `{SALES_ROLLUP_TABLE}`")
+                cursor.execute("SELECT COALESCE(MAX(sale_id), 0) FROM sales")
+                new_mark = cursor.fetchall()[0][0]
+
+                merged = 0
+                if new_mark > high_water_mark or full_rebuild:
+                    cursor.execute(_SALES_ROLLUP_MERGE, (high_water_mark, new_mark))
+                    merged = cursor.rowcount
+                    cursor.execute(
+                        f"UPDATE `{ROLLUP_STATE_TABLE}` SET high_water_mark = %s, rebuilt_version = %s, "
+                        "refreshed_at = NOW() WHERE name = %s",
+                        (new_mark, rebuilt_version, self.name)
+                    )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+        except (mysql.connector.errors.OperationalError, mysql.connector.errors.InterfaceError):
+            discard = True
+            raise
+        finally:
+            if handle is not None:
+                handle.detach()
+                # 被KILL QUERY终止的连接可能残留中断标记，不再复用
+                discard = discard or handle.killed
+            db_pool.release(conn, discard=discard)
+
+        if merged:
+            result_cache.invalidate_tables([SALES_ROLLUP_TABLE])
+        stale = write_version > rebuilt_version
+        with self._lock:
+            self._stats["refreshes"] += 1
+            self._stats["rows_merged"] += max(merged, 0)
+            self._stats["high_water_mark"] = new_mark
+            self._stale = stale
+            if full_rebuild:
+                self._stats["full_rebuilds"] += 1
+                self._unrecorded_write = False
+            stale = stale or self._unrecorded_write
+        elapsed = time.monotonic() - start
+        logger.info(f"销售汇总表刷新完成: 高水位 {high_water_mark} -> {new_mark}, 耗时 {elapsed:.3f}秒")
+        return {
+            "full_rebuild": full_rebuild,
+            "previous_high_water_mark": high_water_mark,
+            "high_water_mark": new_mark,
+            "merged_rows": merged,
+            "stale": stale,
+            "elapsed_seconds": round(elapsed, 3)
+        }
+
+    def _record_write(self, conn):
+        """在rollup_state中递增write_version，把汇总表标记为过期"""
+        self._ensure_tables(conn)
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                f"INSERT INTO `{ROLLUP_STATE_TABLE}` (name, high_water_mark, write_version) VALUES (%s, 0, 1) "
+                "ON DUPLICATE KEY UPDATE write_version = write_version + 1",
+                (self.name,)
+            )
+        finally:
+            cursor.close()
+
+    def note_write(self, tables: Optional[List[str]], statement: str, conn=None):
+        """记录一次写操作；高水位无法覆盖的修改会使汇总表过期
+
+        在写操作提交后调用，conn为执行写操作的连接（已处于autocommit状态），为None时从连接池借用。
+        """
+        if not self.enabled:
+            return
+        touched = {"sales", "products"} if tables is None else set(tables) & {"sales", "products"}
+        if not touched:
+            return
+        # 新增销售记录由高水位增量刷新覆盖，新增产品不影响已有汇总
+        if statement.lstrip().upper().startswith("INSERT"):
+            return
+        with self._lock:
+            if not self._stale:
+                logger.warning("sales/products表发生了增量刷新无法覆盖的修改，汇总表已标记为过期，需要完整重建")
+            self._stale = True
+        try:
+            if conn is not None:
+                self._record_write(conn)
+            else:
+                with db_pool.connection() as pooled:
+                    self._record_write(pooled)
+        except Exception as e:
+            logger.error(f"写入汇总表过期标记失败，本进程在完整重建前不再使用汇总表: {str(e)}")
+            with self._lock:
+                self._unrecorded_write = True
+
+    async def ensure_fresh(self) -> bool:
+        """分析工具调用前先做一次增量刷新，并按rollup_state中的过期标记判断汇总表是否可用"""
+        if not self.enabled:
+            return False
+        try:
+            # 并发的分析请求共享同一次刷新
+            result = await single_flight.do(
+                "sales_rollup_refresh",
+                lambda: db_executor.run_cancellable(self.refresh_sync, timeout=_tool_timeout("refresh_sales_rollup"))
+            )
+            return not result["stale"]
+        except Exception as e:
+            logger.warning(f"刷新销售汇总表失败，改为查询原表: {str(e)}")
+            return False
+
+    def stats(self) -> Dict[str, Any]:
+        """返回汇总表的刷新统计"""
+        with self._lock:
+            return dict(self._stats, enabled=self.enabled, stale=self._stale or self._unrecorded_write)
+
+
+sales_rollup = SalesRollup(SALES_ROLLUP_ENABLED)
+
+@server.tool()
+async def refresh_sales_rollup(full_rebuild: bool = False) -> Dict[str, Any]:
+    """刷新销售汇总表（分析工具使用的按天物化汇总）
     
+    Args:
+        full_rebuild: 是否完整重建。默认只合并高水位之后的新销售记录；
+            修改或删除过已有销售记录、修改过产品类别后需要完整重建
+        
+    Returns:
+        刷新前后的高水位、合并的行数、耗时，以及汇总表是否仍处于过期状态（stale）
+    """
+    try:
+        logger.info(f"刷新销售汇总表，完整重建: {full_rebuild}")
+        result = await db_executor.run_cancellable(
+            sales_rollup.refresh_sync, full_rebuild, timeout=_tool_timeout("refresh_sales_rollup")
+        )
+        return dict(success=True, **result)
+    except Exception as e:
+        logger.error(f"刷新销售汇总表失败: {str(e)}")
+        return {"error": str(e)}
+
+# ======= 日期范围过滤 =======
+
+# 销售表上支持按日期范围分析的索引：名称 -> 列
+SALES_DATE_INDEXES = {
+    "idx_sales_sale_date": ["sale_date"],
+    "idx_sales_customer_date": ["customer_name", "sale_date"]
+}
+
+def _parse_date_range(start_date: Optional[str], end_date: Optional[str]):
+    """解析YYYY-MM-DD格式的起止日期（均包含在内），返回(start, end)，格式错误时抛出ValueError"""
+    start = date.fromisoformat(start_date) if start_date else None
+    end = date.fromisoformat(end_date) if end_date else None
+    if start and end and start > end:
+        raise ValueError(f"开始日期 {start_date} 晚于结束日期 {end_date}")
+    return start, end
+
+def _date_range_conditions(column: str, start: Optional[date], end: Optional[date]):
+    """生成日期列上的范围条件及其绑定参数
+
+    条件直接作用于列本身（不包裹DATE()等函数），结束日期用"小于次日"表示，
+    这样无论列是date还是datetime都能走sale_date上的索引做范围扫描。
+
+    Returns:
+        (以%s为占位符的条件列表, 参数列表)
+    """
+    conditions, params = [], []
+    if start:
+        conditions.append(f"{column} >= %s")
+        params.append(start.isoformat())
+    if end:
+        conditions.append(f"{column} < %s")
+        params.append((end + timedelta(days=1)).isoformat())
+    return conditions, params
+
+def _where(conditions: List[str]) -> str:
+    """把条件列表拼成WHERE子句，没有条件时返回空字符串"""
+    return f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+def _date_range_info(start: Optional[date], end: Optional[date]) -> Dict[str, Optional[str]]:
+    """返回结果中附带的日期范围说明"""
+    return {
+        "start_date": start.isoformat() if start else None,
+        "end_date": end.isoformat() if end else None
+    }
+
+def _ensure_sales_indexes_sync() -> Dict[str, Any]:
+    """为sales表补建按日期分析所需的索引，已存在（按列前缀匹配）的索引会跳过"""
+    with db_pool.connection() as conn:
+        table = schema_cache.get_table("sales", conn)
+        if table is None:
+            return {"error": "表 'sales' 不存在"}
+
+        existing = [index["columns"] for index in table["indexes"]]
+        created, skipped = [], []
+        cursor = conn.cursor()
+        try:
+            for name, columns in SALES_DATE_INDEXES.items():
+                if any(cols[:len(columns)] == columns for cols in existing):
+                    skipped.append(name)
+                    continue
+                column_list = ", ".join(_quote_identifier(c) for c in columns)
+                logger.info(f"在sales表上创建索引 {name}({column_list})")
+                cursor.execute(f"ALTER TABLE `sales` ADD INDEX {_quote_identifier(name)} ({column_list})")
+                created.append(name)
+        finally:
+            cursor.close()
+            if created:
+                schema_cache.invalidate()
+
+    return {"success": True, "created": created, "skipped": skipped}
+
+@server.tool()
+async def ensure_sales_indexes() -> Dict[str, Any]:
+    """为sales表创建日期范围分析所需的索引
     
+    创建 (sale_date) 与 (customer_name, sale_date) 两个索引，
+    使带start_date/end_date的销售趋势、热门产品和客户分析可以走索引范围扫描。
     
+    Returns:
+        新创建的索引和已存在而跳过的索引
+    """
+    try:
+        return await db_executor.run(_ensure_sales_indexes_sync)
+    except Exception as e:
+        logger.error(f"创建销售索引失败: {str(e)}")
+        return {"error": str(e)}
 
 @server.tool()
 async def analyze_category_sales() -> Dict[str, Any]:
@@ -365,20 +3784,35 @@ async def analyze_category_sales() -> Dict[str, Any]:
     try:
         logger.info("分析各产品类别的销售情况")
         
-        query = """
-        SELECT 
-            p.category,
-            SUM(s.total_price) AS total_sales_amount,
-            SUM(s.quantity) AS total_sales_quantity,
-            AVG(p.price) AS average_price,
-            COUNT(DISTINCT s.sale_id) AS transaction_count
-        FROM products p
-        JOIN sales s ON p.product_id = s.product_id
-        GROUP BY p.category
-        ORDER BY total_sales_amount DESC
-        """
+        use_rollup = await sales_rollup.ensure_fresh()
+        if use_rollup:
+            # 从汇总表计算，结果与下面直接查询原表一致
+            query = f"""
+            SELECT 
+                category,
+                SUM(total_amount) AS total_sales_amount,
+                SUM(total_quantity) AS total_sales_quantity,
+                SUM(price_sum) / SUM(sale_count) AS average_price,
+                CAST(SUM(sale_count) AS SIGNED) AS transaction_count
+            FROM `{SALES_ROLLUP_TABLE}`
+            GROUP BY category
+            ORDER BY total_sales_amount DESC
+            """
+        else:
+            query = """
+            SELECT 
+                p.category,
+                SUM(s.total_price) AS total_sales_amount,
+                SUM(s.quantity) AS total_sales_quantity,
+                AVG(p.price) AS average_price,
+                COUNT(DISTINCT s.sale_id) AS transaction_count
+            FROM products p
+            JOIN sales s ON p.product_id = s.product_id
+            GROUP BY p.category
+            ORDER BY total_sales_amount DESC
+            """
         
-        result = await execute_query(query)
+        result = await execute_query(query, timeout=_tool_timeout("analyze_category_sales"))
         
         if "error" in result:
             return result
@@ -386,6 +3820,7 @@ async def analyze_category_sales() -> Dict[str, Any]:
         return {
             "success": True,
             "analysis_type": "category_sales",
+            "data_source": SALES_ROLLUP_TABLE if use_rollup else "sales",
             "results": result.get("results", []),
             "description": "按产品类别统计的销售数据"
         }
@@ -394,11 +3829,13 @@ async def analyze_category_sales() -> Dict[str, Any]:
         return {"error": str(e)}
 
 @server.tool()
-async def get_top_products(limit: int = 10) -> Dict[str, Any]:
+async def get_top_products(limit: int = 10, start_date: str = None, end_date: str = None) -> Dict[str, Any]:
     """获取销售量最高的产品
     
     Args:
         limit: 要返回的产品数量
+        start_date: 开始日期（YYYY-MM-DD，包含），不提供则不限制
+        end_date: 结束日期（YYYY-MM-DD，包含），不提供则不限制
         
     Returns:
         销售量最高的产品列表
@@ -406,6 +3843,10 @@ async def get_top_products(limit: int = 10) -> Dict[str, Any]:
     try:
         logger.info(f"获取销售量最高的{limit}个产品")
         
+        start, end = _parse_date_range(start_date, end_date)
+        conditions, params = _date_range_conditions("s.sale_date", start, end)
+        
+        # 参数以预处理语句绑定，不同的limit和日期范围共用同一条已准备好的语句
         query = f"""
         SELECT 
             p.product_id,
@@ -417,12 +3858,13 @@ async def get_top_products(limit: int = 10) -> Dict[str, Any]:
             COUNT(DISTINCT s.sale_id) AS sale_count
         FROM products p
         JOIN sales s ON p.product_id = s.product_id
+        {_where(conditions)}
         GROUP BY p.product_id, p.product_name, p.category, p.price
         ORDER BY total_quantity_sold DESC
-        LIMIT {limit}
+        LIMIT %s
         """
         
-        result = await execute_query(query)
+        result = await execute_query(query, params=params + [int(limit)], timeout=_tool_timeout("get_top_products"))
         
         if "error" in result:
             return result
@@ -431,6 +3873,7 @@ async def get_top_products(limit: int = 10) -> Dict[str, Any]:
             "success": True,
             "analysis_type": "top_products",
             "limit": limit,
+            **_date_range_info(start, end),
             "results": result.get("results", []),
             "description": f"销售量最高的{limit}个产品"
         }
@@ -439,11 +3882,13 @@ async def get_top_products(limit: int = 10) -> Dict[str, Any]:
         return {"error": str(e)}
 
 @server.tool()
-async def analyze_sales_trend(group_by: str = 'month') -> Dict[str, Any]:
+async def analyze_sales_trend(group_by: str = 'month', start_date: str = None, end_date: str = None) -> Dict[str, Any]:
     """分析销售趋势
     
     Args:
         group_by: 分组类型，可选值有: 'day', 'week', 'month', 'year'
+        start_date: 开始日期（YYYY-MM-DD，包含），不提供则从最早的记录开始
+        end_date: 结束日期（YYYY-MM-DD，包含），不提供则到最新的记录为止
         
     Returns:
         按时间段统计的销售数据
@@ -462,20 +3907,41 @@ async def analyze_sales_trend(group_by: str = 'month') -> Dict[str, Any]:
         if group_by not in time_format:
             return {"error": f"不支持的分组类型: {group_by}，支持的类型有: 'day', 'week', 'month', 'year'"}
             
-        query = f"""
-        SELECT 
-            DATE_FORMAT(s.sale_date, '{time_format[group_by]}') AS time_period,
-            SUM(s.total_price) AS total_sales,
-            SUM(s.quantity) AS total_quantity,
-            COUNT(DISTINCT s.sale_id) AS order_count,
-            COUNT(DISTINCT s.product_id) AS product_count,
-            AVG(s.total_price / s.quantity) AS average_unit_price
-        FROM sales s
-        GROUP BY time_period
-        ORDER BY time_period
-        """
+        start, end = _parse_date_range(start_date, end_date)
+        
+        use_rollup = await sales_rollup.ensure_fresh()
+        conditions, params = _date_range_conditions("r.sale_day" if use_rollup else "s.sale_date", start, end)
+        if use_rollup:
+            # 汇总表按天聚合，行数远小于sales，在其上按时间段分组
+            query = f"""
+            SELECT 
+                DATE_FORMAT(r.sale_day, '{time_format[group_by]}') AS time_period,
+                SUM(r.total_amount) AS total_sales,
+                SUM(r.total_quantity) AS total_quantity,
+                CAST(SUM(r.sale_count) AS SIGNED) AS order_count,
+                COUNT(DISTINCT r.product_id) AS product_count,
+                SUM(r.unit_price_sum) / NULLIF(SUM(r.unit_price_count), 0) AS average_unit_price
+            FROM `{SALES_ROLLUP_TABLE}` r
+            {_where(conditions)}
+            GROUP BY time_period
+            ORDER BY time_period
+            """
+        else:
+            query = f"""
+            SELECT 
+                DATE_FORMAT(s.sale_date, '{time_format[group_by]}') AS time_period,
+                SUM(s.total_price) AS total_sales,
+                SUM(s.quantity) AS total_quantity,
+                COUNT(DISTINCT s.sale_id) AS order_count,
+                COUNT(DISTINCT s.product_id) AS product_count,
+                AVG(s.total_price / s.quantity) AS average_unit_price
+            FROM sales s
+            {_where(conditions)}
+            GROUP BY time_period
+            ORDER BY time_period
+            """
         
-        result = await execute_query(query)
+        result = await execute_query(query, params=params, timeout=_tool_timeout("analyze_sales_trend"))
         
         if "error" in result:
             return result
@@ -484,6 +3950,8 @@ async def analyze_sales_trend(group_by: str = 'month') -> Dict[str, Any]:
             "success": True,
             "analysis_type": "sales_trend",
             "group_by": group_by,
+            **_date_range_info(start, end),
+            "data_source": SALES_ROLLUP_TABLE if use_rollup else "sales",
             "results": result.get("results", []),
             "description": f"按{group_by}分析的销售趋势"
         }
@@ -504,7 +3972,7 @@ async def find_low_stock_products(threshold: int = 10) -> Dict[str, Any]:
     try:
         logger.info(f"查找库存低于{threshold}的产品")
         
-        query = f"""
+        query = """
         SELECT 
             p.product_id,
             p.product_name,
@@ -514,11 +3982,11 @@ async def find_low_stock_products(threshold: int = 10) -> Dict[str, Any]:
             (SELECT SUM(quantity) FROM sales s WHERE s.product_id = p.product_id) AS total_sold,
             p.created_at
         FROM products p
-        WHERE p.stock_quantity < {threshold}
+        WHERE p.stock_quantity < %s
         ORDER BY p.stock_quantity ASC
         """
         
-        result = await execute_query(query)
+        result = await execute_query(query, params=[int(threshold)], timeout=_tool_timeout("find_low_stock_products"))
         
         if "error" in result:
             return result
@@ -535,48 +4003,71 @@ async def find_low_stock_products(threshold: int = 10) -> Dict[str, Any]:
         return {"error": str(e)}
 
 @server.tool()
-async def analyze_customer_purchases(customer_name: str = None) -> Dict[str, Any]:
+async def analyze_customer_purchases(customer_name: str = None, start_date: str = None, end_date: str = None,
+                                     limit: int = 100, offset: int = 0, details_limit: int = 100) -> Dict[str, Any]:
     """分析客户购买记录
     
     Args:
         customer_name: 客户名称，如果不提供则分析所有客户
+        start_date: 开始日期（YYYY-MM-DD，包含），不提供则不限制
+        end_date: 结束日期（YYYY-MM-DD，包含），不提供则不限制
+        limit: 分析所有客户时每页返回的客户数（按消费总额从高到低）
+        offset: 分析所有客户时跳过的客户数，用于翻页
+        details_limit: 分析指定客户时最多返回的购买明细条数（按日期从新到旧）
         
     Returns:
         客户购买记录分析
     """
+    # limit为0时每页都为空且next_offset不前进，按next_offset翻页的调用方会陷入死循环
+    if limit < 1:
+        return {"error": "limit必须大于0"}
+    if offset < 0:
+        return {"error": "offset不能为负数"}
+    if details_limit < 0:
+        return {"error": "details_limit不能为负数"}
     try:
         logger.info(f"分析{'特定客户' if customer_name else '所有客户'}的购买记录")
         
+        start, end = _parse_date_range(start_date, end_date)
+        date_conditions, date_params = _date_range_conditions("s.sale_date", start, end)
+        date_filter = "".join(f" AND {c}" for c in date_conditions)
+        timeout = _tool_timeout("analyze_customer_purchases")
+        
         # 构建基本查询
         if customer_name:
-            # 分析指定客户的购买记录
+            # 分析指定客户的购买记录；客户名作为绑定参数传入，不拼接进SQL。
+            # 该客户的销售记录只按(customer_name, sale_date)索引读取一次，
+            # 最常购买的产品由窗口函数在同一遍扫描中算出，不再对每行执行相关子查询
             query = f"""
             SELECT 
-                s.customer_name,
-                COUNT(DISTINCT s.sale_id) AS total_orders,
-                SUM(s.quantity) AS total_items_purchased,
-                SUM(s.total_price) AS total_spent,
-                AVG(s.total_price) AS average_order_value,
-                MIN(s.sale_date) AS first_purchase_date,
-                MAX(s.sale_date) AS last_purchase_date,
-                DATEDIFF(MAX(s.sale_date), MIN(s.sale_date)) AS customer_lifespan_days,
-                GROUP_CONCAT(DISTINCT p.category ORDER BY p.category SEPARATOR ', ') AS purchased_categories,
-                (
-                    SELECT p2.product_name 
-                    FROM sales s2 
-                    JOIN products p2 ON s2.product_id = p2.product_id 
-                    WHERE s2.customer_name = s.customer_name 
-                    GROUP BY p2.product_id 
-                    ORDER BY SUM(s2.quantity) DESC 
-                    LIMIT 1
-                ) AS favorite_product
-            FROM sales s
-            JOIN products p ON s.product_id = p.product_id
-            WHERE s.customer_name = '{customer_name}'
-            GROUP BY s.customer_name
+                customer_name,
+                COUNT(DISTINCT sale_id) AS total_orders,
+                SUM(quantity) AS total_items_purchased,
+                SUM(total_price) AS total_spent,
+                AVG(total_price) AS average_order_value,
+                MIN(sale_date) AS first_purchase_date,
+                MAX(sale_date) AS last_purchase_date,
+                DATEDIFF(MAX(sale_date), MIN(sale_date)) AS customer_lifespan_days,
+                GROUP_CONCAT(DISTINCT category ORDER BY category SEPARATOR ', ') AS purchased_categories,
+                MAX(favorite_product) AS favorite_product
+            FROM (
+                SELECT 
+                    ps.*,
+                    FIRST_VALUE(product_name) OVER (ORDER BY product_quantity DESC, product_id) AS favorite_product
+                FROM (
+                    SELECT 
+                        s.customer_name, s.sale_id, s.product_id, s.quantity, s.total_price, s.sale_date,
+                        p.product_name, p.category,
+                        SUM(s.quantity) OVER (PARTITION BY s.product_id) AS product_quantity
+                    FROM sales s
+                    JOIN products p ON s.product_id = p.product_id
+                    WHERE s.customer_name = %s{date_filter}
+                ) AS ps
+            ) AS cs
+            GROUP BY customer_name
             """
             
-            # 获取该客户的购买详情
+            # 获取该客户的购买详情，多取一行用于判断是否还有更多
             details_query = f"""
             SELECT 
                 s.sale_id,
@@ -588,27 +4079,36 @@ async def analyze_customer_purchases(customer_name: str = None) -> Dict[str, Any
                 s.salesperson
             FROM sales s
             JOIN products p ON s.product_id = p.product_id
-            WHERE s.customer_name = '{customer_name}'
-            ORDER BY s.sale_date DESC
+            WHERE s.customer_name = %s{date_filter}
+            ORDER BY s.sale_date DESC, s.sale_id DESC
+            LIMIT %s
             """
             
-            result = await execute_query(query)
-            details_result = await execute_query(details_query)
+            # 汇总与明细互不依赖，在两个连接上并发执行
+            result, details_result = await asyncio.gather(
+                execute_query(query, params=[customer_name] + date_params, timeout=timeout),
+                execute_query(details_query, params=[customer_name] + date_params + [int(details_limit) + 1], timeout=timeout)
+            )
             
             if "error" in result:
                 return result
+            if "error" in details_result:
+                return details_result
                 
+            details = details_result.get("results", [])
             return {
                 "success": True,
                 "analysis_type": "customer_purchases",
                 "customer_name": customer_name,
+                **_date_range_info(start, end),
                 "summary": result.get("results", []),
-                "purchase_details": details_result.get("results", []),
+                "purchase_details": details[:details_limit],
+                "details_truncated": len(details) > details_limit,
                 "description": f"客户'{customer_name}'的购买记录分析"
             }
         else:
-            # 分析所有客户
-            query = """
+            # 分析所有客户，按消费总额分页返回；多取一行用于判断是否还有下一页
+            query = f"""
             SELECT 
                 s.customer_name,
                 COUNT(DISTINCT s.sale_id) AS total_orders,
@@ -618,26 +4118,59 @@ async def analyze_customer_purchases(customer_name: str = None) -> Dict[str, Any
                 MIN(s.sale_date) AS first_purchase_date,
                 MAX(s.sale_date) AS last_purchase_date
             FROM sales s
-            WHERE s.customer_name IS NOT NULL
+            WHERE s.customer_name IS NOT NULL{date_filter}
             GROUP BY s.customer_name
-            ORDER BY total_spent DESC
+            ORDER BY total_spent DESC, s.customer_name
+            LIMIT %s OFFSET %s
             """
             
-            result = await execute_query(query)
+            result = await execute_query(query, params=date_params + [int(limit) + 1, int(offset)], timeout=timeout)
             
             if "error" in result:
                 return result
                 
+            customers = result.get("results", [])
+            has_more = len(customers) > limit
             return {
                 "success": True,
                 "analysis_type": "all_customers_purchases",
-                "results": result.get("results", []),
+                **_date_range_info(start, end),
+                "limit": limit,
+                "offset": offset,
+                "has_more": has_more,
+                "next_offset": offset + limit if has_more else None,
+                "results": customers[:limit],
                 "description": "所有客户的购买记录分析"
             }
     except Exception as e:
         logger.error(f"分析客户购买记录失败: {str(e)}")
         return {"error": str(e)}
 
+@server.tool()
+async def get_server_metrics() -> Dict[str, Any]:
+    """获取服务器运行指标
+
+    Returns:
+        连接池、执行层并发、各类缓存、预处理语句缓存命中率以及图表渲染进程池的统计信息
+    """
+    try:
+        return {
+            "success": True,
+            "connection_pool": db_pool.stats(),
+            "executor": db_executor.stats(),
+            "schema_cache": schema_cache.stats(),
+            "result_cache": result_cache.stats(),
+            "chart_cache": chart_cache.stats(),
+            "single_flight": single_flight.stats(),
+            "statement_cache": statement_cache.stats(),
+            "query_guard": query_guard.stats(),
+            "sales_rollup": sales_rollup.stats(),
+            "chart_renderer": chart_renderer.stats()
+        }
+    except Exception as e:
+        logger.error(f"获取服务器指标失败: {str(e)}")
+        return {"error": str(e)}
+
 # ======= 提示模板 =======
 
 @server.prompt()
@@ -680,11 +4213,11 @@ def data_analysis_report() -> str:
 async def get_table_schema(table: str) -> str:
     """获取表结构"""
     try:
-        structure_result = await execute_query(f"DESCRIBE `{table}`")
-        if "error" in structure_result:
-            return f"Error: {structure_result['error']}"
+        table_info = await db_executor.run(schema_cache.get_table, table)
+        if table_info is None:
+            return f"Error: 表 '{table}' 不存在"
             
-        structure = structure_result.get("results", [])
+        structure = table_info["structure"]
         return json.dumps(structure, default=json_serialize, indent=2)
     except Exception as e:
         return f"Error: {str(e)}"
@@ -743,6 +4276,8 @@ async def get_database_info() -> str:
 if __name__ == "__main__":
     logger.info("启动MySQL数据库MCP服务器...")
     logger.info(f"数据库配置: {DB_CONFIG}")
+    logger.info(f"连接池配置: {POOL_CONFIG}")
+    logger.info(f"执行层配置: {EXECUTOR_CONFIG}")
     logger.info("使用stdio传输方式")
     
     try:
@@ -750,4 +4285,8 @@ if __name__ == "__main__":
     
     except Exception as e:
         logger.error(f"服务器运行失败: {str(e)}")
-        sys.exit(1) 
\ No newline at end of file
+        sys.exit(1)
+    finally:
+        db_executor.shutdown()
+        chart_renderer.shutdown()
+        db_pool.close() 
\ No newline at end of file
@@ -15,6 +15,8 @@ from mcp.server.fastmcp import FastMCP
 from mcp.server.stdio import stdio_server
 from mcp.types import CallToolResult
 
+import excel_io
+
 # server = FastMCP(name="mysql-server", description="MySQL数据库交互服务器")
 
 # 创建MCP服务器实例
@@ -216,6 +218,48 @@ async def query_excel_data(file_path: str, sheet_name: Optional[Union[str, int]]
             "file_path": file_path
         }
 
+@mcp.tool(description="推断Excel工作表导入MySQL时的表结构")
+async def infer_excel_schema(file_path: str, sheet_name: Optional[Union[str, int]] = 0, sample_rows: int = 10000,
+                             table_name: Optional[str] = None) -> Dict[str, Any]:
+    """
+    流式读取工作表的前若干行，推断每列对应的MySQL类型，并生成建表语句
+
+    推断规则与MySQL服务器的load_excel_to_table工具一致，可在导入前预览或调整表结构
+
+    Args:
+        file_path: Excel文件的路径
+        sheet_name: 工作表名称或索引，默认为第一个工作表
+        sample_rows: 用于推断类型的行数
+        table_name: 建表语句中使用的表名，默认使用工作表名称
+
+    Returns:
+        包含列类型和建表语句的字典
+    """
+    try:
+        with excel_io.SheetReader(file_path, sheet_name) as reader:
+            sample = []
+            for chunk in reader.chunks(min(sample_rows, 1000)):
+                sample.extend(chunk)
+                if len(sample) >= sample_rows:
+                    break
+            columns = excel_io.infer_column_types(reader.columns, sample[:sample_rows])
+            return {
+                "success": True,
+                "file_path": file_path,
+                "sheet_name": reader.sheet_name,
+                "sample_rows": min(len(sample), sample_rows),
+                "columns": columns,
+                "create_table_sql": excel_io.create_table_sql(
+                    table_name or str(reader.sheet_name), columns
+                )
+            }
+    except Exception as e:
+        return {
+            "error": str(e),
+            "file_path": file_path,
+            "exception_type": type(e).__name__
+        }
+
 @mcp.resource("excel://{file_path}")
 async def excel_resource(file_path: str) -> Tuple[str, str]:
     """
@@ -31,6 +31,8 @@ CREATE TABLE `sales`  (
   `salesperson` varchar(100) CHARACTER SET utf8mb4 COLLATE utf8mb4_general_ci NULL DEFAULT NULL,
   PRIMARY KEY (`sale_id`) USING BTREE,
   INDEX `product_id`(`product_id` ASC) USING BTREE,
+  INDEX `idx_sales_sale_date`(`sale_date` ASC) USING BTREE,
+  INDEX `idx_sales_customer_date`(`customer_name` ASC, `sale_date` ASC) USING BTREE,
   CONSTRAINT `sales_ibfk_1` FOREIGN KEY (`product_id`) REFERENCES `products` (`product_id`) ON DELETE RESTRICT ON UPDATE RESTRICT
 ) ENGINE = InnoDB AUTO_INCREMENT = 31 CHARACTER SET = utf8mb4 COLLATE = utf8mb4_general_ci ROW_FORMAT = Dynamic;
 